@@ -11,15 +11,30 @@ from livekit.agents import (
     metrics,
 )
 from livekit.agents.pipeline import VoicePipelineAgent
-from livekit.plugins import cartesia, deepgram, silero, turn_detector
-from livekit.plugins.openai import stt, llm
+
+from call_events import CallEvents
+from context_budget import groq_compactor
+from loop_monitor import LoopMonitor
+from model_router import routed_groq
+from providers import Pipeline
+from stt_upload import compact_stt
+from audio_ring import SharedVAD
+from barge_in import BargeIn
+from clause_tts import clause_tts
+from call_trace import CallTrace
 
 
 load_dotenv(dotenv_path=".env.local")
 logger = logging.getLogger("voice-agent")
 
+PIPELINE = Pipeline(
+    stt="groq",
+    stt_options={"model": "whisper-large-v3-turbo", "language": "en"},
+    tts="cartesia",
+).from_env().load()
+
 def prewarm(proc: JobProcess):
-    proc.userdata["vad"] = silero.VAD.load()
+    proc.userdata["vad"] = PIPELINE.make_vad()
 
 
 async def entrypoint(ctx: JobContext):
@@ -84,23 +99,34 @@ async def entrypoint(ctx: JobContext):
         ),
     )
 
+    trace = CallTrace(ctx.room.name, agent="inbound-agent").attach(ctx)
     logger.info(f"connecting to room {ctx.room.name}")
-    await ctx.connect(auto_subscribe=AutoSubscribe.AUDIO_ONLY)
+    with trace.span("connect"):
+        await ctx.connect(auto_subscribe=AutoSubscribe.AUDIO_ONLY)
 
     # Wait for the first participant to connect
-    participant = await ctx.wait_for_participant()
+    with trace.span("wait_for_participant"):
+        participant = await ctx.wait_for_participant()
     logger.info(f"starting voice assistant for participant {participant.identity}")
 
+    call_events = CallEvents(call_id=ctx.room.name, phone=participant.identity, agent="inbound-agent")
+    call_events.started()
+    ctx.add_shutdown_callback(call_events.finish)
+
     # This project is configured to use Deepgram STT, OpenAI LLM and Cartesia TTS plugins
     # Other great providers exist like Cerebras, ElevenLabs, Groq, Play.ht, Rime, and more
     # Learn more and pick the best one for your app:
     # https://docs.livekit.io/agents/plugins
+    # the long system prompt plus full history would otherwise be re-sent every turn
+    compactor = groq_compactor()
+    vad = SharedVAD(ctx.proc.userdata["vad"])
     agent = VoicePipelineAgent(
-        vad=ctx.proc.userdata["vad"],
-        stt=stt.STT.with_groq(model="whisper-large-v3-turbo", language="en"),
-        llm=llm.LLM.with_groq(model="llama3-8b-8192", temperature=0.8,),
-        tts=cartesia.TTS(),
-        turn_detector=turn_detector.EOUModel(),
+        vad=vad,
+        stt=compact_stt(PIPELINE, vad, ctx),
+        llm=routed_groq(temperature=0.8),
+        tts=clause_tts(PIPELINE.make_tts()),
+        turn_detector=PIPELINE.make_turn_detector(),
+        before_llm_cb=compactor.before_llm,
         # minimum delay for endpointing, used when turn detector believes the user is done with their turn
         min_endpointing_delay=0.5,
         # maximum delay for endpointing, used when turn detector does not believe the user is done with their turn
@@ -108,6 +134,10 @@ async def entrypoint(ctx: JobContext):
         chat_ctx=initial_ctx,
     )
 
+    compactor.attach(agent, ctx)
+    LoopMonitor(ctx.room.name).attach(agent, ctx)
+    BargeIn(agent, vad).attach(ctx)
+    trace.watch(agent)
     usage_collector = metrics.UsageCollector()
 
     @agent.on("metrics_collected")
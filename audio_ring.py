@@ -0,0 +1,394 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from typing import Callable, Optional
+
+import numpy as np
+from livekit import rtc
+from livekit.agents import vad
+
+
+logger = logging.getLogger("audio-ring")
+
+# caller audio kept per participant; a consumer further behind than this loses audio
+RING_SECONDS = float(os.getenv("AUDIO_RING_SECONDS", "30"))
+# silero counts samples at its model rate
+SILERO_SAMPLE_RATE = 16000
+
+
+class Overrun(Exception):
+    """The requested samples have already been overwritten"""
+
+
+class AudioRing:
+    """
+    Preallocated ring of mono int16 samples. Every sample is stored twice,
+    at i and i + capacity, so any span of up to `capacity` samples is one
+    contiguous slice: readers get NumPy views, never copies. Positions are
+    absolute sample counts since the ring was created.
+    """
+
+    def __init__(self, sample_rate: int, seconds: float = RING_SECONDS):
+        self.sample_rate = sample_rate
+        self.capacity = int(sample_rate * seconds)
+        self._buf = np.zeros(2 * self.capacity, dtype=np.int16)
+        self.written = 0
+        self._resampled: dict[int, tuple[rtc.AudioResampler, AudioRing]] = {}
+
+    def write(self, samples: np.ndarray):
+        # only the newest `capacity` samples of a long write survive it
+        skipped = max(0, len(samples) - self.capacity)
+        samples = samples[skipped:]
+        n = len(samples)
+        self.written += skipped
+        pos = self.written % self.capacity
+        first = min(n, self.capacity - pos)
+        for offset in (0, self.capacity):
+            self._buf[offset + pos:offset + pos + first] = samples[:first]
+            self._buf[offset:offset + n - first] = samples[first:]
+        self.written += n
+
+    def write_frame(self, frame: rtc.AudioFrame):
+        samples = np.frombuffer(frame.data, dtype=np.int16)
+        if frame.num_channels > 1:
+            samples = samples.reshape(-1, frame.num_channels).mean(axis=1).astype(np.int16)
+            frame = rtc.AudioFrame(samples.tobytes(), frame.sample_rate, 1, len(samples))
+        self.write(samples)
+        for resampler, ring in self._resampled.values():
+            for resampled in resampler.push(frame):
+                ring.write_frame(resampled)
+
+    def view(self, start: int, end: int) -> np.ndarray:
+        """Samples [start, end) as a read-only view; valid until they are overwritten"""
+        if start < self.written - self.capacity or end > self.written or start > end:
+            raise Overrun(f"samples {start}-{end} not in ring ({self.written - self.capacity}-{self.written})")
+        view = self._buf[start % self.capacity:start % self.capacity + end - start]
+        view.flags.writeable = False
+        return view
+
+    def valid(self, start: int) -> bool:
+        return start >= self.written - self.capacity
+
+    def cursor(self) -> "Cursor":
+        """A reader starting at the current write position"""
+        return Cursor(self, self.written)
+
+    def at_rate(self, sample_rate: int) -> "AudioRing":
+        """The same audio at another rate, resampled once on write however many readers it has"""
+        if sample_rate == self.sample_rate:
+            return self
+        if sample_rate not in self._resampled:
+            resampler = rtc.AudioResampler(self.sample_rate, sample_rate, num_channels=1)
+            self._resampled[sample_rate] = (resampler, AudioRing(sample_rate, self.capacity / self.sample_rate))
+        return self._resampled[sample_rate][1]
+
+
+class Cursor:
+    """One consumer's read position in an AudioRing"""
+
+    def __init__(self, ring: AudioRing, position: int):
+        self.ring = ring
+        self.position = position
+        self.overruns = 0
+
+    @property
+    def available(self) -> int:
+        return self.ring.written - self.position
+
+    def read(self, max_samples: Optional[int] = None) -> np.ndarray:
+        """Unread samples as a view; a reader that fell behind skips to the oldest sample kept"""
+        if not self.ring.valid(self.position):
+            self.overruns += 1
+            self.position = self.ring.written - self.ring.capacity
+        end = self.ring.written if max_samples is None else min(self.ring.written, self.position + max_samples)
+        view = self.ring.view(self.position, end)
+        self.position = end
+        return view
+
+
+class _VADTap:
+    """One consumer's stream on a SharedVAD; pushes are deduplicated there, events fanned out here"""
+
+    def __init__(self, shared: "SharedVAD"):
+        self._shared = shared
+        # frames pushed through this tap, counted from the shared stream's position when it was opened
+        self.pushed = shared.frames
+        self._queue: asyncio.Queue[Optional[vad.VADEvent]] = asyncio.Queue()
+        self._input_ended = False
+        self._closed = False
+
+    def push_frame(self, frame: rtc.AudioFrame):
+        self._shared._push(self, frame)
+
+    def flush(self):
+        self._shared._stream.flush()
+
+    def end_input(self):
+        self._input_ended = True
+        self._shared._maybe_end_input()
+
+    async def aclose(self):
+        if not self._closed:
+            self._closed = True
+            await self._shared._release(self)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> vad.VADEvent:
+        event = await self._queue.get()
+        if event is None:
+            raise StopAsyncIteration
+        return event
+
+
+class SharedVAD(vad.VAD):
+    """
+    One VAD inference per participant. The pipeline opens a VAD stream for
+    turn-taking and the STT StreamAdapter opens another for endpointing, and
+    both are pushed the same frames; without this, silero runs twice on every
+    window. Here each frame is written once to an AudioRing and inferred
+    once, and every stream gets all events. END_OF_SPEECH audio can be read
+    back from the ring as a view with `utterance()`.
+    """
+
+    def __init__(self, inner: vad.VAD, *, seconds: float = RING_SECONDS):
+        super().__init__(capabilities=inner.capabilities)
+        self.inner = inner
+        self.seconds = seconds
+        self.ring: Optional[AudioRing] = None
+        self.frames = 0
+        # perf_counter time at which the newest frame was written
+        self.written_at = 0.0
+        self._stream: Optional[vad.VADStream] = None
+        self._fan_out_task: Optional[asyncio.Task] = None
+        self._taps: set[_VADTap] = set()
+        self._listeners: list[Callable[[vad.VADEvent], None]] = []
+        inner.on("metrics_collected", self._forward_metrics)
+
+    def _forward_metrics(self, *args, **kwargs):
+        self.emit("metrics_collected", *args, **kwargs)
+
+    def stream(self) -> _VADTap:
+        if self._stream is None:
+            self._stream = self.inner.stream()
+            self._fan_out_task = asyncio.create_task(self._fan_out(self._stream))
+        tap = _VADTap(self)
+        self._taps.add(tap)
+        return tap
+
+    def add_listener(self, listener: Callable[[vad.VADEvent], None]):
+        """Called with every event as soon as it is inferred, before any stream sees it"""
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[vad.VADEvent], None]):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def _push(self, tap: _VADTap, frame: rtc.AudioFrame):
+        # every stream is pushed the same frames, each from its own task and possibly several behind
+        # the others; a frame is new only when it takes the furthest-ahead stream past what was written
+        tap.pushed += 1
+        if tap.pushed <= self.frames:
+            return
+        if self.ring is None:
+            self.ring = AudioRing(frame.sample_rate, self.seconds)
+        self.ring.write_frame(frame)
+        self.written_at = time.perf_counter()
+        self.frames += 1
+        self._stream.push_frame(frame)
+
+    def _maybe_end_input(self):
+        if self._stream is not None and all(tap._input_ended for tap in self._taps):
+            self._stream.end_input()
+
+    async def _fan_out(self, stream: vad.VADStream):
+        try:
+            async for event in stream:
+                for listener in self._listeners:
+                    try:
+                        listener(event)
+                    except Exception:
+                        logger.exception("VAD listener failed")
+                for tap in self._taps:
+                    tap._queue.put_nowait(event)
+        finally:
+            for tap in self._taps:
+                tap._queue.put_nowait(None)
+
+    async def _release(self, tap: _VADTap):
+        self._taps.discard(tap)
+        if self._taps or self._stream is None:
+            return
+        stream, task = self._stream, self._fan_out_task
+        self._stream = self._fan_out_task = None
+        await stream.aclose()
+        task.cancel()
+        self.inner.off("metrics_collected", self._forward_metrics)
+
+    def arrival_time(self, position: float) -> Optional[float]:
+        """When the caller audio `position` seconds into the stream arrived, assuming it arrives in real time"""
+        if self.ring is None:
+            return None
+        return self.written_at - (self.ring.written / self.ring.sample_rate - position)
+
+    def speech_start(self, position: float, lookback: float = 0.3) -> float:
+        """
+        The VAD reports speech a few windows after it starts. Walks back from
+        `position` (seconds into the stream) through the 10ms blocks still
+        above the noise floor of the audio before them, to where the caller's
+        level rose.
+        """
+        ring = self.ring
+        if ring is None:
+            return position
+        block = ring.sample_rate // 100
+        end = min(int(position * ring.sample_rate), ring.written)
+        blocks = (end - max(0, ring.written - ring.capacity, end - int(lookback * 2 * ring.sample_rate))) // block
+        if blocks < 4:
+            return position
+        audio = ring.view(end - blocks * block, end).astype(np.float32).reshape(blocks, block)
+        level = np.sqrt((audio * audio).mean(axis=1))
+        # the quieter half of the window is taken as the floor; 100 is well under any speech
+        floor = max(100.0, 4 * float(np.percentile(level, 10)))
+        rising = 0
+        while rising < min(blocks - 1, int(lookback * 100)) and level[blocks - 1 - rising] > floor:
+            rising += 1
+        return position - rising * block / ring.sample_rate
+
+    def utterance(self, event: vad.VADEvent) -> Optional[np.ndarray]:
+        """The END_OF_SPEECH event's audio as a view into the ring, or None if it cannot be located"""
+        ring = self.ring
+        if ring is None or ring.sample_rate != SILERO_SAMPLE_RATE or not event.frames:
+            return None
+        frame = event.frames[0]
+        end = event.samples_index
+        start = end - frame.samples_per_channel
+        if not ring.valid(start) or end > ring.written:
+            return None
+        view = ring.view(start, end)
+        # silero stops buffering at max_buffered_speech, after which its buffer is no longer the tail
+        edge = np.frombuffer(frame.data, dtype=np.int16)
+        if len(view) and (view[0] != edge[0] or view[-1] != edge[-1]):
+            return None
+        return view
+
+
+# formants (Hz) of a few vowels, for test audio
+_VOWELS = ((730, 1090, 2440), (270, 2290, 3010), (300, 870, 2240), (530, 1840, 2480), (570, 840, 2410), (660, 1720, 2410))
+
+
+def _voiced(seconds: float, rate: int = SILERO_SAMPLE_RATE, seed: int = 0) -> np.ndarray:
+    """Speech-like test audio: 200ms syllables of a fricative onset and a formant-shaped vowel, 2.6s phrases"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * rate)) / rate
+    syllable = (t // 0.2).astype(int)
+    within = (t % 0.2) / 0.2
+    formants = np.array(_VOWELS)[rng.integers(0, len(_VOWELS), syllable.max() + 1)][syllable]
+    f0 = (140 + 25 * np.sin(2 * np.pi * 0.5 * t)) * np.clip(1 + 0.01 * rng.standard_normal(len(t)), 0.97, 1.03)
+    phase = 2 * np.pi * np.cumsum(f0 / rate)
+    vowel = np.zeros_like(t)
+    for k in range(1, 40):
+        vowel += sum(1 / (1 + ((k * f0 - formants[:, j]) / (60 + 40 * j)) ** 2) for j in range(3)) / k**0.7 * np.sin(k * phase)
+    vowel *= np.clip((within - 0.2) / 0.1, 0, 1) * np.clip((1 - within) / 0.15, 0, 1) / np.abs(vowel).max()
+    fricative = np.diff(rng.standard_normal(len(t)), prepend=0.0) * (within < 0.2) * np.clip(within / 0.05, 0, 1) * 0.09
+    x = (vowel + fricative) * ((t % 4.0) < 2.6)
+    return (x / np.abs(x).max() * 14000 + rng.normal(0, 40, len(t))).astype(np.int16)
+
+
+async def _simulate_call(silero_vad: vad.VAD, audio: np.ndarray, shared: bool, trace: bool = False, burst: int = 4) -> dict:
+    """
+    Drives the VAD and STT streams the way the pipeline's HumanInput does:
+    10ms frames from a 16kHz AudioStream pushed to both, `burst` at a time
+    as after any loop lag, so the STT's forwarding task runs behind. The STT
+    is a batch STT behind stt_upload's StreamAdapter with the request
+    stubbed out. With
+    `trace`, the bytes allocated are estimated from the tracemalloc peak of
+    each frame's step (a lower bound; tracing distorts the CPU time).
+    """
+    import tracemalloc
+
+    from livekit.agents import stt
+
+    from stt_upload import CompactUploadSTT, TrimmingVAD
+
+    class _Transcriptions:
+        async def create(self, **kwargs):
+            return type("Response", (), {"text": "ok", "language": "en"})()
+
+    class _BatchSTT:
+        _client = type("Client", (), {"audio": type("Audio", (), {"transcriptions": _Transcriptions()})()})()
+        _opts = type("Options", (), {"model": "whisper"})()
+
+        def _sanitize_options(self, *, language=None):
+            return type("Config", (), {"language": language or "en"})()
+
+    vad_ = SharedVAD(silero_vad) if shared else silero_vad
+    trimming = TrimmingVAD(vad_)
+    adapter = stt.StreamAdapter(stt=CompactUploadSTT(_BatchSTT(), provider="bench", trimming=trimming), vad=trimming)
+    vad_stream, stt_stream = vad_.stream(), adapter.stream()
+    counts = {"vad_events": 0, "stt_events": 0}
+
+    async def drain(stream, key):
+        async for _ in stream:
+            counts[key] += 1
+
+    consumers = [asyncio.create_task(drain(vad_stream, "vad_events")), asyncio.create_task(drain(stt_stream, "stt_events"))]
+    frame_samples = SILERO_SAMPLE_RATE // 100
+    allocated = 0
+    if trace:
+        tracemalloc.start()
+    cpu, wall = time.process_time(), time.perf_counter()
+    for i in range(0, len(audio) - frame_samples + 1, frame_samples):
+        if trace:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        frame = rtc.AudioFrame(audio[i:i + frame_samples].tobytes(), SILERO_SAMPLE_RATE, 1, frame_samples)
+        stt_stream.push_frame(frame)
+        vad_stream.push_frame(frame)
+        if i // frame_samples % burst == burst - 1:
+            await asyncio.sleep(0)
+        if trace:
+            allocated += tracemalloc.get_traced_memory()[1] - before
+    stt_stream.end_input()
+    vad_stream.end_input()
+    await asyncio.gather(*consumers)
+    cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+    if trace:
+        tracemalloc.stop()
+    await stt_stream.aclose()
+    await vad_stream.aclose()
+    seconds = len(audio) / SILERO_SAMPLE_RATE
+    return {
+        "cpu_ms_per_audio_s": cpu * 1000 / seconds,
+        "wall_s": wall,
+        "allocated_kb_per_audio_s": allocated / 1024 / seconds,
+        "ring_s": vad_.ring.written / SILERO_SAMPLE_RATE if shared else seconds,
+        **counts,
+    }
+
+
+async def _bench(seconds: float):
+    from livekit.plugins import silero
+
+    silero_vad = silero.VAD.load()
+    audio = _voiced(seconds)
+    await _simulate_call(silero_vad, _voiced(4), shared=False)  # warm up onnxruntime
+    print(f"{seconds:.0f}s of caller audio, 10ms frames at 16kHz")
+    print("path      cpu ms/audio s  allocated KB/audio s  vad events  stt events  audio written s")
+    for label, shared in (("current", False), ("shared", True)):
+        r = await _simulate_call(silero_vad, audio, shared)
+        traced = await _simulate_call(silero_vad, audio, shared, trace=True)
+        print(f"{label:9s} {r['cpu_ms_per_audio_s']:14.1f} {traced['allocated_kb_per_audio_s']:21.1f} {r['vad_events']:11d} {r['stt_events']:11d} {r['ring_s']:16.1f}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="CPU and allocations per call: separate VAD streams vs one shared ring and inference")
+    parser.add_argument("--seconds", type=float, default=60)
+    args = parser.parse_args()
+    asyncio.run(_bench(args.seconds))
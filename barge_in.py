@@ -0,0 +1,413 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
+
+from livekit import rtc
+from livekit.agents import llm, vad
+
+from audio_ring import SILERO_SAMPLE_RATE, SharedVAD
+from runtime_reports import RUNTIME_DIR, ReportLog, quantile
+
+
+logger = logging.getLogger("barge-in")
+
+BARGE_IN_DIR = os.path.join(RUNTIME_DIR, "barge_in")
+REPORTS = ReportLog(BARGE_IN_DIR)
+
+ENABLED = os.getenv("BARGE_IN", "on") != "off"
+# agent audio allowed in the source queue ahead of the speaker; a pause holds it back and a resume replays it
+PLAYOUT_LEAD_MS = float(os.getenv("BARGE_IN_PLAYOUT_LEAD_MS", "200"))
+# silence after which a pause that did not become an interruption (a cough, "mm-hm") resumes
+RESUME_SILENCE_MS = float(os.getenv("BARGE_IN_RESUME_SILENCE_MS", "150"))
+# caller speech onset to agent silence
+TARGET_MS = 150
+# silero infers on 512-sample windows at 16kHz
+_WINDOW_SECONDS = 0.032
+
+
+def _seconds(frame: rtc.AudioFrame) -> float:
+    return frame.samples_per_channel / frame.sample_rate
+
+
+class _GatedSource:
+    """
+    The agent's AudioSource behind a gate. Frames are only let into the
+    source queue PLAYOUT_LEAD_MS ahead of the speaker; the rest waits
+    upstream in the TTS stream. A pause clears the queue but keeps what was
+    in it, and resuming plays that again first, so a false alarm costs the
+    caller a gap rather than part of the sentence.
+    """
+
+    def __init__(self, inner, lead_ms: float = PLAYOUT_LEAD_MS):
+        self._inner = inner
+        self._lead = lead_ms / 1000
+        self._open = asyncio.Event()
+        self._open.set()
+        # frames captured recently enough that they may still be queued
+        self._recent: deque = deque()
+        self._recent_seconds = 0.0
+        self._held: list = []
+        self._replay: Optional[asyncio.Task] = None
+        self.replayed_seconds = 0.0
+
+    def __getattr__(self, name):
+        return getattr(self._inner, name)
+
+    @property
+    def paused(self) -> bool:
+        return not self._open.is_set()
+
+    async def capture_frame(self, frame):
+        while True:
+            await self._open.wait()
+            if self._replay is not None:
+                await self._replay
+                self._replay = None
+                continue
+            excess = self._inner.queued_duration - self._lead
+            if excess <= 0:
+                break
+            await asyncio.sleep(excess)
+        await self._capture(frame)
+
+    async def _capture(self, frame):
+        await self._inner.capture_frame(frame)
+        self._recent.append(frame)
+        self._recent_seconds += _seconds(frame)
+        # the queue never holds more than the lead and one frame, so anything older has played
+        while self._recent_seconds - _seconds(self._recent[0]) > self._lead + _seconds(frame):
+            self._recent_seconds -= _seconds(self._recent.popleft())
+
+    def pause(self):
+        self._open.clear()
+        queued = self._inner.queued_duration
+        self._inner.clear_queue()
+        held: list = []
+        while self._recent and queued > 0:
+            frame = self._recent.pop()
+            seconds = _seconds(frame)
+            if seconds > queued:
+                # only the end of this frame was still queued
+                samples = int(queued * frame.sample_rate)
+                data = bytes(frame.data)[-samples * frame.num_channels * 2:] if samples else b""
+                frame = rtc.AudioFrame(data, frame.sample_rate, frame.num_channels, samples)
+            if frame.samples_per_channel:
+                held.append(frame)
+            queued -= seconds
+        self._recent.clear()
+        self._recent_seconds = 0.0
+        self._held = held[::-1] + self._held
+
+    def resume(self):
+        if self._held and self._replay is None:
+            self._replay = asyncio.create_task(self._replay_held())
+        self._open.set()
+
+    def discard(self):
+        """Drops the held audio, for a speech that was interrupted or has ended"""
+        self._held = []
+
+    async def _replay_held(self):
+        while self._held:
+            frame = self._held.pop(0)
+            self.replayed_seconds += _seconds(frame)
+            await self._capture(frame)
+
+
+@dataclass
+class _Pause:
+    speech: object
+    onset: float
+    played_text: str
+
+
+class BargeIn:
+    """
+    Silences the agent as soon as the caller starts talking over it, instead
+    of after VoicePipelineAgent's interrupt_speech_duration of speech. On
+    the first VAD window above the activation threshold the queued agent
+    audio is cleared and held back, and playout paused. If the pipeline then
+    interrupts the speech, the LLM stream behind it is closed and the
+    committed assistant message is cut back to what was heard before the
+    pause. If the caller goes quiet without interrupting, playout resumes
+    from the held audio.
+    """
+
+    def __init__(self, agent, vad_: SharedVAD, *, enabled: bool = ENABLED, lead_ms: float = PLAYOUT_LEAD_MS, resume_silence_ms: float = RESUME_SILENCE_MS):
+        self._agent = agent
+        self._vad = vad_
+        self.enabled = enabled
+        self._lead_ms = lead_ms
+        self._resume_silence = resume_silence_ms / 1000
+        self._threshold = getattr(getattr(vad_.inner, "_opts", None), "activation_threshold", 0.5)
+        self._source: Optional[_GatedSource] = None
+        self._pause: Optional[_Pause] = None
+        # what the caller heard of the last interrupted speech, until the pipeline commits it
+        self._heard: Optional[str] = None
+        self._speaking = False
+        self.latencies_ms: list[float] = []
+        self.false_alarms = 0
+        self.interruptions = 0
+        self.llm_cancelled = 0
+        self.chars_dropped = 0
+
+    def attach(self, job_ctx=None) -> "BargeIn":
+        if not self.enabled:
+            return self
+        self._agent.on("agent_started_speaking", self._on_started_speaking)
+        self._agent.on("agent_stopped_speaking", self._on_stopped_speaking)
+        self._agent.on("agent_speech_interrupted", self._on_speech_interrupted)
+        self._vad.add_listener(self._on_vad_event)
+        if job_ctx is not None:
+
+            async def report():
+                if not self.latencies_ms:
+                    return
+                data = {"call_id": job_ctx.room.name, "ts": time.time(), **self.report()}
+                logger.info(f"barge-in: {data}")
+                await asyncio.to_thread(REPORTS.write, os.getenv("AGENT_WORKER_ID", "dev"), data)
+
+            job_ctx.add_shutdown_callback(report)
+        return self
+
+    def _on_started_speaking(self):
+        self._speaking = True
+        if self._source is None:
+            # the playout emits this right before capturing its first frame, so the gate is in place for it
+            playout = self._agent._agent_output._agent_playout
+            self._source = playout._audio_source = _GatedSource(playout._audio_source, self._lead_ms)
+        self._source.resume()
+
+    def _on_stopped_speaking(self):
+        self._speaking = False
+        if self._source is not None:
+            self._source.discard()
+            self._source.resume()
+        self._pause = None
+
+    def _on_vad_event(self, event: vad.VADEvent):
+        if self._pause is None:
+            # START_OF_SPEECH only comes after min_speech_duration above the threshold
+            if event.type == vad.VADEventType.START_OF_SPEECH or (
+                event.type == vad.VADEventType.INFERENCE_DONE and event.probability >= self._threshold
+            ):
+                self._maybe_pause(event)
+        elif self._pause.speech.interrupted:
+            self._confirm()
+        elif event.type == vad.VADEventType.END_OF_SPEECH or event.raw_accumulated_silence >= self._resume_silence:
+            self.false_alarms += 1
+            self._pause = None
+            self._source.resume()
+
+    def _maybe_pause(self, event: vad.VADEvent):
+        speech = self._agent._playing_speech
+        if not self._speaking or self._source is None or self._pause is not None:
+            return
+        if speech is None or not speech.allow_interruptions or speech.interrupted:
+            return
+        # the onset's position in the caller's audio, placed on the clock by when that audio arrived,
+        # so the VAD's detection, queueing and inference delay are all counted
+        speech_seconds = event.speech_duration or event.raw_accumulated_speech + _WINDOW_SECONDS
+        position = self._vad.speech_start(event.samples_index / SILERO_SAMPLE_RATE - speech_seconds)
+        onset = self._vad.arrival_time(position)
+        try:
+            played_text = speech.synthesis_handle.tts_forwarder.played_text
+        except AttributeError:
+            played_text = ""
+        self._source.pause()
+        silenced = time.perf_counter()
+        if onset is None:
+            onset = silenced - speech_seconds
+        self._pause = _Pause(speech, onset, played_text)
+        self.latencies_ms.append((silenced - onset) * 1000)
+
+    def _confirm(self):
+        pause, self._pause = self._pause, None
+        self._source.discard()
+        self._heard = pause.played_text
+        self.interruptions += 1
+        # the pipeline stops reading the reply on interruption but leaves the request streaming
+        if isinstance(pause.speech.source, llm.LLMStream):
+            asyncio.create_task(pause.speech.source.aclose())
+            self.llm_cancelled += 1
+
+    def _on_speech_interrupted(self, msg: llm.ChatMessage):
+        heard, self._heard = self._heard, None
+        if heard is None or not isinstance(msg.content, str):
+            return
+        # the pipeline commits what its transcript clock says was played, which kept running while paused
+        heard = heard.rstrip()
+        if not msg.content.startswith(heard) or len(msg.content) <= len(heard) + 3:
+            return
+        self.chars_dropped += len(msg.content) - len(heard) - 3
+        msg.content = heard + "..."
+
+    def report(self) -> dict:
+        return {
+            "latency_ms": [round(ms, 1) for ms in self.latencies_ms],
+            "false_alarms": self.false_alarms,
+            "interruptions": self.interruptions,
+            "llm_cancelled": self.llm_cancelled,
+            "chars_dropped": self.chars_dropped,
+        }
+
+
+def summarize(reports: list[dict]) -> dict:
+    latencies = [ms for r in reports for ms in r["latency_ms"]]
+    return {
+        "calls": len(reports),
+        "barge_ins": len(latencies),
+        "p50_ms": quantile(latencies, 0.5),
+        "p95_ms": quantile(latencies, 0.95),
+        "under_target": sum(ms <= TARGET_MS for ms in latencies) / len(latencies) if latencies else 0.0,
+        **{key: sum(r[key] for r in reports) for key in ("false_alarms", "interruptions", "llm_cancelled", "chars_dropped")},
+    }
+
+
+async def _trial(silero_vad: vad.VAD, caller, controlled: bool) -> dict:
+    """
+    One barge-in against the real playout path: the agent plays 6s of audio
+    through AgentPlayout into an rtc.AudioSource while caller audio is fed
+    to the VAD in real time. The pipeline's own rule interrupts after
+    interrupt_speech_duration; with `controlled`, BargeIn runs as well.
+    Silence is the moment the source queue is cleared.
+    """
+    import numpy as np
+    from livekit import rtc
+    from livekit.agents import utils
+    from livekit.agents.pipeline.agent_playout import AgentPlayout
+
+
+    class _Forwarder:
+        played_text = ""
+
+        def segment_playout_started(self):
+            pass
+
+        def segment_playout_finished(self):
+            pass
+
+        async def aclose(self):
+            pass
+
+    class _Speech:
+        allow_interruptions, interrupted, source, synthesis_handle = True, False, None, None
+
+    class _Agent(utils.EventEmitter):
+        pass
+
+    source = rtc.AudioSource(24000, 1)
+    silenced: list[float] = []
+    clear_queue = source.clear_queue
+    source.clear_queue = lambda: (silenced.append(time.perf_counter()), clear_queue())
+    playout = AgentPlayout(audio_source=source)
+    agent = _Agent()
+    agent._agent_output = type("Output", (), {"_agent_playout": playout})()
+    agent._playing_speech = speech = _Speech()
+    playout.on("playout_started", lambda: agent.emit("agent_started_speaking"))
+    playout.on("playout_stopped", lambda interrupted: agent.emit("agent_stopped_speaking"))
+
+    shared = SharedVAD(silero_vad)
+    controller = BargeIn(agent, shared, enabled=True).attach() if controlled else None
+    vad_stream = shared.stream()
+
+    async def agent_audio():
+        tone = (np.sin(2 * np.pi * 200 * np.arange(480) / 24000) * 6000).astype(np.int16).tobytes()
+        for _ in range(300):
+            yield rtc.AudioFrame(tone, 24000, 1, 480)
+
+    handle = playout.play("bench", agent_audio(), _Forwarder())
+
+    async def pipeline_rule():
+        async for event in vad_stream:
+            if event.type == vad.VADEventType.INFERENCE_DONE and event.speech_duration >= 0.5 and not speech.interrupted:
+                speech.interrupted = True
+                handle.interrupt()
+
+    rule = asyncio.create_task(pipeline_rule())
+    frame_samples = SILERO_SAMPLE_RATE // 100
+    started = time.perf_counter()
+    for i in range(0, len(caller) - frame_samples + 1, frame_samples):
+        await asyncio.sleep(max(0.0, started + i / SILERO_SAMPLE_RATE - time.perf_counter()))
+        vad_stream.push_frame(rtc.AudioFrame(caller[i:i + frame_samples].tobytes(), SILERO_SAMPLE_RATE, 1, frame_samples))
+    vad_stream.end_input()
+    await rule
+    handle.interrupt()
+    await handle.join()
+    await vad_stream.aclose()
+    await source.aclose()
+    onset = started + np.argmax(np.abs(caller) > 1000) / SILERO_SAMPLE_RATE
+    return {
+        "silence_ms": (silenced[0] - onset) * 1000 if silenced and silenced[0] < started + len(caller) / SILERO_SAMPLE_RATE - 0.05 else None,
+        "recorded_ms": controller.latencies_ms[0] if controller and controller.latencies_ms else None,
+        "interrupted": speech.interrupted,
+        "false_alarms": controller.false_alarms if controller else 0,
+        "replayed_ms": controller._source.replayed_seconds * 1000 if controller and controller._source else 0.0,
+    }
+
+
+async def _bench(trials: int):
+    import numpy as np
+    from livekit.plugins import silero
+
+    from audio_ring import _voiced
+
+    silero_vad = silero.VAD.load()
+    rng = np.random.default_rng(1)
+
+    def caller(speech_s: float):
+        lead = np.zeros(int(rng.uniform(0.8, 1.4) * SILERO_SAMPLE_RATE), dtype=np.int16)
+        tail = np.zeros(SILERO_SAMPLE_RATE, dtype=np.int16)
+        return np.concatenate([lead, _voiced(speech_s), tail])
+
+    print(f"caller talks over the agent, {trials} trials per path (silence = agent audio queue cleared)")
+    print("path        onset->silence p50   p95   max  interrupted  recorded p50")
+    for label, controlled in (("pipeline", False), ("barge-in", True)):
+        results = [await _trial(silero_vad, caller(1.2), controlled) for _ in range(trials)]
+        silence = [r["silence_ms"] for r in results if r["silence_ms"] is not None]
+        recorded = [r["recorded_ms"] for r in results if r["recorded_ms"] is not None]
+        print(
+            f"{label:11s} {quantile(silence, 0.5):18.0f} {quantile(silence, 0.95):5.0f} {max(silence, default=0):5.0f}"
+            f" {sum(r['interrupted'] for r in results):8d}/{trials}  {quantile(recorded, 0.5):12.0f}"
+        )
+    blips = [await _trial(silero_vad, caller(0.25), True) for _ in range(max(1, trials // 2))]
+    print(
+        f"short blips (0.25s): {sum(r['false_alarms'] for r in blips)}/{len(blips)} paused and resumed,"
+        f" {sum(r['interrupted'] for r in blips)} then interrupted by the pipeline,"
+        f" {quantile([r['replayed_ms'] for r in blips], 0.5):.0f}ms of held agent audio replayed (p50)"
+    )
+    # silero keeps adding to speech_duration until min_silence_duration has passed, so the
+    # pipeline's own rule also fires on short blips; the pause only shortens the gap before it
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Barge-in reaction time: recent calls, or an offline benchmark")
+    parser.add_argument("--worker", default="dev")
+    parser.add_argument("-n", type=int, default=100, help="number of recent calls")
+    parser.add_argument("--bench", action="store_true", help="measure onset-to-silence against the real playout path")
+    parser.add_argument("--trials", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.bench:
+        asyncio.run(_bench(args.trials))
+        raise SystemExit
+    summary = summarize(REPORTS.read(args.worker, args.n))
+    if not summary["barge_ins"]:
+        print("no reports")
+        raise SystemExit
+    print(
+        f"{summary['barge_ins']} barge-ins over {summary['calls']} calls: onset->silence p50 {summary['p50_ms']:.0f}ms"
+        f" p95 {summary['p95_ms']:.0f}ms, {summary['under_target']:.0%} under {TARGET_MS}ms"
+    )
+    print(
+        f"{summary['interruptions']} interruptions ({summary['llm_cancelled']} LLM streams closed,"
+        f" {summary['chars_dropped']} unheard characters dropped from history), {summary['false_alarms']} resumed"
+    )
@@ -0,0 +1,499 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import re
+import time
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Optional
+
+from call_events import BOOKING_COMPLETED, CallEvents
+from faq_cache import reply_without_llm
+
+
+logger = logging.getLogger("booking-flow")
+
+# BOOKING_TRACKER=off leaves the whole flow to the LLM; bookings are still
+# measured, which gives the baseline to compare the tracker against
+TRACKER_ENABLED = os.getenv("BOOKING_TRACKER", "on") != "off"
+
+CENTERS = {
+    "Delhi": ("delhi", "dilli", "दिल्ली"),
+    "Govardhan": ("govardhan", "goverdhan", "gowardhan", "गोवर्धन"),
+    "Udupi": ("udupi", "udipi", "उडुपी", "उडुपि"),
+}
+OPENING_HOUR, CLOSING_HOUR = 8, 18
+
+_WEEKDAYS = [
+    ("monday", "somvar", "somwar", "सोमवार"),
+    ("tuesday", "mangalvar", "mangalwar", "मंगलवार"),
+    ("wednesday", "budhvar", "budhwar", "बुधवार"),
+    ("thursday", "guruvar", "guruwar", "brihaspativar", "गुरुवार", "बृहस्पतिवार"),
+    ("friday", "shukravar", "shukrawar", "शुक्रवार"),
+    ("saturday", "shanivar", "shaniwar", "शनिवार"),
+    ("sunday", "ravivar", "raviwar", "itwar", "रविवार", "इतवार"),
+]
+_MONTHS = ["january", "february", "march", "april", "may", "june", "july", "august", "september", "october", "november", "december"]
+_RELATIVE_DAYS = {
+    "day after tomorrow": 2, "parso": 2, "parson": 2, "परसों": 2,
+    "today": 0, "aaj": 0, "आज": 0,
+    # "kal" is also yesterday, but nobody books an appointment for yesterday
+    "tomorrow": 1, "kal": 1, "कल": 1,
+}
+_HOUR_WORDS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8,
+    "nine": 9, "ten": 10, "eleven": 11, "twelve": 12,
+    "ek": 1, "do": 2, "teen": 3, "char": 4, "chaar": 4, "paanch": 5, "panch": 5, "chhe": 6, "che": 6,
+    "saat": 7, "aath": 8, "nau": 9, "das": 10, "gyarah": 11, "barah": 12,
+    "एक": 1, "दो": 2, "तीन": 3, "चार": 4, "पांच": 5, "पाँच": 5, "छह": 6, "छः": 6,
+    "सात": 7, "आठ": 8, "नौ": 9, "दस": 10, "ग्यारह": 11, "बारह": 12,
+}
+_MORNING = ("am", "morning", "subah", "सुबह")
+_AFTERNOON = ("pm", "afternoon", "evening", "dopahar", "shaam", "sham", "दोपहर", "शाम")
+_HALF_PAST = ("saade", "sade", "साढ़े")
+
+_ISSUES = [
+    "joint pain", "back pain", "knee pain", "digestion", "digestive", "acidity", "gas", "constipation", "bloating",
+    "stomach", "stress", "anxiety", "insomnia", "sleep", "arthritis", "headache", "migraine", "skin", "hair fall",
+    "weight", "diabetes", "blood pressure", "cough", "cold", "allergy",
+    "pet dard", "kamar dard", "ghutno", "tanav", "neend", "पेट", "घुटन", "कमर", "तनाव", "नींद",
+]
+_BOOKING_INTENT = re.compile(
+    r"\b(book|booking|appointment|schedule|consult|see the doctor|meet the doctor|milna|dikhana)\b|अपॉइंटमेंट|मिलना|दिखाना"
+)
+_NAME_PATTERNS = [
+    re.compile(r"\bmy name is ([a-z][a-z .']*)", re.I),
+    re.compile(r"\bname'?s ([a-z][a-z .']*)", re.I),
+    re.compile(r"\bmera naam ([a-z][a-z .']*?)(?: hai\b|$)", re.I),
+    re.compile(r"मेरा नाम (\S+(?: \S+)?) (?:है)"),
+]
+# only trusted right after the agent asked for the name: "I am having pain" is not a name
+_NAME_REPLY_PATTERNS = [re.compile(r"^(?:i am|i'm|this is|it's|it is)\s+([a-z][a-z .']*)", re.I)]
+_NOT_NAME_WORDS = {
+    "and", "from", "calling", "here", "speaking", "i", "want", "to", "the", "a", "for", "with", "my", "is", "hai",
+    "yes", "no", "ok", "okay", "hello", "hi", "haan", "nahi", "sure", "having", "not", "in", "at",
+}
+_YES = re.compile(r"^(yes|yeah|yep|yup|sure|correct|right|ok|okay|perfect|great|haan|han|ha|ji|theek|thik|bilkul|हाँ|हां|जी|ठीक|बिल्कुल)\b")
+_NO = re.compile(r"\b(no|nope|nah|not|wrong|nahi|nahin|mat|नहीं|ना)\b")
+_HINGLISH = re.compile(r"\b(hai|mera|naam|baje|haan|nahi|chahiye|mujhe|aap|kya|karna|ko)\b")
+
+
+def _clean(text: str) -> str:
+    return re.sub(r"[^\w\s:.'/ऀ-ॿ]", " ", text.lower()).strip()
+
+
+def language_of(text: str) -> str:
+    if re.search(r"[ऀ-ॿ]", text):
+        return "hi"
+    if _HINGLISH.search(text.lower()):
+        return "hinglish"
+    return "en"
+
+
+def _contains(text: str, word: str) -> bool:
+    if word.isascii():
+        return re.search(rf"\b{re.escape(word)}\b", text) is not None
+    return word in text
+
+
+def parse_center(text: str) -> Optional[str]:
+    text = _clean(text)
+    for center, names in CENTERS.items():
+        if any(_contains(text, name) for name in names):
+            return center
+    return None
+
+
+def parse_date(text: str, today: Optional[date] = None) -> Optional[date]:
+    """English and Hindi (Devanagari or romanized) relative days, weekdays and day-month dates"""
+    today = today or date.today()
+    text = _clean(text)
+    for word, offset in _RELATIVE_DAYS.items():
+        if _contains(text, word):
+            return today + timedelta(days=offset)
+    for weekday, names in enumerate(_WEEKDAYS):
+        if any(_contains(text, name) for name in names):
+            days = (weekday - today.weekday()) % 7
+            if days == 0 or _contains(text, "next") or _contains(text, "agle"):
+                days = days or 7
+            return today + timedelta(days=days)
+
+    months = "|".join(m[:3] + r"[a-z]*" for m in _MONTHS)
+    match = re.search(rf"\b(\d{{1,2}})(?:st|nd|rd|th)?\s+(?:of\s+)?({months})\b", text) or re.search(
+        rf"\b({months})\s+(\d{{1,2}})(?:st|nd|rd|th)?\b", text
+    )
+    if match:
+        day_str, month_str = match.groups() if match.group(1).isdigit() else match.groups()[::-1]
+        month = next(i for i, m in enumerate(_MONTHS, 1) if month_str.startswith(m[:3]))
+        return _next_date(today, month, int(day_str))
+    match = re.search(r"\b(\d{1,2})/(\d{1,2})\b", text)
+    if match:
+        return _next_date(today, int(match.group(2)), int(match.group(1)))
+    match = re.search(r"\b(\d{1,2})(?:st|nd|rd|th)\b", text)
+    if match:
+        day = int(match.group(1))
+        month = today.month if day >= today.day else today.month % 12 + 1
+        return _next_date(today, month, day)
+    return None
+
+
+def _next_date(today: date, month: int, day: int) -> Optional[date]:
+    try:
+        candidate = date(today.year, month, day)
+        return candidate if candidate >= today else date(today.year + 1, month, day)
+    except ValueError:
+        return None
+
+
+def parse_time(text: str) -> Optional[tuple[int, int]]:
+    """(hour, minute) on a 24h clock; bare hours are read within clinic hours (3 -> 15:00)"""
+    text = re.sub(r"\b([ap])\.m\.?", r"\1m", _clean(text))
+    if _contains(text, "noon") or _contains(text, "dopahar 12"):
+        return 12, 0
+    hour = minute = None
+    match = re.search(r"\b(\d{1,2})(?::|\.)(\d{2})\s*(a\.?m\.?|p\.?m\.?)?", text) or re.search(
+        r"\b(\d{1,2})\s*(?:o'?clock\s*)?(a\.?m\.?|p\.?m\.?|baje|बजे)", text
+    ) or re.search(r"\bat (\d{1,2})\b", text)
+    if match:
+        hour = int(match.group(1))
+        minute = int(match.group(2)) if match.lastindex and match.lastindex >= 2 and (match.group(2) or "").isdigit() else 0
+    else:
+        for word, value in _HOUR_WORDS.items():
+            if re.search(rf"(?:^|\s){re.escape(word)}\s*(?:o'?clock|baje|बजे|am|pm|a\.m\.|p\.m\.)", text):
+                hour, minute = value, 0
+                break
+    if hour is None or hour > 23 or minute > 59:
+        return None
+    if any(_contains(text, w) for w in _HALF_PAST):
+        minute = 30
+
+    if hour <= 12:
+        if any(_contains(text, w) for w in _AFTERNOON):
+            hour = hour % 12 + 12
+        elif any(_contains(text, w) for w in _MORNING):
+            hour = hour % 12
+        elif hour < OPENING_HOUR:
+            hour += 12
+    return hour, minute
+
+
+def parse_name(text: str, asked: bool = False) -> Optional[str]:
+    patterns = _NAME_PATTERNS + (_NAME_REPLY_PATTERNS if asked else [])
+    candidate = None
+    for pattern in patterns:
+        match = pattern.search(text.strip())
+        if match:
+            candidate = match.group(1)
+            break
+    if candidate is None and asked:
+        # a bare reply, unless it is really another slot ("Tuesday", "Delhi")
+        if parse_center(text) or parse_date(text) or parse_time(text):
+            return None
+        candidate = text
+    if candidate is None:
+        return None
+    words = []
+    for word in re.sub(r"[^\w\s'ऀ-ॿ]", " ", candidate).split():
+        if word.lower() in _NOT_NAME_WORDS:
+            break
+        words.append(word)
+    if not words or len(words) > 3 or not all(re.fullmatch(r"[^\W\d_][\w'ऀ-ॿ]*", w) for w in words):
+        return None
+    return " ".join(w.capitalize() for w in words)
+
+
+def parse_issue(text: str, asked: bool = False) -> Optional[str]:
+    cleaned = _clean(text)
+    for issue in _ISSUES:
+        # prefix match, so "sleeping" and "headaches" count
+        if (re.search(rf"\b{re.escape(issue)}", cleaned) if issue.isascii() else issue in cleaned):
+            return issue
+    # a short free-text answer to "what can Dr. Ramesh help with"
+    if asked and 0 < len(cleaned.split()) <= 12 and "?" not in text and not _YES.match(cleaned) and not _NO.search(cleaned):
+        return cleaned
+    return None
+
+
+def format_date(d: date) -> str:
+    return f"{d:%A}, {d.day} {d:%B}"
+
+
+def format_time(hour: int, minute: int) -> str:
+    suffix = "am" if hour < 12 else "pm"
+    hour12 = hour % 12 or 12
+    return f"{hour12}{suffix}" if minute == 0 else f"{hour12}:{minute:02d}{suffix}"
+
+
+PROMPTS = {
+    "en": {
+        "name": "Sure, happy to book that for you! Can I get your full name?",
+        "issue": "Thanks{name}! And what health issue can Dr. Ramesh help you with?",
+        "center": "Got it. Which center works best, Delhi, Govardhan or Udupi?",
+        "date": "Lovely. Which day would you like to come in?",
+        "times": "On {date} we have {times} free. Which one works?",
+        "unavailable": "Hmm, {time} is taken on {date}. We have {times}, which one works?",
+        "confirm": "So that's {name} at our {center} center on {date} at {time}. Shall I book it?",
+        "booked": "Done! You're booked at our {center} center on {date} at {time}. See you then!",
+        "change": "No problem, what would you like to change?",
+        "closed": "Ah, we're closed on Sundays. Any other day work for you?",
+        "hours": "We're open from 8 AM to 6 PM. What time in between suits you?",
+    },
+    "hinglish": {
+        "name": "Haan ji, appointment book kar deti hoon! Aapka poora naam kya hai?",
+        "issue": "Thank you{name}! Aapko kis problem ke liye Dr. Ramesh se milna hai?",
+        "center": "Theek hai. Kaunsa center aapke liye best rahega, Delhi, Govardhan ya Udupi?",
+        "date": "Badhiya. Aap kis din aana chahenge?",
+        "times": "{date} ko {times} free hai. Kaunsa time theek rahega?",
+        "unavailable": "Hmm, {date} ko {time} available nahi hai. {times} free hai, kaunsa chalega?",
+        "confirm": "Toh {name}, {center} center, {date} ko {time}. Book kar doon?",
+        "booked": "Ho gaya! {center} center mein {date} ko {time} ka appointment book hai. Milte hain!",
+        "change": "Koi baat nahi, kya change karna hai?",
+        "closed": "Sunday ko clinic band rehta hai. Koi aur din chalega?",
+        "hours": "Clinic subah 8 se shaam 6 baje tak khula hai. Is beech kaunsa time theek rahega?",
+    },
+    "hi": {
+        "name": "जी ज़रूर, अपॉइंटमेंट बुक कर देती हूँ! आपका पूरा नाम क्या है?",
+        "issue": "धन्यवाद{name}! आपको किस समस्या के लिए डॉ. रमेश से मिलना है?",
+        "center": "ठीक है. कौनसा सेंटर आपके लिए सही रहेगा, दिल्ली, गोवर्धन या उडुपी?",
+        "date": "बढ़िया. आप किस दिन आना चाहेंगे?",
+        "times": "{date} को {times} खाली है. कौनसा समय ठीक रहेगा?",
+        "unavailable": "{date} को {time} खाली नहीं है. {times} खाली है, कौनसा चलेगा?",
+        "confirm": "तो {name}, {center} सेंटर, {date} को {time}. बुक कर दूँ?",
+        "booked": "हो गया! {center} सेंटर में {date} को {time} का अपॉइंटमेंट बुक है. मिलते हैं!",
+        "change": "कोई बात नहीं, क्या बदलना है?",
+        "closed": "रविवार को क्लिनिक बंद रहता है. कोई और दिन चलेगा?",
+        "hours": "क्लिनिक सुबह 8 से शाम 6 बजे तक खुला है. इस बीच कौनसा समय ठीक रहेगा?",
+    },
+}
+
+# dialogue states
+IDLE = "idle"
+ASK_NAME = "ask_name"
+ASK_ISSUE = "ask_issue"
+ASK_CENTER = "ask_center"
+ASK_DATE = "ask_date"
+ASK_TIME = "ask_time"
+CONFIRM = "confirm"
+CHANGE = "change"
+DONE = "done"
+
+
+@dataclass
+class BookingSlots:
+    name: Optional[str] = None
+    issue: Optional[str] = None
+    center: Optional[str] = None
+    date: Optional[date] = None
+    time: Optional[tuple[int, int]] = None
+
+
+class BookingTracker:
+    """
+    Dialogue-state tracker for the appointment flow in agent2's system prompt
+    (name, health issue, center, date and time, confirmation). Slots are
+    parsed locally from every caller turn; while the caller is answering the
+    flow, the next question is asked without an LLM round-trip, and
+    look_up_availability / confirm_appointment are called directly. Turns
+    that fill no slot are left to the LLM.
+    """
+
+    def __init__(self, actions, events: CallEvents, *, enabled: bool = TRACKER_ENABLED, today: Optional[date] = None):
+        self.actions = actions
+        self.events = events
+        self.enabled = enabled
+        self.today = today
+        self.state = IDLE
+        self.slots = BookingSlots()
+        self.language = "en"
+        self._available: Optional[list[str]] = None
+        self._available_for: Optional[date] = None
+        # measurement of one booking, from the first booking intent to confirmation
+        self.started_at: Optional[float] = None
+        self.llm_calls = 0
+        self.tracked_turns = 0
+        self.booked: Optional[dict] = None
+
+    def prefill(self, *, name: str = "", language: str = ""):
+        """Start from what a returning caller already told us"""
+        self.slots.name = name or self.slots.name
+        self.language = language if language in PROMPTS else self.language
+
+    @property
+    def active(self) -> bool:
+        return self.started_at is not None and self.state != DONE
+
+    def on_llm_call(self):
+        if self.active:
+            self.llm_calls += 1
+
+    def on_function_calls(self, called_functions):
+        """The LLM may still book by itself (open-ended turns, tracker disabled)"""
+        for called in called_functions:
+            if called.call_info.function_info.name == "confirm_appointment" and called.exception is None:
+                args = called.call_info.arguments
+                self.booked = {"date": args.get("date", ""), "time": args.get("time", ""), "center": args.get("center", "")}
+                self._finish(mode="tracker" if self.enabled else "llm")
+
+    def _finish(self, mode: str):
+        if self.state == DONE:
+            return
+        self.state = DONE
+        if self.started_at is None:
+            return
+        duration = time.time() - self.started_at
+        logger.info(f"booking completed by {mode} in {duration:.1f}s with {self.llm_calls} LLM calls")
+        self.events.emit(
+            BOOKING_COMPLETED,
+            mode=mode,
+            duration=duration,
+            llm_calls=self.llm_calls,
+            tracked_turns=self.tracked_turns,
+        )
+
+    def _extract(self, text: str) -> bool:
+        """Fill slots from one caller turn; returns whether anything was filled"""
+        filled = False
+        name = parse_name(text, asked=self.state == ASK_NAME)
+        if name and not self.slots.name:
+            self.slots.name, filled = name, True
+        issue = parse_issue(text, asked=self.state == ASK_ISSUE)
+        if issue and not self.slots.issue:
+            self.slots.issue, filled = issue, True
+        center = parse_center(text)
+        if center:
+            self.slots.center, filled = center, True
+        day = parse_date(text, self.today)
+        if day:
+            self.slots.date, filled = day, True
+        at = parse_time(text)
+        if at:
+            self.slots.time, filled = at, True
+        return filled
+
+    async def _availability(self) -> Optional[list[str]]:
+        if self._available_for != self.slots.date:
+            result = await self.actions.look_up_availability(date=format_date(self.slots.date))
+            try:
+                self._available = json.loads(result)["available_times"]
+            except (TypeError, ValueError, KeyError):
+                self._available = None
+            self._available_for = self.slots.date
+        return self._available
+
+    def _say(self, key: str, **values) -> str:
+        return PROMPTS[self.language][key].format(**values)
+
+    async def _next_prompt(self) -> str:
+        slots = self.slots
+        if not slots.name:
+            self.state = ASK_NAME
+            return self._say("name")
+        if not slots.issue:
+            self.state = ASK_ISSUE
+            return self._say("issue", name=f" {slots.name.split()[0]}")
+        if not slots.center:
+            self.state = ASK_CENTER
+            return self._say("center")
+        if not slots.date:
+            self.state = ASK_DATE
+            return self._say("date")
+        if slots.date.weekday() == 6:
+            slots.date = None
+            self.state = ASK_DATE
+            return self._say("closed")
+        if slots.time and not OPENING_HOUR <= slots.time[0] < CLOSING_HOUR:
+            slots.time = None
+            self.state = ASK_TIME
+            return self._say("hours")
+
+        available = await self._availability()
+        day = format_date(slots.date)
+        if available:
+            wanted = format_time(*slots.time) if slots.time else None
+            if wanted not in available:
+                self.state = ASK_TIME
+                times = ", ".join(available)
+                if wanted:
+                    slots.time = None
+                    return self._say("unavailable", time=wanted, date=day, times=times)
+                return self._say("times", date=day, times=times)
+        elif not slots.time:
+            self.state = ASK_TIME
+            return self._say("hours")
+
+        self.state = CONFIRM
+        return self._say("confirm", name=slots.name, center=slots.center, date=day, time=format_time(*slots.time))
+
+    async def _book(self) -> str:
+        slots = self.slots
+        day, at = format_date(slots.date), format_time(*slots.time)
+        await self.actions.confirm_appointment(day, at, slots.center)
+        self.booked = {"date": day, "time": at, "center": slots.center}
+        self._finish(mode="tracker")
+        return self._say("booked", center=slots.center, date=day, time=at)
+
+    async def reply_to(self, text: str) -> Optional[str]:
+        """The reply for a caller turn, or None when the LLM should answer it"""
+        if self.state == DONE:
+            return None
+        if self.started_at is None:
+            if not _BOOKING_INTENT.search(text.lower()):
+                return None
+            self.started_at = time.time()
+        if not self.enabled:
+            return None
+
+        language = language_of(text)
+        # short replies ("Delhi", "pet dard") keep the language the caller has been using
+        if language != "en" or len(text.split()) > 3:
+            self.language = language
+        cleaned = _clean(text)
+        filled = self._extract(text)
+        if self.state == CONFIRM and not filled:
+            if _NO.search(cleaned):
+                self.state = CHANGE
+                return self._say("change")
+            if _YES.match(cleaned):
+                return await self._book()
+        if not filled and self.state != IDLE:
+            return None
+        self.tracked_turns += 1
+        return await self._next_prompt()
+
+    async def handle_turn(self, agent, chat_ctx) -> bool:
+        """before_llm_cb helper: answers the turn locally when the tracker can. Returns True if it did."""
+        if not chat_ctx.messages or chat_ctx.messages[-1].role != "user":
+            return False
+        text = chat_ctx.messages[-1].content
+        if not isinstance(text, str) or not text.strip():
+            return False
+        reply = await self.reply_to(text)
+        if reply is None:
+            return False
+        logger.info(f"booking tracker ({self.state}) answered {text!r}: {self.slots}")
+        reply_without_llm(agent, chat_ctx, reply)
+        return True
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from call_events import CallEventStore
+
+    parser = argparse.ArgumentParser(description="Compare tracker-driven and LLM-only bookings")
+    parser.add_argument("--day", default=None, help="YYYY-MM-DD, default all days")
+    args = parser.parse_args()
+
+    rollup = CallEventStore().rollup(day=args.day or "*")
+    for mode in ("llm", "tracker"):
+        count = rollup.get(f"bookings:{mode}", 0)
+        if not count:
+            print(f"{mode:>8}: no bookings")
+            continue
+        print(
+            f"{mode:>8}: {count:.0f} bookings, "
+            f"{rollup.get(f'booking_llm_calls:{mode}', 0) / count:.1f} LLM calls and "
+            f"{rollup.get(f'booking_seconds:{mode}', 0) / count:.0f}s per booking"
+        )
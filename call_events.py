@@ -0,0 +1,280 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+
+
+logger = logging.getLogger("call-events")
+
+DB_PATH = os.getenv("CALL_EVENTS_DB", os.path.join("data", "call_events.db"))
+
+# event types
+CALL_STARTED = "call_started"
+AVAILABILITY_CHECKED = "availability_checked"
+APPOINTMENT_CONFIRMED = "appointment_confirmed"
+ANSWERING_MACHINE = "answering_machine"
+CALL_ENDED = "call_ended"
+BOOKING_COMPLETED = "booking_completed"
+
+EVENT_TYPES = (CALL_STARTED, AVAILABILITY_CHECKED, APPOINTMENT_CONFIRMED, ANSWERING_MACHINE, CALL_ENDED, BOOKING_COMPLETED)
+
+# rollup bucket that accumulates across all days, so totals are a single row lookup
+ALL_DAYS = "*"
+
+
+def normalize_phone(phone: str) -> str:
+    """A caller's number as the transcript archive keys it: what follows the "+", letters and digits only"""
+    return "".join(c for c in phone.rsplit("+", 1)[-1] if c.isalnum())
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    call_id TEXT NOT NULL,
+    type TEXT NOT NULL,
+    phone TEXT NOT NULL DEFAULT '',
+    agent TEXT NOT NULL DEFAULT '',
+    center TEXT NOT NULL DEFAULT '',
+    data TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS events_type_ts ON events (type, ts);
+CREATE INDEX IF NOT EXISTS events_call_id ON events (call_id);
+CREATE TABLE IF NOT EXISTS rollups (
+    day TEXT NOT NULL,
+    dimension TEXT NOT NULL,
+    key TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    value REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, dimension, key, metric)
+);
+"""
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+    # WAL lets the dashboard read while job processes append
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def _metrics_for(event_type: str, data: dict) -> dict[str, float]:
+    """Rollup increments contributed by a single event"""
+    if event_type == CALL_STARTED:
+        return {"calls": 1}
+    if event_type == AVAILABILITY_CHECKED:
+        return {"availability_checks": 1}
+    if event_type == APPOINTMENT_CONFIRMED:
+        return {"appointments": 1}
+    if event_type == ANSWERING_MACHINE:
+        return {"answering_machines": 1}
+    if event_type == CALL_ENDED:
+        # new and returning callers are split so the effect of caller memory shows up
+        caller = "returning" if data.get("returning") else "new"
+        return {
+            "ended_calls": 1,
+            "duration_seconds": float(data.get("duration", 0.0)),
+            f"outcome:{data.get('outcome', 'unknown')}": 1,
+            f"ended_calls:{caller}": 1,
+            f"duration_seconds:{caller}": float(data.get("duration", 0.0)),
+            f"llm_calls:{caller}": float(data.get("llm_calls", 0)),
+        }
+    if event_type == BOOKING_COMPLETED:
+        # split by who drove the flow, so tracker and LLM-only bookings can be compared
+        mode = data.get("mode", "llm")
+        return {
+            f"bookings:{mode}": 1,
+            f"booking_llm_calls:{mode}": float(data.get("llm_calls", 0)),
+            f"booking_seconds:{mode}": float(data.get("duration", 0.0)),
+        }
+    return {}
+
+
+class CallEventStore:
+    """
+    Append-only store of typed call events. Every append also bumps the
+    per-day / per-phone / per-center / per-agent rollups in the same
+    transaction, so dashboard reads never have to scan the event history.
+    """
+
+    def __init__(self, path: str = DB_PATH):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = _connect(self.path)
+        return self._conn
+
+    def append(
+        self,
+        event_type: str,
+        *,
+        call_id: str,
+        phone: str = "",
+        agent: str = "",
+        center: str = "",
+        ts: Optional[float] = None,
+        **data,
+    ):
+        if event_type not in EVENT_TYPES:
+            raise ValueError(f"unknown call event type: {event_type}")
+        ts = time.time() if ts is None else ts
+        day = datetime.fromtimestamp(ts).strftime("%Y-%m-%d")
+        increments = _metrics_for(event_type, data)
+        dimensions = [("all", ""), ("phone", phone), ("center", center.lower()), ("agent", agent)]
+
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO events (ts, call_id, type, phone, agent, center, data) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (ts, call_id, event_type, phone, agent, center, json.dumps(data)),
+            )
+            self.conn.executemany(
+                "INSERT INTO rollups (day, dimension, key, metric, value) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (day, dimension, key, metric) DO UPDATE SET value = value + excluded.value",
+                [
+                    (bucket, dimension, key, metric, value)
+                    for bucket in (day, ALL_DAYS)
+                    for dimension, key in dimensions
+                    if dimension == "all" or key
+                    for metric, value in increments.items()
+                ],
+            )
+
+    def rollup(self, dimension: str = "all", key: str = "", day: str = ALL_DAYS) -> dict[str, float]:
+        """Precomputed metrics for one dimension value on one day (or all days)"""
+        rows = self.conn.execute(
+            "SELECT metric, value FROM rollups WHERE day = ? AND dimension = ? AND key = ?",
+            (day, dimension, key),
+        )
+        return {metric: value for metric, value in rows}
+
+    def keys(self, dimension: str) -> list[str]:
+        rows = self.conn.execute(
+            "SELECT DISTINCT key FROM rollups WHERE day = ? AND dimension = ? ORDER BY key",
+            (ALL_DAYS, dimension),
+        )
+        return [key for (key,) in rows]
+
+    def arrivals_by_slot(self, since: float, slot_minutes: int = 15) -> dict[tuple[int, int], int]:
+        """Calls started since `since`, counted per (weekday, slot of the day) in local time; Monday is 0"""
+        rows = self.conn.execute(
+            "SELECT CAST(strftime('%w', ts, 'unixepoch', 'localtime') AS INTEGER), "
+            "CAST(strftime('%H', ts, 'unixepoch', 'localtime') AS INTEGER) * 60 "
+            "+ CAST(strftime('%M', ts, 'unixepoch', 'localtime') AS INTEGER), COUNT(*) "
+            "FROM events WHERE type = ? AND ts >= ? GROUP BY 1, 2",
+            (CALL_STARTED, since),
+        )
+        counts: dict[tuple[int, int], int] = {}
+        for sunday_first, minute, n in rows:
+            key = ((sunday_first - 1) % 7, minute // slot_minutes)
+            counts[key] = counts.get(key, 0) + n
+        return counts
+
+    def recorded_calls(self, call_ids: list[str]) -> set[str]:
+        """The calls among `call_ids` that have events"""
+        found: set[str] = set()
+        # sqlite caps the number of bound parameters per statement
+        for i in range(0, len(call_ids), 500):
+            chunk = call_ids[i:i + 500]
+            rows = self.conn.execute(
+                f"SELECT DISTINCT call_id FROM events WHERE call_id IN ({', '.join('?' * len(chunk))})",
+                chunk,
+            )
+            found.update(call_id for (call_id,) in rows)
+        return found
+
+    def first_event_ts(self) -> Optional[float]:
+        return self.conn.execute("SELECT MIN(ts) FROM events").fetchone()[0]
+
+    def events(self, call_id: str) -> list[dict]:
+        rows = self.conn.execute(
+            "SELECT ts, type, phone, agent, center, data FROM events WHERE call_id = ? ORDER BY id",
+            (call_id,),
+        )
+        return [
+            {"ts": ts, "type": t, "phone": phone, "agent": agent, "center": center, **json.loads(data)}
+            for ts, t, phone, agent, center, data in rows
+        ]
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class CallEvents:
+    """
+    Event emitter bound to a single call. Writes happen on a thread so the
+    sqlite commit never blocks the job's event loop.
+    """
+
+    def __init__(self, *, call_id: str, phone: str = "", agent: str = "", store: Optional[CallEventStore] = None):
+        self.call_id = call_id
+        # SIP identities, dialled numbers and archive keys all name the same caller
+        self.phone = normalize_phone(phone)
+        self.agent = agent
+        self.center = ""
+        self.outcome = "caller_hangup"
+        self.started_at = time.time()
+        self.returning = False
+        self.llm_calls = 0
+        self._store = store or CallEventStore()
+        self._pending: set[asyncio.Task] = set()
+        self._ended = False
+
+    def emit(self, event_type: str, **data):
+        if event_type == APPOINTMENT_CONFIRMED:
+            self.outcome = "appointment"
+            self.center = data.pop("center", "") or self.center
+        elif event_type == ANSWERING_MACHINE:
+            self.outcome = "answering_machine"
+
+        kwargs = dict(call_id=self.call_id, phone=self.phone, agent=self.agent, center=self.center, ts=time.time(), **data)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._append(event_type, kwargs)
+            return
+        task = loop.create_task(asyncio.to_thread(self._append, event_type, kwargs))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    def _append(self, event_type: str, kwargs: dict):
+        try:
+            self._store.append(event_type, **kwargs)
+        except Exception as e:
+            # losing a metrics event must never take down a call
+            logger.warning(f"failed to record {event_type} for {self.call_id}: {e}")
+
+    def started(self):
+        self.emit(CALL_STARTED)
+
+    def ended_by_agent(self):
+        if self.outcome == "caller_hangup":
+            self.outcome = "agent_hangup"
+
+    async def finish(self):
+        """Emit call_ended with duration and outcome, then flush pending writes"""
+        if not self._ended:
+            self._ended = True
+            self.emit(
+                CALL_ENDED,
+                duration=time.time() - self.started_at,
+                outcome=self.outcome,
+                returning=self.returning,
+                llm_calls=self.llm_calls,
+            )
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
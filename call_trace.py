@@ -0,0 +1,302 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from livekit.agents import metrics
+
+from runtime_reports import RUNTIME_DIR
+
+
+logger = logging.getLogger("call-trace")
+
+TRACE_DIR = os.path.join(RUNTIME_DIR, "traces")
+ENABLED = os.getenv("CALL_TRACE", "on") != "off"
+# fraction of calls written, and the fraction once the host's 1-minute load per core reaches BUSY_LOAD
+SAMPLE = float(os.getenv("CALL_TRACE_SAMPLE", "1.0"))
+BUSY_SAMPLE = float(os.getenv("CALL_TRACE_BUSY_SAMPLE", "0.1"))
+BUSY_LOAD = float(os.getenv("CALL_TRACE_BUSY_LOAD", "0.7"))
+# calls with a turn slower than this (end of speech to agent audio) are written regardless
+SLOW_TURN_MS = float(os.getenv("CALL_TRACE_SLOW_TURN_MS", "2500"))
+# the oldest traces are deleted beyond this many
+KEEP = int(os.getenv("CALL_TRACE_KEEP", "2000"))
+MAX_EVENTS = 20000
+
+# timeline rows, top to bottom
+LANES = ("call", "caller", "turn", "endpointing", "stt", "llm", "tts", "agent", "tools")
+
+
+def _sample_rate() -> float:
+    try:
+        load = os.getloadavg()[0] / (os.cpu_count() or 1)
+    except OSError:
+        return SAMPLE
+    return BUSY_SAMPLE if load >= BUSY_LOAD else SAMPLE
+
+
+class CallTrace:
+    """
+    Spans for one call on a timeline: setup steps from the entrypoint, and for
+    each turn the caller's speech, endpointing, transcript, LLM, TTS, tool
+    calls and the agent's playout, rebuilt from the pipeline's metrics. Spans
+    are kept in memory; at the end of the call the trace is written as a
+    Chrome trace (open it in ui.perfetto.dev or chrome://tracing) if the call
+    was sampled or had a slow turn.
+    """
+
+    def __init__(self, call_id: str, *, agent: str = "", enabled: bool = ENABLED):
+        self.call_id = call_id
+        self.agent = agent
+        self.enabled = enabled
+        self.sampled = enabled and random.random() < _sample_rate()
+        self.started_at = time.time()
+        self.turns: list[dict] = []
+        self._events: list[tuple] = []
+        self._agent = None
+        self._user_started: Optional[float] = None
+        self._agent_started: Optional[float] = None
+        self._tools_started: Optional[float] = None
+        self._tool_names: list[str] = []
+        # turns by the speech id of their reply, and the latest one not yet answered
+        self._by_speech: dict[str, dict] = {}
+        self._waiting: Optional[dict] = None
+
+    # --- recording ---
+
+    def complete(self, name: str, lane: str, start: float, end: float, **args):
+        """A span from `start` to `end` (time.time())"""
+        if self.enabled and len(self._events) < MAX_EVENTS:
+            self._events.append(("X", name, lane, start, max(start, end), args))
+
+    def instant(self, name: str, lane: str = "call", at: Optional[float] = None, **args):
+        if self.enabled and len(self._events) < MAX_EVENTS:
+            self._events.append(("i", name, lane, time.time() if at is None else at, 0.0, args))
+
+    @contextmanager
+    def span(self, name: str, lane: str = "call", **args):
+        """Time a block of the entrypoint; the yielded dict becomes the span's args"""
+        start = time.time()
+        try:
+            yield args
+        finally:
+            self.complete(name, lane, start, time.time(), **args)
+
+    # --- the pipeline ---
+
+    def watch(self, agent):
+        """Follow `agent`'s (VoicePipelineAgent) turns"""
+        if not self.enabled:
+            return
+        self._agent = agent
+        agent.on("user_started_speaking", self._on_user_started)
+        agent.on("user_stopped_speaking", self._on_user_stopped)
+        agent.on("agent_started_speaking", self._on_agent_started)
+        agent.on("agent_stopped_speaking", self._on_agent_stopped)
+        agent.on("function_calls_collected", self._on_tools_collected)
+        agent.on("function_calls_finished", self._on_tools_finished)
+        agent.on("metrics_collected", self._on_metrics)
+
+    def _on_user_started(self):
+        self._user_started = time.time()
+
+    def _on_user_stopped(self):
+        if self._user_started is not None:
+            self.complete("caller speech", "caller", self._user_started, time.time())
+            self._user_started = None
+
+    def _on_agent_started(self):
+        now = time.time()
+        self._agent_started = now
+        speech = getattr(self._agent, "_playing_speech", None)
+        turn, self._waiting = self._waiting, None
+        if turn is None:
+            return
+        # the first audio after the caller's turn ends it, even a filler
+        turn["playout"] = now
+        turn["response_ms"] = (now - turn["vad_end"]) * 1000
+        turn["answered_by"] = getattr(speech, "id", None)
+        self.complete(f"turn {turn['turn']}", "turn", turn["vad_end"], now, **self._breakdown(turn))
+
+    def _on_agent_stopped(self):
+        if self._agent_started is not None:
+            speech = getattr(self._agent, "_playing_speech", None)
+            interrupted = bool(getattr(speech, "interrupted", False))
+            self.complete("agent speech", "agent", self._agent_started, time.time(), interrupted=interrupted)
+            self._agent_started = None
+
+    def _on_tools_collected(self, calls):
+        self._tools_started = time.time()
+        self._tool_names = [call.function_info.name for call in calls]
+
+    def _on_tools_finished(self, called):
+        if self._tools_started is None:
+            return
+        failed = [c.call_info.function_info.name for c in called if getattr(c, "exception", None) is not None]
+        self.complete(" + ".join(self._tool_names) or "tools", "tools", self._tools_started, time.time(), failed=failed)
+        self._tools_started = None
+
+    def _on_metrics(self, m: metrics.AgentMetrics):
+        if isinstance(m, metrics.PipelineEOUMetrics):
+            vad_end = m.timestamp - m.end_of_utterance_delay
+            turn = {
+                "turn": len(self.turns) + 1,
+                "speech_id": m.sequence_id,
+                "vad_end": vad_end,
+                "endpointing_ms": m.end_of_utterance_delay * 1000,
+                "transcript_ms": m.transcription_delay * 1000,
+            }
+            self.turns.append(turn)
+            self._by_speech[m.sequence_id] = turn
+            self._waiting = turn
+            self.complete("endpointing", "endpointing", vad_end, m.timestamp, speech_id=m.sequence_id)
+            self.complete("transcript", "stt", vad_end, vad_end + m.transcription_delay, speech_id=m.sequence_id)
+        elif isinstance(m, metrics.PipelineSTTMetrics):
+            # batch recognitions; streaming STT reports no duration
+            if m.duration > 0:
+                self.complete("stt request", "stt", m.timestamp - m.duration, m.timestamp, audio_ms=round(m.audio_duration * 1000))
+        elif isinstance(m, metrics.PipelineLLMMetrics):
+            start = m.timestamp - m.duration
+            self.complete(
+                "llm", "llm", start, m.timestamp,
+                speech_id=m.sequence_id, label=m.label, ttft_ms=round(m.ttft * 1000), tokens=m.completion_tokens, cancelled=m.cancelled,
+            )
+            if m.ttft > 0:
+                self.instant("llm first token", "llm", start + m.ttft)
+            turn = self._by_speech.get(m.sequence_id)
+            if turn is not None and "llm_start" not in turn:
+                turn["llm_start"] = start
+                turn["llm_ttft_ms"] = m.ttft * 1000
+        elif isinstance(m, metrics.PipelineTTSMetrics):
+            start = m.timestamp - m.duration
+            self.complete(
+                "tts", "tts", start, m.timestamp,
+                speech_id=m.sequence_id, ttfb_ms=round(m.ttfb * 1000), chars=m.characters_count, cancelled=m.cancelled,
+            )
+            if m.ttfb > 0:
+                self.instant("tts first byte", "tts", start + m.ttfb)
+            turn = self._by_speech.get(m.sequence_id)
+            if turn is not None and "tts_start" not in turn:
+                turn["tts_start"] = start
+                turn["tts_ttfb_ms"] = m.ttfb * 1000
+
+    @staticmethod
+    def _breakdown(turn: dict) -> dict:
+        return {key: round(value) for key, value in turn.items() if key.endswith("_ms")}
+
+    # --- output ---
+
+    def slow(self) -> bool:
+        return any(turn.get("response_ms", 0) >= SLOW_TURN_MS for turn in self.turns)
+
+    def to_chrome(self) -> dict:
+        lanes = {lane: i for i, lane in enumerate(LANES)}
+        events = [{"ph": "M", "pid": 1, "tid": 0, "name": "process_name", "args": {"name": f"{self.agent} {self.call_id}".strip()}}]
+        for lane, tid in lanes.items():
+            events.append({"ph": "M", "pid": 1, "tid": tid, "name": "thread_name", "args": {"name": lane}})
+            events.append({"ph": "M", "pid": 1, "tid": tid, "name": "thread_sort_index", "args": {"sort_index": tid}})
+        for ph, name, lane, start, end, args in self._events:
+            event = {"ph": ph, "name": name, "cat": lane, "pid": 1, "tid": lanes[lane], "ts": round((start - self.started_at) * 1e6), "args": args}
+            if ph == "X":
+                event["dur"] = round((end - start) * 1e6)
+            else:
+                event["s"] = "t"
+            events.append(event)
+        turns = [{**self._breakdown(turn), "turn": turn["turn"], "at_s": round(turn["vad_end"] - self.started_at, 3)} for turn in self.turns]
+        return {
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "otherData": {"call_id": self.call_id, "agent": self.agent, "started_at": self.started_at, "sampled": self.sampled, "turns": turns},
+        }
+
+    def attach(self, job_ctx) -> "CallTrace":
+        """Write the trace when the job ends, if it is kept"""
+        if not self.enabled:
+            return self
+
+        async def write():
+            if self._user_started is not None:
+                self._on_user_stopped()
+            if not (self.sampled or self.slow()):
+                return
+            await asyncio.to_thread(write_trace, self.call_id, self.to_chrome())
+
+        job_ctx.add_shutdown_callback(write)
+        return self
+
+
+def trace_path(call_id: str) -> str:
+    return os.path.join(TRACE_DIR, f"{call_id}.json")
+
+
+def write_trace(call_id: str, trace: dict):
+    os.makedirs(TRACE_DIR, exist_ok=True)
+    tmp = trace_path(call_id) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(trace, f, separators=(",", ":"))
+    os.replace(tmp, trace_path(call_id))
+    prune()
+
+
+def prune(keep: int = KEEP):
+    try:
+        names = [name for name in os.listdir(TRACE_DIR) if name.endswith(".json")]
+    except FileNotFoundError:
+        return
+    if len(names) <= keep:
+        return
+    paths = sorted((os.path.join(TRACE_DIR, name) for name in names), key=os.path.getmtime)
+    for path in paths[: len(paths) - keep]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def read_trace(call_id: str) -> Optional[dict]:
+    try:
+        with open(trace_path(call_id), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def turn_table(trace: dict) -> list[dict]:
+    """One row per turn, in milliseconds"""
+    columns = ("turn", "at_s", "response_ms", "endpointing_ms", "transcript_ms", "llm_ttft_ms", "tts_ttfb_ms")
+    return [{column: turn.get(column) for column in columns} for turn in trace.get("otherData", {}).get("turns", [])]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Per-call traces: list recent calls or print one call's turns")
+    parser.add_argument("call_id", nargs="?", help="room name of the call")
+    parser.add_argument("-n", type=int, default=20, help="number of recent traces to list")
+    args = parser.parse_args()
+
+    if args.call_id is None:
+        try:
+            names = sorted(os.listdir(TRACE_DIR), key=lambda name: os.path.getmtime(os.path.join(TRACE_DIR, name)))
+        except FileNotFoundError:
+            names = []
+        for name in [name for name in names if name.endswith(".json")][-args.n :]:
+            trace = read_trace(name[: -len(".json")]) or {}
+            rows = turn_table(trace)
+            worst = max((row["response_ms"] or 0 for row in rows), default=0)
+            print(f"{name[: -len('.json')]:40s} {len(rows):3d} turns, slowest {worst:6.0f}ms")
+        raise SystemExit
+    trace = read_trace(args.call_id)
+    if trace is None:
+        print(f"no trace at {trace_path(args.call_id)}")
+        raise SystemExit(1)
+    print(f"{trace_path(args.call_id)} (open in ui.perfetto.dev)")
+    print("turn    at  response  endpointing  transcript  llm ttft  tts ttfb")
+    for row in turn_table(trace):
+        cells = [row[key] for key in ("response_ms", "endpointing_ms", "transcript_ms", "llm_ttft_ms", "tts_ttfb_ms")]
+        print(f"{row['turn']:4d} {row['at_s']:6.1f}s " + "  ".join("         -" if c is None else f"{c:8.0f}ms" for c in cells))
@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Optional
+
+
+logger = logging.getLogger("caller-memory")
+
+DB_PATH = os.getenv("CALLER_MEMORY_DB", os.path.join("data", "callers.db"))
+# bookings kept per caller; older ones only survive in the summary
+MAX_BOOKINGS = 5
+
+CALL_SUMMARY_PROMPT = (
+    "You keep notes about a caller of Dr. Ramesh's Ayurveda clinic for the next time they call. "
+    "Merge the previous notes with this call. Keep their name, health issues, preferred center, bookings, "
+    "open requests and anything they asked us to remember; drop small talk. "
+    "Write at most 80 words in plain sentences, in English."
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS callers (
+    phone TEXT PRIMARY KEY,
+    profile TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+_LANGUAGE_NAMES = {"en": "English", "hi": "Hindi", "hinglish": "Hinglish", "kn": "Kannada"}
+
+
+@dataclass
+class CallerProfile:
+    phone: str
+    name: str = ""
+    issue: str = ""
+    center: str = ""
+    language: str = ""
+    summary: str = ""
+    calls: int = 0
+    last_call: float = 0.0
+    bookings: list[dict] = field(default_factory=list)
+
+    def prompt(self) -> str:
+        """System message telling the agent what it already knows about this caller"""
+        lines = [f"This caller has called {self.calls} time{'s' if self.calls != 1 else ''} before. Do not ask again for details you already know; just confirm them."]
+        if self.name:
+            lines.append(f"Name: {self.name}.")
+        if self.issue:
+            lines.append(f"Health issue last time: {self.issue}.")
+        if self.center:
+            lines.append(f"Preferred center: {self.center}.")
+        if self.language in _LANGUAGE_NAMES:
+            lines.append(f"They usually speak {_LANGUAGE_NAMES[self.language]}.")
+        for booking in self.bookings[-2:]:
+            lines.append(f"Booked: {booking.get('date', '')} at {booking.get('time', '')}, {booking.get('center', '')} center.")
+        if self.summary:
+            lines.append(f"Notes from past calls: {self.summary}")
+        return "\n".join(lines)
+
+
+class CallerMemory:
+    """
+    Per-phone caller profiles in sqlite, one JSON row per phone number, so a
+    call start costs a single primary-key lookup.
+    """
+
+    def __init__(self, path: str = DB_PATH):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    def get(self, phone: str) -> Optional[CallerProfile]:
+        with self._lock:
+            row = self.conn.execute("SELECT profile FROM callers WHERE phone = ?", (phone,)).fetchone()
+        if row is None:
+            return None
+        data = json.loads(row[0])
+        return CallerProfile(**{k: v for k, v in data.items() if k in CallerProfile.__dataclass_fields__})
+
+    def put(self, profile: CallerProfile):
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO callers (phone, profile, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (phone) DO UPDATE SET profile = excluded.profile, updated_at = excluded.updated_at",
+                (profile.phone, json.dumps(asdict(profile), ensure_ascii=False), time.time()),
+            )
+
+    def forget(self, phone: str):
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM callers WHERE phone = ?", (phone,))
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+async def remember_call(
+    memory: CallerMemory,
+    profile: CallerProfile,
+    *,
+    summarizer,
+    messages: list,
+    name: Optional[str] = None,
+    issue: Optional[str] = None,
+    center: Optional[str] = None,
+    language: Optional[str] = None,
+    booking: Optional[dict] = None,
+):
+    """
+    Fold a finished call into the caller's profile. Runs after the call has
+    ended, so the summary request and the sqlite write never delay a reply.
+    """
+    from context_budget import summarize
+
+    profile.calls += 1
+    profile.last_call = time.time()
+    profile.name = name or profile.name
+    profile.issue = issue or profile.issue
+    profile.center = center or profile.center
+    profile.language = language or profile.language
+    if booking:
+        profile.bookings = (profile.bookings + [booking])[-MAX_BOOKINGS:]
+    if any(m.role == "user" for m in messages):
+        try:
+            profile.summary = await summarize(summarizer, messages, profile.summary, prompt=CALL_SUMMARY_PROMPT) or profile.summary
+        except Exception as e:
+            logger.warning(f"failed to summarize call for {profile.phone}: {e}")
+    try:
+        await asyncio.to_thread(memory.put, profile)
+    except Exception as e:
+        logger.warning(f"failed to save caller profile for {profile.phone}: {e}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect or delete returning-caller profiles")
+    parser.add_argument("phone")
+    parser.add_argument("--forget", action="store_true", help="delete the profile")
+    args = parser.parse_args()
+
+    memory = CallerMemory()
+    if args.forget:
+        memory.forget(args.phone)
+        print(f"forgot {args.phone}")
+    else:
+        profile = memory.get(args.phone)
+        print(json.dumps(asdict(profile), indent=2, ensure_ascii=False) if profile else "no profile")
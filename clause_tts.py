@@ -0,0 +1,397 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import re
+import time
+from dataclasses import dataclass, fields, replace
+from typing import Optional
+
+from livekit import rtc
+from livekit.agents import APIConnectOptions, tokenize, tts, utils
+
+
+# clause: flush TTS text at clause boundaries; sentence: the pipeline's default sentence tokenizer
+SEGMENTATION = os.getenv("TTS_SEGMENTATION", "clause")
+RULES_FILE = os.getenv("TTS_CLAUSE_RULES", os.path.join("data", "clause_rules.json"))
+
+
+@dataclass(frozen=True)
+class ClauseRules:
+    # a clause is flushed once it has this many characters; later ones need `growth` times more each
+    first_min_chars: int = 12
+    growth: float = 2.5
+    # after this many chunks only sentence ends flush, unless a sentence runs past max_chars
+    clause_chunks: int = 2
+    max_chars: int = 160
+    # a complete sentence this long is flushed on its own ("Sure!")
+    min_sentence_chars: int = 5
+    # interjections that make a first chunk on their own when punctuation follows ("Okay,")
+    fillers: tuple[str, ...] = ()
+    # discourse markers that open a clause; the text before them is flushed without punctuation,
+    # so a chunk needs min_opener_words words to end there
+    openers: tuple[str, ...] = ()
+    min_opener_words: int = 4
+    # openers that are also ordinary words ("I hope well."); they only open a clause as "Well, ..."
+    comma_openers: tuple[str, ...] = ()
+    # words whose trailing period does not end a sentence
+    abbreviations: tuple[str, ...] = ()
+
+    def min_chars(self, chunk_index: int) -> float:
+        if chunk_index >= self.clause_chunks:
+            return self.max_chars
+        return self.first_min_chars * self.growth**chunk_index
+
+
+# Devanagari and Kannada need more code points per syllable (vowel signs, viramas), so their
+# minimums are higher for the same amount of speech. Hinglish is written in Latin script and
+# follows the English rules, which include the common romanized fillers.
+DEFAULT_RULES = {
+    "en": ClauseRules(
+        fillers=("okay", "ok", "sure", "hmm", "great", "right", "alright", "got it", "achha", "haan", "ji", "theek hai"),
+        openers=(
+            "so", "okay", "ok", "but", "because", "actually", "anyway", "also", "well",
+            "toh", "achha", "haan", "lekin", "matlab",
+        ),
+        comma_openers=("so", "okay", "ok", "actually", "anyway", "also", "well", "achha", "haan"),
+        abbreviations=("dr", "mr", "mrs", "ms", "st", "prof", "vs", "etc", "e.g", "i.e", "a.m", "p.m", "rs"),
+    ),
+    "hi": ClauseRules(
+        first_min_chars=16,
+        max_chars=200,
+        fillers=("ठीक है", "जी हाँ", "जी", "हाँ", "अच्छा", "हम्म"),
+        # तो ends a condition clause in Hindi rather than opening one, so it is not an opener
+        openers=("लेकिन", "क्योंकि", "अच्छा", "फिर", "मतलब", "वैसे"),
+        comma_openers=("अच्छा",),
+        abbreviations=("डॉ", "श्री"),
+    ),
+    "kn": ClauseRules(
+        first_min_chars=18,
+        max_chars=220,
+        fillers=("ಸರಿ", "ಹೌದು", "ಹಾಂ", "ಓಕೆ"),
+        openers=("ಆದರೆ", "ಯಾಕೆಂದರೆ", "ಸರಿ", "ಅಂದರೆ", "ಮತ್ತೆ"),
+        comma_openers=("ಸರಿ",),
+        abbreviations=("ಡಾ",),
+    ),
+}
+
+_SCRIPTS = (("hi", 0x0900, 0x097F), ("kn", 0x0C80, 0x0CFF))
+# sentence ends (incl. the danda), then clause punctuation or a spaced dash, then any closing quotes;
+# a boundary only counts once the whitespace after it has arrived, so "5,000" and "3.5" never split
+_BOUNDARY = re.compile(r"(?:(?P<strong>[.!?…।॥]+)|(?P<weak>[,;:—–]|\s-))[\"'”’)»]*(?=\s)")
+
+
+def load_rules(path: str = RULES_FILE) -> dict[str, ClauseRules]:
+    """DEFAULT_RULES with per-language overrides from a JSON file, e.g. {"hi": {"first_min_chars": 20}}"""
+    rules = dict(DEFAULT_RULES)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            overrides = json.load(f)
+    except (OSError, ValueError):
+        return rules
+    known = {f.name for f in fields(ClauseRules)}
+    for language, values in overrides.items():
+        values = {k: tuple(v) if isinstance(v, list) else v for k, v in values.items() if k in known}
+        rules[language] = replace(rules.get(language, DEFAULT_RULES["en"]), **values)
+    return rules
+
+
+def language_of(text: str) -> str:
+    """Rules key by script: Devanagari -> hi, Kannada -> kn, anything else (incl. Hinglish) -> en"""
+    counts = dict.fromkeys((name for name, _, _ in _SCRIPTS), 0)
+    latin = 0
+    for ch in text:
+        code = ord(ch)
+        if code < 0x80:
+            latin += ch.isalpha()
+            continue
+        for name, low, high in _SCRIPTS:
+            if low <= code <= high:
+                counts[name] += 1
+    name, count = max(counts.items(), key=lambda kv: kv[1])
+    return name if count > latin else "en"
+
+
+def _opener_pattern(rules: dict[str, ClauseRules]) -> re.Pattern:
+    words = sorted({w for r in rules.values() for w in r.openers}, key=len, reverse=True)
+    # \b does not work inside Indic words (vowel signs are not \w), so the word end is spelled out
+    return re.compile(r"\s(?=(" + "|".join(map(re.escape, words)) + r")[\s,.!?।])", re.IGNORECASE)
+
+
+def _next_cut(text: str, chunk_index: int, rules: dict[str, ClauseRules], openers: re.Pattern) -> Optional[int]:
+    """
+    Where the next chunk of `text` ends, or None to keep buffering. Only the
+    text before a boundary is looked at, so a stream cuts where tokenize()
+    on the whole reply would.
+    """
+    candidates = [(m.end(), "strong" if m.group("strong") else "weak", m) for m in _BOUNDARY.finditer(text)]
+    candidates += [(m.start(), "opener", m) for m in openers.finditer(text)]
+    for cut, kind, match in sorted(candidates, key=lambda c: c[0]):
+        chunk = text[:cut].strip()
+        language_rules = rules.get(language_of(chunk), rules["en"])
+        if kind != "opener" and chunk_index == 0 and chunk.rstrip(".,;:!?…।—–-\"'”’)» ").lower() in language_rules.fillers:
+            return cut
+        if kind == "strong":
+            last_word = chunk.rstrip("\"'”’)»").rstrip(".").rsplit(None, 1)[-1].lower() if chunk else ""
+            if match.group("strong") == "." and (last_word in language_rules.abbreviations or len(last_word) == 1 and last_word.isalpha()):
+                continue
+            if len(chunk) >= language_rules.min_sentence_chars:
+                return cut
+            continue
+        if len(chunk) < language_rules.min_chars(chunk_index):
+            continue
+        if kind == "opener":
+            word = match.group(1).lower()
+            if word not in language_rules.openers or len(chunk.split()) < language_rules.min_opener_words:
+                continue
+            if word in language_rules.comma_openers and text[match.end(1)] != ",":
+                continue
+        return cut
+    return None
+
+
+class ClauseTokenizer(tokenize.SentenceTokenizer):
+    """
+    Splits TTS text at clause boundaries rather than sentence ends: the first
+    chunk of a reply is a leading filler ("Okay,", "ठीक है,") or is flushed
+    at the first comma, clause punctuation or opener ("but", "Well,", "लेकिन") once it
+    is first_min_chars long, later
+    chunks need progressively more text, and after clause_chunks only
+    sentence ends flush. Punctuation stays on the chunk it closes, so the TTS
+    still hears a continuation rather than a final fall. Rules are picked per
+    chunk from its script.
+    """
+
+    def __init__(self, rules: Optional[dict[str, ClauseRules]] = None):
+        self._rules = rules or load_rules()
+        self._openers = _opener_pattern(self._rules)
+
+    def tokenize(self, text: str, *, language: str | None = None) -> list[str]:
+        chunks = []
+        text = text.replace("\n", " ").strip()
+        while True:
+            cut = _next_cut(text, len(chunks), self._rules, self._openers)
+            if cut is None:
+                break
+            chunks.append(text[:cut].strip())
+            text = text[cut:].lstrip()
+        if text:
+            chunks.append(text)
+        return chunks
+
+    def stream(self, *, language: str | None = None) -> tokenize.SentenceStream:
+        return _ClauseStream(self._rules, self._openers)
+
+
+class _ClauseStream(tokenize.SentenceStream):
+    def __init__(self, rules: dict[str, ClauseRules], openers: re.Pattern):
+        super().__init__()
+        self._rules = rules
+        self._openers = openers
+        self._buf = ""
+        self._chunks = 0
+        self._segment_id = utils.shortuuid()
+
+    def push_text(self, text: str) -> None:
+        self._check_not_closed()
+        self._buf = (self._buf + text.replace("\n", " ")).lstrip()
+        while True:
+            cut = _next_cut(self._buf, self._chunks, self._rules, self._openers)
+            if cut is None:
+                return
+            self._send(self._buf[:cut].strip())
+            self._buf = self._buf[cut:].lstrip()
+
+    def flush(self) -> None:
+        self._check_not_closed()
+        if self._buf.strip():
+            self._send(self._buf.strip())
+        self._buf = ""
+        self._chunks = 0
+        self._segment_id = utils.shortuuid()
+
+    def end_input(self) -> None:
+        self.flush()
+        self._do_close()
+
+    async def aclose(self) -> None:
+        self._do_close()
+
+    def _send(self, chunk: str):
+        self._event_ch.send_nowait(tokenize.TokenData(segment_id=self._segment_id, token=chunk))
+        self._chunks += 1
+
+
+def segmenter() -> tokenize.SentenceTokenizer:
+    """The tokenizer TTS text goes through, per TTS_SEGMENTATION"""
+    if SEGMENTATION == "clause":
+        return ClauseTokenizer()
+    return tokenize.basic.SentenceTokenizer()
+
+
+class _ClauseStreamingTTS(tts.TTS):
+    """
+    A streaming TTS (Cartesia's websocket) with its own sentence tokenizer
+    swapped for clause segmentation. Chunks go out on one context, so the
+    provider keeps prosody continuous across them.
+    """
+
+    def __init__(self, inner: tts.TTS):
+        super().__init__(capabilities=inner.capabilities, sample_rate=inner.sample_rate, num_channels=inner.num_channels)
+        self._inner = inner
+        self._tokenizer = ClauseTokenizer()
+        inner.on("metrics_collected", lambda *args, **kwargs: self.emit("metrics_collected", *args, **kwargs))
+
+    def synthesize(self, text: str, *, conn_options: Optional[APIConnectOptions] = None) -> tts.ChunkedStream:
+        return self._inner.synthesize(text, conn_options=conn_options)
+
+    def stream(self, *, conn_options: Optional[APIConnectOptions] = None) -> tts.SynthesizeStream:
+        stream = self._inner.stream(conn_options=conn_options)
+        # read by the stream's input task, which has not started yet
+        if hasattr(stream, "_sent_tokenizer_stream"):
+            stream._sent_tokenizer_stream = self._tokenizer.stream()
+        return stream
+
+    def prewarm(self) -> None:
+        self._inner.prewarm()
+
+    async def aclose(self):
+        await self._inner.aclose()
+
+
+def clause_tts(inner: tts.TTS) -> tts.TTS:
+    """
+    `inner` with TTS text segmented at clauses. VoicePipelineAgent would wrap
+    a non-streaming TTS in a StreamAdapter with the sentence tokenizer; the
+    adapter is built here instead, so the pipeline uses it as is.
+    """
+    if SEGMENTATION != "clause":
+        return inner
+    if inner.capabilities.streaming:
+        return _ClauseStreamingTTS(inner)
+    return tts.StreamAdapter(tts=inner, sentence_tokenizer=ClauseTokenizer())
+
+
+# casual replies in the style the entrypoints prompt for
+_BENCH_REPLIES = (
+    "Sure, I can help with that. Which center would you like to visit, Delhi, Govardhan or Udupi?",
+    "Okay so your appointment is booked for Monday at 5 PM, and Dr. Ramesh will see you then.",
+    "Hmm, we're closed on Sundays, but Saturday morning works great if that suits you.",
+    "Got it, Priya! Digestion issues are super common, and the doctor has a lot of experience with them.",
+    "Great, see you on Tuesday then. Take care!",
+    "Achha, toh aapka appointment Tuesday ko 11 baje fix ho gaya hai, Udupi center mein.",
+    "जी हाँ, क्लिनिक सुबह आठ बजे से शाम छह बजे तक खुला रहता है, लेकिन रविवार को बंद रहता है।",
+    "ठीक है, आपका अपॉइंटमेंट सोमवार शाम पाँच बजे दिल्ली सेंटर में बुक हो गया है।",
+    "ಸರಿ, ನಿಮ್ಮ ಅಪಾಯಿಂಟ್ಮೆಂಟ್ ಸೋಮವಾರ ಸಂಜೆ ಐದು ಗಂಟೆಗೆ ಉಡುಪಿ ಕೇಂದ್ರದಲ್ಲಿ ಬುಕ್ ಆಗಿದೆ.",
+)
+
+
+def _tokens(text: str) -> list[str]:
+    """LLM-ish tokens: words with their leading space, long words in pieces of four characters"""
+    pieces = []
+    for word in re.findall(r"\s*\S+", text):
+        pieces += [word[i : i + 4] for i in range(0, len(word), 4)]
+    return pieces
+
+
+class _BenchChunkedStream(tts.ChunkedStream):
+    async def _run(self) -> None:
+        bench = self._tts
+        await asyncio.sleep((bench.base_ms + bench.per_char_ms * len(self._input_text)) / 1000)
+        samples = int(bench.speech_ms_per_char * len(self._input_text) * bench.sample_rate / 1000)
+        frame = 480
+        for start in range(0, samples, frame):
+            n = min(frame, samples - start)
+            self._event_ch.send_nowait(
+                tts.SynthesizedAudio(
+                    request_id="bench",
+                    frame=rtc.AudioFrame(
+                        data=bytes(n * 2), sample_rate=bench.sample_rate, num_channels=1, samples_per_channel=n
+                    ),
+                )
+            )
+
+
+class _BenchTTS(tts.TTS):
+    """Non-streaming TTS whose first byte takes base_ms + per_char_ms per character of input"""
+
+    def __init__(self, base_ms: float, per_char_ms: float, speech_ms_per_char: float):
+        super().__init__(capabilities=tts.TTSCapabilities(streaming=False), sample_rate=24000, num_channels=1)
+        self.base_ms, self.per_char_ms, self.speech_ms_per_char = base_ms, per_char_ms, speech_ms_per_char
+
+    def synthesize(self, text: str, *, conn_options: Optional[APIConnectOptions] = None) -> tts.ChunkedStream:
+        return _BenchChunkedStream(tts=self, input_text=text, conn_options=conn_options)
+
+
+async def _speak(reply: str, tokenizer: tokenize.SentenceTokenizer, token_ms: float, bench_tts: _BenchTTS) -> dict:
+    """Stream one reply through a StreamAdapter; time from the first LLM token to the first audio, and playout stalls"""
+    stream = tts.StreamAdapter(tts=bench_tts, sentence_tokenizer=tokenizer).stream()
+
+    async def feed():
+        for token in _tokens(reply):
+            stream.push_text(token)
+            await asyncio.sleep(token_ms / 1000)
+        stream.end_input()
+
+    started = time.perf_counter()
+    feeder = asyncio.create_task(feed())
+    first_audio, playhead, stall = None, 0.0, 0.0
+    async for audio in stream:
+        now = time.perf_counter() - started
+        if first_audio is None:
+            first_audio = playhead = now
+        elif now > playhead:
+            stall += now - playhead
+            playhead = now
+        playhead += audio.frame.samples_per_channel / audio.frame.sample_rate
+    await feeder
+    await stream.aclose()
+    chunks = tokenizer.tokenize(reply)
+    return {
+        "language": language_of(reply),
+        "first_audio_ms": first_audio * 1000,
+        "stall_ms": stall * 1000,
+        "chunks": len(chunks),
+        "first_chars": len(chunks[0]),
+    }
+
+
+async def _bench(token_ms: float, base_ms: float, per_char_ms: float):
+    from statistics import mean, median
+
+    bench_tts = _BenchTTS(base_ms, per_char_ms, speech_ms_per_char=65)
+    print(
+        f"{len(_BENCH_REPLIES)} replies, an LLM token every {token_ms:.0f}ms,"
+        f" TTS first byte after {base_ms:.0f}ms + {per_char_ms}ms/char"
+    )
+    print("segmentation  language  first token->first audio p50   max  stalls ms  chunks  first chunk chars")
+    for label, tokenizer in (("sentence", tokenize.basic.SentenceTokenizer()), ("clause", ClauseTokenizer())):
+        results = [await _speak(reply, tokenizer, token_ms, bench_tts) for reply in _BENCH_REPLIES]
+        for language in ("en", "hi", "kn", "all"):
+            rows = [r for r in results if language in ("all", r["language"])]
+            first = [r["first_audio_ms"] for r in rows]
+            print(
+                f"{label:13s} {language:8s} {median(first):28.0f} {max(first):5.0f} {mean(r['stall_ms'] for r in rows):10.0f}"
+                f" {mean(r['chunks'] for r in rows):7.1f} {mean(r['first_chars'] for r in rows):18.0f}"
+            )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Show how replies are segmented for TTS, or benchmark first audio")
+    parser.add_argument("text", nargs="*", help="text to segment")
+    parser.add_argument("--bench", action="store_true", help="LLM first token to first audio, sentence vs clause")
+    parser.add_argument("--token-ms", type=float, default=15, help="time between LLM tokens")
+    parser.add_argument("--tts-base-ms", type=float, default=300, help="TTS time to first byte for an empty request")
+    parser.add_argument("--tts-char-ms", type=float, default=2.0, help="extra TTS time to first byte per character")
+    args = parser.parse_args()
+
+    if args.bench:
+        asyncio.run(_bench(args.token_ms, args.tts_base_ms, args.tts_char_ms))
+        raise SystemExit
+    for reply in [" ".join(args.text)] if args.text else _BENCH_REPLIES:
+        print(f"[{language_of(reply)}]")
+        for chunk in ClauseTokenizer().tokenize(reply):
+            print(f"  | {chunk}")
@@ -0,0 +1,267 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from collections import defaultdict
+from typing import Optional
+
+from livekit.agents import llm, metrics
+
+
+logger = logging.getLogger("context-budget")
+
+# context windows of the models the entrypoints use
+MODEL_WINDOWS = {
+    "llama3-8b-8192": 8192,
+    "llama-3.1-8b-instant": 131072,
+    "llama-3.3-70b-versatile": 131072,
+    "gpt-4o-mini": 128000,
+}
+# prefill time grows with the prompt, so the budget sits well below the windows
+DEFAULT_BUDGET = int(os.getenv("CHAT_CONTEXT_BUDGET", "3000"))
+# room left for the reply and tool definitions
+OUTPUT_RESERVE = 1024
+# messages at the end of the context that are always sent verbatim
+KEEP_RECENT = 6
+
+SUMMARY_PROMPT = (
+    "You keep notes for a phone assistant. Update the running summary of the call with the new turns below. "
+    "Keep every name, phone number, date, time, place, price, booking detail and decision; drop small talk. "
+    "Write at most 120 words in plain sentences, in English."
+)
+
+try:
+    import tiktoken
+
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _encoding = None
+
+
+def count_tokens(text: str) -> int:
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    # roughly four characters per token for Llama 3 and GPT tokenizers
+    return len(text) // 4 + 1
+
+
+def _text(msg: llm.ChatMessage) -> str:
+    if isinstance(msg.content, str):
+        return msg.content
+    if isinstance(msg.content, list):
+        return " ".join(c if isinstance(c, str) else "[image]" for c in msg.content)
+    return ""
+
+
+def message_tokens(msg: llm.ChatMessage) -> int:
+    tokens = count_tokens(_text(msg)) + 4
+    for call in msg.tool_calls or []:
+        tokens += count_tokens(call.raw_arguments) + 8
+    return tokens
+
+
+def budget_for(*models: str, budget: int = DEFAULT_BUDGET) -> int:
+    """Token budget that fits every model a call may be routed to"""
+    windows = [MODEL_WINDOWS.get(m, 8192) for m in models] or [8192]
+    return min(budget, min(windows) - OUTPUT_RESERVE)
+
+
+async def summarize(summarizer: llm.LLM, messages: list[llm.ChatMessage], previous: str = "", prompt: str = SUMMARY_PROMPT) -> str:
+    """Fold `messages` into the `previous` summary with one request to `summarizer`"""
+    lines = []
+    for msg in messages:
+        if msg.role == "tool":
+            lines.append(f"tool result: {_text(msg)}")
+        elif msg.tool_calls:
+            lines.extend(f"assistant called {c.function_info.name}({c.raw_arguments})" for c in msg.tool_calls)
+        elif _text(msg) and msg.role != "system":
+            lines.append(f"{msg.role}: {_text(msg)}")
+    request = llm.ChatContext().append(role="system", text=prompt).append(
+        role="user", text=f"Summary so far: {previous or '(none)'}\n\nNew turns:\n" + "\n".join(lines)
+    )
+    text = ""
+    async with summarizer.chat(chat_ctx=request) as stream:
+        async for chunk in stream:
+            for choice in chunk.choices:
+                text += choice.delta.content or ""
+    return text.strip()
+
+
+class TTFTByLength:
+    """Time to first token bucketed by turn number and by prompt size"""
+
+    TURN_BUCKETS = ((1, 5), (6, 10), (11, 20), (21, 40), (41, 10_000))
+
+    def __init__(self):
+        self.turns = 0
+        self._ttft: dict[str, list[float]] = defaultdict(list)
+        self._prompt: dict[str, list[int]] = defaultdict(list)
+
+    def record(self, ttft: float, prompt_tokens: int):
+        self.turns += 1
+        low, high = next(b for b in self.TURN_BUCKETS if b[0] <= self.turns <= b[1])
+        label = f"turns {low}-{high}" if high < 10_000 else f"turns {low}+"
+        self._ttft[label].append(ttft)
+        self._prompt[label].append(prompt_tokens)
+
+    def summary(self) -> dict:
+        return {
+            label: {
+                "requests": len(ttfts),
+                "avg_ttft_ms": sum(ttfts) / len(ttfts) * 1000,
+                "avg_prompt_tokens": sum(self._prompt[label]) / len(ttfts),
+            }
+            for label, ttfts in self._ttft.items()
+        }
+
+
+class ContextCompactor:
+    """
+    Keeps the chat context of a call under a token budget. The system prompt
+    and the most recent turns are sent verbatim; older turns are replaced by
+    a rolling summary that a small model writes in the background, so no
+    reply waits on it. Turns are folded in large blocks and the summary sits
+    right after the system prompt, which keeps the prompt prefix identical
+    across most requests and lets provider-side prompt caching work.
+    """
+
+    def __init__(
+        self,
+        summarizer: llm.LLM,
+        *,
+        budget: int = DEFAULT_BUDGET,
+        hard_limit: Optional[int] = None,
+        keep_recent: int = KEEP_RECENT,
+    ):
+        self.summarizer = summarizer
+        self.budget = budget
+        # never sent past this, even before the summary is ready
+        self.hard_limit = hard_limit or budget * 2
+        self.keep_recent = keep_recent
+        self.summary = ""
+        self._summary_msg: Optional[llm.ChatMessage] = None
+        self._covered: set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.compactions = 0
+        self.summary_seconds = 0.0
+        self.dropped = 0
+        self.ttft = TTFTByLength()
+
+    def apply(self, chat_ctx: llm.ChatContext):
+        """Compact `chat_ctx` in place before it is sent to the LLM"""
+        messages = chat_ctx.messages
+        # the system prompt and anything injected right after it (caller memory) stay verbatim
+        n = 0
+        while n < len(messages) and messages[n].role == "system":
+            n += 1
+        head = messages[:n]
+        rest = [m for m in messages[len(head):] if m.id not in self._covered]
+        summary = [self._summary_msg] if self._summary_msg is not None else []
+
+        tokens = sum(message_tokens(m) for m in head + summary + rest)
+        # a system prompt close to the budget would otherwise trigger a fold on every turn
+        budget = max(self.budget, sum(message_tokens(m) for m in head + summary) + 1000)
+        if tokens > budget and self._task is None:
+            fold = self._fold_candidates(rest, tokens, budget)
+            if fold:
+                self._task = asyncio.create_task(self._summarize(fold))
+
+        # the summary is not ready yet and the context is far too long: drop the oldest turns
+        while tokens > self.hard_limit and len(rest) > self.keep_recent:
+            cut = self._turn_boundary(rest, 1)
+            tokens -= sum(message_tokens(m) for m in rest[:cut])
+            self.dropped += cut
+            rest = rest[cut:]
+
+        chat_ctx.messages[:] = head + summary + rest
+
+    def _turn_boundary(self, rest: list[llm.ChatMessage], start: int) -> int:
+        """Index of the first user message at or after `start`, so tool calls stay with their results"""
+        limit = max(1, len(rest) - self.keep_recent)
+        i = start
+        while i < limit and rest[i].role != "user":
+            i += 1
+        return min(i, limit)
+
+    def _fold_candidates(self, rest: list[llm.ChatMessage], tokens: int, budget: int) -> list[llm.ChatMessage]:
+        # fold enough to get well under budget, so folds (and prefix changes) are rare
+        target = tokens - int(budget * 0.6)
+        foldable = rest[: max(0, len(rest) - self.keep_recent)]
+        folded = 0
+        cut = 0
+        for i, msg in enumerate(foldable):
+            if folded >= target:
+                break
+            folded += message_tokens(msg)
+            cut = i + 1
+        if cut < len(foldable):
+            cut = self._turn_boundary(rest, cut)
+        return rest[:cut]
+
+    async def _summarize(self, fold: list[llm.ChatMessage]):
+        started = time.perf_counter()
+        try:
+            text = await summarize(self.summarizer, fold, self.summary)
+            if text:
+                self.summary = text
+                self._summary_msg = llm.ChatMessage.create(
+                    role="system", text=f"Summary of the earlier part of this call: {self.summary}"
+                )
+                self._covered.update(m.id for m in fold)
+                self.compactions += 1
+                self.summary_seconds += time.perf_counter() - started
+                logger.info(f"folded {len(fold)} messages into the call summary in {time.perf_counter() - started:.2f}s")
+        except Exception as e:
+            logger.warning(f"failed to summarize older turns: {e}")
+        finally:
+            self._task = None
+
+    async def before_llm(self, agent, chat_ctx: llm.ChatContext):
+        """Drop-in before_llm_cb for entrypoints without one of their own"""
+        self.apply(chat_ctx)
+
+    def record_llm_metrics(self, m):
+        if not m.cancelled and m.ttft > 0:
+            self.ttft.record(m.ttft, m.prompt_tokens)
+
+    def report(self) -> dict:
+        return {
+            "compactions": self.compactions,
+            "avg_summary_s": self.summary_seconds / self.compactions if self.compactions else 0.0,
+            "dropped_messages": self.dropped,
+            "ttft_by_call_length": self.ttft.summary(),
+        }
+
+    def attach(self, agent, job_ctx):
+        """Collect TTFT from `agent` and log the report when the call ends"""
+
+        @agent.on("metrics_collected")
+        def on_metrics_collected(agent_metrics):
+            if isinstance(agent_metrics, metrics.LLMMetrics):
+                self.record_llm_metrics(agent_metrics)
+
+        async def report():
+            await self.aclose()
+            logger.info(f"chat context: {self.report()}")
+
+        job_ctx.add_shutdown_callback(report)
+
+    async def aclose(self):
+        if self._task is not None:
+            self._task.cancel()
+
+
+def groq_compactor() -> ContextCompactor:
+    """Compactor sized for both routed Groq models, summarizing with the fast one"""
+    from livekit.plugins import openai
+
+    from model_router import FAST_MODEL, LARGE_MODEL
+    from rate_limiter import limited
+
+    return ContextCompactor(
+        limited(openai.LLM.with_groq(model=FAST_MODEL, temperature=0.2), "groq", FAST_MODEL),
+        budget=budget_for(FAST_MODEL, LARGE_MODEL),
+        hard_limit=min(MODEL_WINDOWS.get(m, 8192) for m in (FAST_MODEL, LARGE_MODEL)) - OUTPUT_RESERVE,
+    )
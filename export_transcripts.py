@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from typing import Optional
+
+from transcript_archive import ARCHIVE_DIR, TranscriptArchive, parse_log_content
+
+
+logger = logging.getLogger("transcript-export")
+
+EXPORT_DIR = os.getenv("TRANSCRIPTS_EXPORT_DIR", "exports")
+STATE_NAME = "export_state.json"
+# calls without a recorded duration that started more recently than this are assumed in progress
+IN_PROGRESS_GRACE = 3600.0
+
+
+def _call_key(call: dict) -> str:
+    # compaction renames x.log to x.log.gz; both are the same call
+    return call["file"].removesuffix(".gz")
+
+
+def _parse_call(call: dict) -> list[dict]:
+    """Flatten one transcript file into one row per turn. Runs in a worker process."""
+    try:
+        content = TranscriptArchive(ARCHIVE_DIR).read_text(call["file"])
+    except OSError as e:
+        logger.warning(f"skipping {call['file']}: {e}")
+        return []
+    rows = []
+    for call_index, turns in enumerate(parse_log_content(content)):
+        for turn_index, turn in enumerate(turns):
+            rows.append({
+                "call_file": _call_key(call),
+                "phone": call["phone"],
+                "agent": call["agent"],
+                "room": call["room"],
+                "call_started_at": call["started_at"].isoformat(),
+                "call_duration": call["duration"],
+                "call_index": call_index,
+                "turn_index": turn_index,
+                "timestamp": turn["timestamp"],
+                "speaker": turn["speaker"],
+                "text": turn["text"],
+            })
+    return rows
+
+
+def _write_jsonl(rows: list[dict], path: str):
+    with open(path, "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False))
+            f.write("\n")
+
+
+def _write_parquet(rows: list[dict], path: str):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export requires pyarrow: pip install pyarrow") from None
+    table = pa.Table.from_pylist(rows, schema=pa.schema([
+        ("call_file", pa.string()),
+        ("phone", pa.string()),
+        ("agent", pa.string()),
+        ("room", pa.string()),
+        ("call_started_at", pa.string()),
+        ("call_duration", pa.float64()),
+        ("call_index", pa.int32()),
+        ("turn_index", pa.int32()),
+        ("timestamp", pa.string()),
+        ("speaker", pa.string()),
+        ("text", pa.string()),
+    ]))
+    pq.write_table(table, path, compression="zstd")
+
+
+class TranscriptExporter:
+    """
+    Export archived transcripts to JSONL or Parquet, parsing files across a
+    process pool. Incremental runs only pick up calls that were not part of a
+    previous export, tracked in <out_dir>/export_state.json.
+    """
+
+    def __init__(self, archive: Optional[TranscriptArchive] = None, out_dir: str = EXPORT_DIR, workers: Optional[int] = None):
+        self.archive = archive or TranscriptArchive()
+        self.out_dir = out_dir
+        self.workers = workers or os.cpu_count() or 1
+        self.state_path = os.path.join(out_dir, STATE_NAME)
+
+    def _load_exported(self) -> set[str]:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return set(json.load(f).get("exported", []))
+        except (OSError, ValueError):
+            return set()
+
+    def _save_exported(self, exported: set[str]):
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"updated_at": time.time(), "exported": sorted(exported)}, f)
+        os.replace(tmp, self.state_path)
+
+    def export(
+        self,
+        *,
+        fmt: str = "jsonl",
+        since: Optional[date] = None,
+        until: Optional[date] = None,
+        incremental: bool = False,
+    ) -> dict:
+        if fmt not in ("jsonl", "parquet"):
+            raise ValueError(f"unsupported export format: {fmt}")
+        os.makedirs(self.out_dir, exist_ok=True)
+        started = time.perf_counter()
+
+        exported = self._load_exported() if incremental else set()
+        now = time.time()
+        calls = [
+            call
+            for call in self.archive.list_calls(since=since, until=until)
+            if _call_key(call) not in exported
+            and not (call["duration"] is None and now - call["started_at"].timestamp() < IN_PROGRESS_GRACE)
+        ]
+        calls.reverse()  # oldest first
+
+        rows = []
+        if calls:
+            chunksize = max(1, len(calls) // (self.workers * 4))
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                for call_rows in pool.map(_parse_call, calls, chunksize=chunksize):
+                    rows.extend(call_rows)
+
+        path = None
+        if rows:
+            stem = os.path.join(self.out_dir, f"transcripts_{datetime.now().strftime('%Y%m%d-%H%M%S')}")
+            path, n = f"{stem}.{fmt}", 1
+            while os.path.exists(path):
+                path, n = f"{stem}_{n}.{fmt}", n + 1
+            if fmt == "parquet":
+                _write_parquet(rows, path)
+            else:
+                _write_jsonl(rows, path)
+
+        if incremental:
+            self._save_exported(exported | {_call_key(call) for call in calls})
+
+        elapsed = time.perf_counter() - started
+        return {
+            "path": path,
+            "calls": len(calls),
+            "rows": len(rows),
+            "seconds": elapsed,
+            "calls_per_second": len(calls) / elapsed if elapsed > 0 else 0.0,
+        }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Export call transcripts for analytics")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl")
+    parser.add_argument("--since", type=date.fromisoformat, help="first day to export (YYYY-MM-DD)")
+    parser.add_argument("--until", type=date.fromisoformat, help="last day to export (YYYY-MM-DD)")
+    parser.add_argument("--incremental", action="store_true", help="only export calls added since the last incremental run")
+    parser.add_argument("--out", default=EXPORT_DIR)
+    parser.add_argument("--workers", type=int, default=None, help="parser processes (default: one per CPU core)")
+    args = parser.parse_args()
+
+    result = TranscriptExporter(out_dir=args.out, workers=args.workers).export(
+        fmt=args.format, since=args.since, until=args.until, incremental=args.incremental
+    )
+    if result["path"]:
+        print(f"exported {result['calls']} calls ({result['rows']} turns) to {result['path']}")
+    else:
+        print("nothing to export")
+    print(f"{result['seconds']:.2f}s, {result['calls_per_second']:.1f} calls/s")
@@ -0,0 +1,321 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+import numpy as np
+
+
+logger = logging.getLogger("faq-cache")
+
+FAQ_FILE = os.getenv("FAQ_CACHE_FILE", os.path.join("data", "faq_cache.json"))
+EMBEDDING_MODEL = os.getenv("FAQ_EMBEDDING_MODEL", "BAAI/bge-small-en-v1.5")
+
+# Canonical answers taken from the clinic facts in agent2.py's system prompt.
+# Every entry lists a few phrasings; more are learned from past transcripts.
+CLINIC_FAQ = [
+    {
+        "answer": "We're open from 8 AM to 6 PM every day, except Sunday when the clinic is closed.",
+        "questions": [
+            "what are your timings",
+            "what time do you open",
+            "when are you open",
+            "what are the clinic hours",
+            "till what time are you open",
+            "are you open on sunday",
+            "what time does the clinic close",
+        ],
+    },
+    {
+        "answer": "We have three centers, in Delhi, Govardhan and Udupi. Which one is closest to you?",
+        "questions": [
+            "where are your centers",
+            "where is the clinic located",
+            "which cities do you have clinics in",
+            "what is your address",
+            "do you have a center in delhi",
+            "where are you located",
+        ],
+    },
+    {
+        "answer": "Dr. Ramesh is an Ayurvedic practitioner who focuses on holistic healing and natural treatments, things like digestion problems, stress and joint pain.",
+        "questions": [
+            "what does dr ramesh treat",
+            "who is dr ramesh",
+            "what kind of doctor is dr ramesh",
+            "what treatments do you offer",
+            "what problems can the doctor help with",
+            "does the doctor treat joint pain",
+        ],
+    },
+]
+
+
+class HashingEmbedder:
+    """
+    Dependency-free fallback: L2-normalised hashed character trigrams. Much
+    weaker than a neural model, so it is used with a stricter threshold.
+    """
+
+    default_threshold = 0.75
+
+    def __init__(self, dim: int = 2048):
+        self.dim = dim
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            padded = f"  {text} "
+            for j in range(len(padded) - 2):
+                h = int.from_bytes(hashlib.blake2b(padded[j:j + 3].encode(), digest_size=4).digest(), "little")
+                out[i, h % self.dim] += 1.0
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        return out / np.maximum(norms, 1e-9)
+
+
+class FastEmbedder:
+    """Small ONNX sentence embedding model running on CPU (fastembed)"""
+
+    default_threshold = 0.86
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL):
+        from fastembed import TextEmbedding
+
+        self._model = TextEmbedding(model_name=model_name)
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        vectors = np.array(list(self._model.embed(texts)), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-9)
+
+
+def load_embedder():
+    try:
+        return FastEmbedder()
+    except ImportError:
+        logger.info("fastembed is not installed, using the hashing embedder for the FAQ cache")
+        return HashingEmbedder()
+
+
+def _normalize(text: str) -> str:
+    text = text.lower().replace("dr.", "dr")
+    return re.sub(r"[^\w\s]", " ", text).strip()
+
+
+@dataclass
+class FAQHit:
+    answer: str
+    question: str
+    score: float
+    lookup_ms: float
+
+
+@dataclass
+class FAQStats:
+    lookups: int = 0
+    hits: int = 0
+    lookup_ms_total: float = 0.0
+    # running average of what a miss costs: LLM time to first token plus TTS time to first byte
+    llm_ttft_total: float = 0.0
+    llm_ttft_count: int = 0
+    tts_ttfb_total: float = 0.0
+    tts_ttfb_count: int = 0
+    per_answer: dict[str, int] = field(default_factory=dict)
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    @property
+    def saved_ms_per_hit(self) -> float:
+        llm = self.llm_ttft_total / self.llm_ttft_count if self.llm_ttft_count else 0.0
+        tts = self.tts_ttfb_total / self.tts_ttfb_count if self.tts_ttfb_count else 0.0
+        lookup = self.lookup_ms_total / self.lookups if self.lookups else 0.0
+        return max(0.0, (llm + tts) * 1000 - lookup)
+
+    def summary(self) -> dict:
+        return {
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": self.hit_rate,
+            "avg_lookup_ms": self.lookup_ms_total / self.lookups if self.lookups else 0.0,
+            "saved_ms_per_hit": self.saved_ms_per_hit,
+            "saved_ms_total": self.saved_ms_per_hit * self.hits,
+        }
+
+
+class FAQCache:
+    """
+    Semantic cache of canned answers. Questions are embedded on CPU and
+    matched by cosine similarity against a small in-memory matrix; a hit
+    above `threshold` is answered without an LLM round-trip.
+    """
+
+    def __init__(self, entries: Optional[list[dict]] = None, embedder=None, threshold: Optional[float] = None):
+        self.embedder = embedder or load_embedder()
+        self.threshold = threshold if threshold is not None else self.embedder.default_threshold
+        self.entries = entries if entries is not None else load_entries()
+        self.stats = FAQStats()
+        self._build()
+
+    def _build(self):
+        self._questions: list[str] = []
+        self._answers: list[str] = []
+        for entry in self.entries:
+            for question in entry["questions"]:
+                self._questions.append(_normalize(question))
+                self._answers.append(entry["answer"])
+        self._matrix = self.embedder.embed(self._questions) if self._questions else np.zeros((0, 1), np.float32)
+
+    @property
+    def answers(self) -> list[str]:
+        return [entry["answer"] for entry in self.entries]
+
+    def lookup(self, text: str) -> Optional[FAQHit]:
+        started = time.perf_counter()
+        query = _normalize(text)
+        hit = None
+        # answers are English; leave other scripts and long, multi-part turns to the LLM
+        if query and query.isascii() and len(query.split()) <= 16 and len(self._questions):
+            scores = self._matrix @ self.embedder.embed([query])[0]
+            best = int(np.argmax(scores))
+            if scores[best] >= self.threshold:
+                hit = FAQHit(self._answers[best], self._questions[best], float(scores[best]), 0.0)
+        lookup_ms = (time.perf_counter() - started) * 1000
+
+        self.stats.lookups += 1
+        self.stats.lookup_ms_total += lookup_ms
+        if hit is not None:
+            hit.lookup_ms = lookup_ms
+            self.stats.hits += 1
+            self.stats.per_answer[hit.answer] = self.stats.per_answer.get(hit.answer, 0) + 1
+        return hit
+
+    def record_miss_cost(self, *, llm_ttft: Optional[float] = None, tts_ttfb: Optional[float] = None):
+        """Feed latency metrics so the saving per hit can be estimated"""
+        if llm_ttft is not None and llm_ttft > 0:
+            self.stats.llm_ttft_total += llm_ttft
+            self.stats.llm_ttft_count += 1
+        if tts_ttfb is not None and tts_ttfb > 0:
+            self.stats.tts_ttfb_total += tts_ttfb
+            self.stats.tts_ttfb_count += 1
+
+    def learn_from_transcripts(self, calls: list[list[dict]], min_score: Optional[float] = None) -> int:
+        """
+        Add caller phrasings from past calls as extra keys for existing
+        answers. Only questions that the agent answered with (roughly) the
+        canonical answer are learned, so no unreviewed answer text is added.
+        """
+        min_score = min_score if min_score is not None else self.threshold * 0.9
+        answer_vectors = self.embedder.embed([_normalize(a) for a in self.answers]) if self.entries else None
+        known = set(self._questions)
+        learned = 0
+        for call in calls:
+            for turn, reply in zip(call, call[1:]):
+                if turn["speaker"] != "User" or reply["speaker"] != "Agent":
+                    continue
+                question = _normalize(turn["text"])
+                if not question or question in known or not question.isascii() or len(question.split()) > 16:
+                    continue
+                reply_scores = answer_vectors @ self.embedder.embed([_normalize(reply["text"])])[0]
+                best = int(np.argmax(reply_scores))
+                if reply_scores[best] < min_score:
+                    continue
+                self.entries[best]["questions"].append(question)
+                known.add(question)
+                learned += 1
+        if learned:
+            self._build()
+        return learned
+
+
+def load_entries(path: str = FAQ_FILE) -> list[dict]:
+    """Learned entries from disk, falling back to the seed answers"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return [{"answer": e["answer"], "questions": list(e["questions"])} for e in CLINIC_FAQ]
+
+
+def save_entries(entries: list[dict], path: str = FAQ_FILE):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(entries, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+async def answer_from_cache(cache: FAQCache, agent, chat_ctx) -> bool:
+    """
+    before_llm_cb helper: when the caller's last turn is a confident FAQ hit,
+    speak the canned answer and skip the LLM. Returns True on a hit.
+    """
+    if not chat_ctx.messages or chat_ctx.messages[-1].role != "user":
+        return False
+    question = chat_ctx.messages[-1].content
+    if not isinstance(question, str):
+        return False
+    hit = cache.lookup(question)
+    if hit is None:
+        return False
+    logger.info(f"FAQ cache hit ({hit.score:.2f}, {hit.lookup_ms:.1f} ms) for {question!r}")
+    reply_without_llm(agent, chat_ctx, hit.answer)
+    return True
+
+
+# replies being spoken without the LLM, held so the tasks are not garbage-collected mid-reply
+_replies: set[asyncio.Task] = set()
+
+
+def _reply_done(task: asyncio.Task):
+    _replies.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("reply without the LLM failed", exc_info=task.exception())
+
+
+def reply_without_llm(agent, chat_ctx, text: str) -> asyncio.Task:
+    """Speak `text` as the reply to the caller's last turn from inside before_llm_cb"""
+    # the cancelled reply would never commit the caller's turn, so do it here
+    user_msg = chat_ctx.messages[-1]
+    agent.chat_ctx.messages.append(user_msg)
+    agent.emit("user_speech_committed", user_msg)
+    task = asyncio.create_task(agent.say(text, allow_interruptions=True))
+    _replies.add(task)
+    task.add_done_callback(_reply_done)
+    return task
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from transcript_archive import TranscriptArchive, parse_log_content
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Build the FAQ answer cache from past transcripts")
+    parser.add_argument("--query", action="append", default=[], help="look up a question instead of learning")
+    args = parser.parse_args()
+
+    cache = FAQCache()
+    if args.query:
+        for q in args.query:
+            hit = cache.lookup(q)
+            print(f"{q!r} -> {hit.answer if hit else 'MISS'} ({hit.score:.2f})" if hit else f"{q!r} -> MISS")
+    else:
+        archive = TranscriptArchive()
+        calls = []
+        for call in archive.list_calls():
+            try:
+                calls.extend(parse_log_content(archive.read_text(call["file"])))
+            except OSError:
+                pass
+        learned = cache.learn_from_transcripts(calls)
+        save_entries(cache.entries)
+        print(f"learned {learned} phrasings from {len(calls)} calls")
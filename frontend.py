@@ -1,10 +1,16 @@
 import streamlit as st
 import pandas as pd
-import subprocess
+import json
 import os
 import time
 from datetime import datetime
-import re
+
+import call_trace
+import rate_limiter
+import recording
+import supervisor
+from call_events import CallEventStore
+from transcript_archive import TranscriptArchive, parse_log_content
 
 # Page configuration
 st.set_page_config(
@@ -111,74 +117,12 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+transcript_archive = TranscriptArchive()
+
 # Helper functions
-def get_transcription_files():
-    """Get all transcription log files from the transcriptions folder"""
-    files = []
-    
-    # Make sure the folder exists
-    if not os.path.exists("transcriptions"):
-        return files
-        
-    for file in os.listdir("transcriptions"):
-        if file.startswith("transcriptions_") and file.endswith(".log"):
-            # Extract phone number from filename
-            # phone = file.replace("transcriptions_", "").replace(".log", "")
-            # files.append({"file": os.path.join("transcriptions", file), "phone": phone})
-            parts = file.replace(".log", "").split("_")
-            if len(parts) >= 2:
-                phone = parts[1]
-                files.append({"file": os.path.join("transcriptions", file), "phone": phone})
-    return files
-
-def parse_log_content(content):
-    """Parse log content into calls"""
-    calls = []
-    current_call = []
-    current_timestamp = None
-    
-    for line in content.split('\n'):
-        if line.startswith('['):
-            # Extract timestamp
-            timestamp_match = re.match(r'\[(.*?)\]', line)
-            if timestamp_match:
-                timestamp_str = timestamp_match.group(1)
-                try:
-                    timestamp = datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S.%f')
-                except ValueError:
-                    try:
-                        timestamp = datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
-                    except:
-                        timestamp = None
-                
-                if current_timestamp is None:
-                    current_timestamp = timestamp
-                elif timestamp and (timestamp - current_timestamp).total_seconds() > 600:
-                    # If more than 10 minutes passed, consider it a new call
-                    if current_call:
-                        calls.append(current_call)
-                        current_call = []
-                    current_timestamp = timestamp
-            
-            # Extract speaker and text
-            if "USER:" in line:
-                speaker = "User"
-                text = line.split("USER:")[1].strip()
-                current_call.append({"timestamp": timestamp_str if timestamp_match else "", 
-                                    "speaker": speaker, 
-                                    "text": text})
-            elif "AGENT:" in line:
-                speaker = "Agent"
-                text = line.split("AGENT:")[1].strip()
-                current_call.append({"timestamp": timestamp_str if timestamp_match else "", 
-                                    "speaker": speaker, 
-                                    "text": text})
-    
-    # Add the last call if it exists
-    if current_call:
-        calls.append(current_call)
-    
-    return calls
+def get_transcription_files(phone=None, day=None):
+    """Get transcription log files from the archive manifest"""
+    return transcript_archive.list_calls(phone=phone, day=day)
 
 def read_transcription(file_path):
     """Read and parse a specific transcription log file"""
@@ -186,65 +130,52 @@ def read_transcription(file_path):
         return []
     
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        return parse_log_content(content)
+        return parse_log_content(transcript_archive.read_text(file_path))
     except Exception as e:
         st.error(f"Error reading file {file_path}: {e}")
         return []
 
-def read_all_transcriptions():
-    """Read all transcription logs"""
+def read_all_transcriptions(phone=None):
+    """Read all transcription logs, optionally only those of one phone number, with each call's room if known"""
     all_calls = []
+    rooms = []
     
-    # Check if the transcriptions folder exists
-    if not os.path.exists("transcriptions"):
-        return all_calls
-        
     # Read the default transcriptions.log file if it exists
-    default_log = os.path.join("transcriptions", "transcriptions.log")
-    if os.path.exists(default_log):
+    default_log = os.path.join(transcript_archive.root, "transcriptions.log")
+    if phone is None and os.path.exists(default_log):
         try:
             with open(default_log, 'r', encoding='utf-8') as f:
                 content = f.read()
             calls = parse_log_content(content)
             all_calls.extend(calls)
+            rooms.extend([None] * len(calls))
         except Exception as e:
             st.error(f"Error reading default log: {e}")
     
     # Also check for phone-specific files
-    for file_info in get_transcription_files():
+    for file_info in get_transcription_files(phone=phone):
         calls_from_file = read_transcription(file_info["file"])
         all_calls.extend(calls_from_file)
+        rooms.extend([file_info["room"]] * len(calls_from_file))
     
-    return all_calls
+    return all_calls, rooms
 
 def start_agent():
-    """Start the agent in a separate process"""
+    """Start the worker supervisor in the background"""
     try:
-        # Assuming the actual agent script is named "agent.py" instead of trying to run paste.txt
-        process = subprocess.Popen(['python', 'agent2.py', "dev"], shell=True)
-        st.session_state.agent_process = process
-        st.session_state.agent_running = True
+        supervisor.launch_detached()
         return True
     except Exception as e:
         st.error(f"Failed to start agent: {e}")
         return False
 
 def stop_agent():
-    """Stop the running agent process"""
-    if 'agent_process' in st.session_state and st.session_state.agent_process:
-        st.session_state.agent_process.terminate()
-        st.session_state.agent_process = None
-        st.session_state.agent_running = False
-        return True
-    return False
+    """Ask the supervisor to drain active calls and stop its workers"""
+    return supervisor.request_stop()
 
-# Initialize session state
-if 'agent_running' not in st.session_state:
-    st.session_state.agent_running = False
-if 'agent_process' not in st.session_state:
-    st.session_state.agent_process = None
+# The supervisor runs detached, so its status survives browser refreshes
+supervisor_status = supervisor.read_status()
+agent_running = supervisor_status is not None and supervisor_status.get("state") != "draining"
 
 # Header
 st.markdown("<div class='header'><h1 style='text-align: center;'>Dr. Ramesh's Ayurveda Clinic Voice Bot Dashboard</h1></div>", unsafe_allow_html=True)
@@ -253,34 +184,76 @@ st.markdown("<div class='header'><h1 style='text-align: center;'>Dr. Ramesh's Ay
 st.sidebar.title("Control Panel")
 
 # Agent status
-status_class = "agent-running" if st.session_state.agent_running else "agent-stopped"
-status_text = "RUNNING" if st.session_state.agent_running else "STOPPED"
+status_class = "agent-running" if agent_running else "agent-stopped"
+if supervisor_status is None:
+    status_text = "STOPPED"
+elif supervisor_status.get("state") == "draining":
+    status_text = "DRAINING"
+else:
+    status_text = "RUNNING"
 st.sidebar.markdown(f"<div class='agent-status {status_class}'>Agent Status: {status_text}</div>", unsafe_allow_html=True)
 
 # Start/Stop buttons
 col1, col2 = st.sidebar.columns(2)
 with col1:
-    if st.button("Start Agent", disabled=st.session_state.agent_running):
+    if st.button("Start Agent", disabled=supervisor_status is not None):
         if start_agent():
             st.sidebar.success("Agent started successfully!")
             time.sleep(1)
             st.rerun()
 
 with col2:
-    if st.button("Stop Agent", disabled=not st.session_state.agent_running):
+    if st.button("Stop Agent", disabled=not agent_running):
         if stop_agent():
-            st.sidebar.success("Agent stopped successfully!")
+            st.sidebar.success("Agent is draining active calls and will stop when they finish")
             time.sleep(1)
             st.rerun()
 
+# Per-worker load
+if supervisor_status and supervisor_status.get("workers"):
+    workers = supervisor_status["workers"]
+    st.sidebar.markdown(f"**Workers:** {sum(w['alive'] for w in workers)}/{len(workers)} up, "
+                        f"{sum(w['active_calls'] for w in workers)} active calls")
+    st.sidebar.dataframe(pd.DataFrame([{
+        "Worker": w["worker_id"],
+        "PID": w["pid"],
+        "Healthy": w["healthy"],
+        "Active Calls": w["active_calls"],
+        "Load": f"{w['load']:.0%}",
+        "Idle": f"{w.get('idle_processes', 0)}/{w.get('target_idle', 0)}",
+        "Cold Starts": w.get("cold_starts", 0),
+        "Restarts": w["restarts"],
+    } for w in workers]), hide_index=True)
+
+# Recording upload backlog
+upload_stats = recording.read_stats() if supervisor_status else None
+if upload_stats:
+    st.sidebar.markdown(
+        f"**Recording uploads:** {upload_stats['throughput_bytes_per_sec'] / 1024:.0f} KB/s, "
+        f"backlog {upload_stats['backlog_files']} segments ({upload_stats['backlog_bytes'] / 1024 / 1024:.1f} MB)"
+    )
+
+# Host-wide provider rate limits
+limiter_stats = rate_limiter.read_stats() if supervisor_status else None
+if limiter_stats:
+    st.sidebar.markdown("**Provider rate limits**")
+    st.sidebar.dataframe(pd.DataFrame([{
+        "Bucket": b["bucket"],
+        "Utilization": f"{b['utilization']:.0%}",
+        "Backlog": f"{b['backlog_seconds']:.1f}s",
+        "Queued": b["queued"],
+        "Rerouted": b["rejected"],
+    } for b in limiter_stats]), hide_index=True)
+
 # Display phone number
 st.markdown("<div class='phone-number'>📞 Call this number to talk to the voice bot: <b>+918035737225</b></div>", unsafe_allow_html=True)
 
 # Dashboard stats
 # Get all transcription files
-transcription_files = get_transcription_files()
-phone_numbers = [f["phone"] for f in transcription_files]
+phone_numbers = transcript_archive.phones()
 calls = []
+call_rooms = []
+selected_option = "All Calls"
 
 # Add an option to view all calls
 if phone_numbers:
@@ -289,25 +262,35 @@ if phone_numbers:
     
     if selected_option == "All Calls":
         # Show all calls across all files
-        calls = read_all_transcriptions()
+        calls, call_rooms = read_all_transcriptions()
     else:
         # Show calls for selected phone number
-        selected_file = next((f["file"] for f in transcription_files if f["phone"] == selected_option), None)
-        if selected_file:
-            calls = read_transcription(selected_file)
+        calls, call_rooms = read_all_transcriptions(phone=selected_option)
 else:
     st.info("No call logs found in the transcriptions folder. Start the agent and make a call to generate logs.")
 
+# Headline numbers come from the precomputed call-event rollups; transcripts
+# are only text-matched for calls without events, recorded before the event
+# store existed, and their counts are added to the rollups
+event_store = CallEventStore()
+if selected_option == "All Calls":
+    rollup = event_store.rollup()
+else:
+    rollup = event_store.rollup("phone", selected_option)
+recorded = event_store.recorded_calls([room for room in call_rooms if room])
+older_calls = [call for call, room in zip(calls, call_rooms) if room not in recorded]
+
 col1, col2, col3 = st.columns(3)
 
 with col1:
-    st.markdown(f"<div class='stats-card'><h3>Total Calls</h3><h2>{len(calls)}</h2></div>", unsafe_allow_html=True)
+    total_calls = int(rollup.get("calls", 0)) + len(older_calls)
+    st.markdown(f"<div class='stats-card'><h3>Total Calls</h3><h2>{total_calls}</h2></div>", unsafe_allow_html=True)
 
 with col2:
     # Calculate average call duration
-    total_duration = 0
-    valid_calls = 0
-    for call in calls:
+    total_duration = rollup.get("duration_seconds", 0.0) / 60
+    valid_calls = int(rollup.get("ended_calls", 0))
+    for call in older_calls:
         if len(call) >= 2:
             try:
                 start_time = datetime.strptime(call[0]['timestamp'].strip(), '%Y-%m-%d %H:%M:%S.%f')
@@ -317,19 +300,19 @@ with col2:
                 valid_calls += 1
             except Exception:
                 pass
-    
+
     avg_duration = total_duration / valid_calls if valid_calls else 0
     st.markdown(f"<div class='stats-card'><h3>Avg. Call Duration</h3><h2>{avg_duration:.1f} mins</h2></div>", unsafe_allow_html=True)
 
 with col3:
     # Count appointments made
-    appointment_count = 0
-    for call in calls:
+    appointment_count = int(rollup.get("appointments", 0))
+    for call in older_calls:
         for message in call:
             if message['speaker'] == 'Agent' and 'reservation confirmed' in message['text'].lower():
                 appointment_count += 1
                 break
-    
+
     st.markdown(f"<div class='stats-card'><h3>Appointments Made</h3><h2>{appointment_count}</h2></div>", unsafe_allow_html=True)
 
 # Call logs
@@ -370,6 +353,19 @@ else:
                     else:
                         st.markdown(f"<div class='agent-message'><strong>🤖 {msg['speaker']}:</strong> {msg['text']}</div>", unsafe_allow_html=True)
 
+                # per-turn latency, from the call's trace if it was kept
+                trace = call_trace.read_trace(call_rooms[i]) if call_rooms[i] else None
+                if trace is not None:
+                    st.write("#### Timing")
+                    st.dataframe(pd.DataFrame(call_trace.turn_table(trace)), hide_index=True)
+                    st.download_button(
+                        "Download trace (open in ui.perfetto.dev)",
+                        data=json.dumps(trace),
+                        file_name=f"{call_rooms[i]}.json",
+                        mime="application/json",
+                        key=f"trace-{i}",
+                    )
+
 # About section
 st.sidebar.markdown("---")
 st.sidebar.header("About")
@@ -0,0 +1,261 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
+
+from livekit.agents import APIConnectOptions, llm
+
+
+logger = logging.getLogger("hedged-llm")
+
+# hedging and failover replace the inner streams' own retries
+_NO_RETRY = APIConnectOptions(max_retry=0, timeout=10.0)
+
+
+async def _next_chunk(stream: llm.LLMStream) -> Optional[llm.ChatChunk]:
+    try:
+        return await stream.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+@dataclass
+class HedgeStats:
+    requests: int = 0
+    hedged: int = 0
+    hedge_wins: int = 0
+    failovers: int = 0
+    failures: int = 0
+    latency_gained: float = 0.0
+
+    @property
+    def hedge_rate(self) -> float:
+        return self.hedged / self.requests if self.requests else 0.0
+
+    def summary(self) -> dict:
+        return {
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_rate": self.hedge_rate,
+            "hedge_wins": self.hedge_wins,
+            "failovers": self.failovers,
+            "failures": self.failures,
+            "latency_gained_ms": self.latency_gained * 1000,
+        }
+
+
+class HedgedLLM(llm.LLM):
+    """
+    Sends each request to `primary`; if no token has arrived by a deadline
+    derived from the primary's recent p95 time-to-first-token, the same
+    request is also sent to `secondary` and whichever stream starts first is
+    used. Errors (including 429s) on the primary before its first token fail
+    over to the secondary immediately.
+    """
+
+    def __init__(
+        self,
+        primary: llm.LLM,
+        secondary: llm.LLM,
+        *,
+        percentile: float = 0.95,
+        min_deadline: float = 0.3,
+        max_deadline: float = 2.5,
+        initial_deadline: float = 1.0,
+        window: int = 200,
+    ):
+        super().__init__()
+        self.primary = primary
+        self.secondary = secondary
+        self.percentile = percentile
+        self.min_deadline = min_deadline
+        self.max_deadline = max_deadline
+        self.initial_deadline = initial_deadline
+        self._ttfts: deque[float] = deque(maxlen=window)
+        self.stats = HedgeStats()
+
+    def deadline(self) -> float:
+        if len(self._ttfts) < 20:
+            return self.initial_deadline
+        ordered = sorted(self._ttfts)
+        p = ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile))]
+        return min(self.max_deadline, max(self.min_deadline, p))
+
+    def record_primary_ttft(self, ttft: float):
+        self._ttfts.append(ttft)
+
+    def expected_primary_ttft_after(self, elapsed: float) -> float:
+        """
+        Estimated TTFT of a primary that had not started by `elapsed`: the
+        mean of its recorded TTFTs slower than that, or `max_deadline` if none
+        were. The loser is cancelled, so this stands in for its real TTFT.
+        """
+        slower = [t for t in self._ttfts if t > elapsed]
+        return max(elapsed, sum(slower) / len(slower) if slower else self.max_deadline)
+
+    def chat(
+        self,
+        *,
+        chat_ctx: llm.ChatContext,
+        conn_options: APIConnectOptions = _NO_RETRY,
+        fnc_ctx: Optional[llm.FunctionContext] = None,
+        **kwargs,
+    ) -> "HedgedLLMStream":
+        return HedgedLLMStream(self, chat_ctx=chat_ctx, fnc_ctx=fnc_ctx, conn_options=conn_options, chat_kwargs=kwargs)
+
+
+class HedgedLLMStream(llm.LLMStream):
+    def __init__(
+        self,
+        hedged: HedgedLLM,
+        *,
+        chat_ctx: llm.ChatContext,
+        fnc_ctx: Optional[llm.FunctionContext],
+        conn_options: APIConnectOptions,
+        chat_kwargs: dict,
+    ):
+        # failover is handled here, so the base class must not retry the whole race
+        super().__init__(hedged, chat_ctx=chat_ctx, fnc_ctx=fnc_ctx, conn_options=APIConnectOptions(max_retry=0, timeout=conn_options.timeout))
+        self._hedged = hedged
+        self._chat_kwargs = {k: v for k, v in chat_kwargs.items() if v is not None}
+
+    def _start(self, model: llm.LLM) -> tuple[llm.LLMStream, asyncio.Task]:
+        stream = model.chat(chat_ctx=self._chat_ctx, fnc_ctx=self._fnc_ctx, conn_options=_NO_RETRY, **self._chat_kwargs)
+        return stream, asyncio.create_task(_next_chunk(stream))
+
+    def _forward(self, chunk: llm.ChatChunk):
+        for choice in chunk.choices:
+            if choice.delta.tool_calls:
+                self._function_calls_info.extend(choice.delta.tool_calls)
+        self._event_ch.send_nowait(chunk)
+
+    async def _run(self) -> None:
+        hedged = self._hedged
+        stats = hedged.stats
+        stats.requests += 1
+        started = time.perf_counter()
+
+        primary, primary_task = self._start(hedged.primary)
+        racers: dict[asyncio.Task, llm.LLMStream] = {primary_task: primary}
+        secondary_started = False
+
+        def start_secondary():
+            nonlocal secondary_started
+            secondary_started = True
+            stream, task = self._start(hedged.secondary)
+            racers[task] = stream
+
+        await asyncio.wait({primary_task}, timeout=hedged.deadline())
+        hedge_fired = not primary_task.done()
+        if hedge_fired:
+            stats.hedged += 1
+            start_secondary()
+
+        winner: Optional[tuple[llm.LLMStream, Optional[llm.ChatChunk]]] = None
+        last_error: Optional[BaseException] = None
+        try:
+            while racers and winner is None:
+                done, _ = await asyncio.wait(racers.keys(), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    stream = racers.pop(task)
+                    if task.exception() is None:
+                        winner = (stream, task.result())
+                        break
+                    last_error = task.exception()
+                    logger.warning(f"{'primary' if stream is primary else 'secondary'} LLM failed: {last_error}")
+                    await stream.aclose()
+                    if stream is primary and not secondary_started:
+                        stats.failovers += 1
+                        start_secondary()
+        finally:
+            ttft = time.perf_counter() - started
+            if winner is not None and winner[0] is not primary and hedge_fired and primary_task in racers:
+                stats.hedge_wins += 1
+                stats.latency_gained += hedged.expected_primary_ttft_after(ttft) - ttft
+            # losers (or everything, if we are being cancelled ourselves) are cancelled
+            for task, stream in racers.items():
+                task.cancel()
+                await stream.aclose()
+
+        if winner is None:
+            stats.failures += 1
+            raise last_error or RuntimeError("no LLM produced a response")
+
+        stream, first_chunk = winner
+        if stream is primary:
+            hedged.record_primary_ttft(ttft)
+
+        try:
+            if first_chunk is not None:
+                self._forward(first_chunk)
+                async for chunk in stream:
+                    self._forward(chunk)
+        finally:
+            await stream.aclose()
+
+
+def with_fallback(primary: llm.LLM) -> llm.LLM:
+    """Hedge `primary` with the model named by LLM_HEDGE_MODEL (OpenAI), unless it is set to "off" """
+    model = os.getenv("LLM_HEDGE_MODEL", "gpt-4o-mini")
+    if model == "off":
+        return primary
+    from livekit.plugins import openai
+
+    from rate_limiter import limited
+
+    return HedgedLLM(primary, limited(openai.LLM(model=model, temperature=0.8), "openai", model))
+
+
+async def _bench(requests: int):
+    from livekit.plugins import openai
+
+    from mock_llm_server import create_app, start_server
+
+    # primary: fast but with injected slow requests and 429s; secondary: steady
+    primary_server = await start_server(create_app(ttft=0.08, slow_rate=0.1, slow_ttft=2.0, fail_rate=0.05), 18901)
+    secondary_server = await start_server(create_app(ttft=0.15), 18902)
+    primary = openai.LLM(model="mock-primary", base_url="http://127.0.0.1:18901/v1", api_key="mock")
+    secondary = openai.LLM(model="mock-secondary", base_url="http://127.0.0.1:18902/v1", api_key="mock")
+
+    async def run(model: llm.LLM) -> list[float]:
+        ttfts = []
+        for _ in range(requests):
+            started = time.perf_counter()
+            ttft = None
+            try:
+                async for _ in model.chat(chat_ctx=llm.ChatContext().append(role="user", text="hello")):
+                    if ttft is None:
+                        ttft = time.perf_counter() - started
+            except Exception:
+                ttft = float("inf")
+            ttfts.append(ttft if ttft is not None else float("inf"))
+        return sorted(ttfts)
+
+    def pct(values: list[float], p: float) -> str:
+        value = values[min(len(values) - 1, int(len(values) * p))]
+        return "failed" if value == float("inf") else f"{value * 1000:.0f}ms"
+
+    baseline = await run(primary)
+    hedged = HedgedLLM(primary, secondary)
+    with_hedge = await run(hedged)
+    for name, ttfts in (("primary only", baseline), ("hedged", with_hedge)):
+        print(f"{name:>12}: p50 {pct(ttfts, 0.5)}  p95 {pct(ttfts, 0.95)}  p99 {pct(ttfts, 0.99)}")
+    print(hedged.stats.summary())
+
+    await primary_server.cleanup()
+    await secondary_server.cleanup()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.ERROR)
+    parser = argparse.ArgumentParser(description="Benchmark hedged LLM requests against local mock servers")
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(_bench(args.requests))
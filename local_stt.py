@@ -0,0 +1,631 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import struct
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Optional
+
+import numpy as np
+from livekit.agents import (
+    DEFAULT_API_CONNECT_OPTIONS,
+    APIConnectionError,
+    APIConnectOptions,
+    stt,
+    utils,
+    vad,
+)
+
+from audio_ring import SILERO_SAMPLE_RATE, Overrun, SharedVAD
+from runtime_reports import RUNTIME_DIR, ReportLog, quantile
+
+
+logger = logging.getLogger("local-stt")
+
+LOCAL_STT_DIR = os.path.join(RUNTIME_DIR, "local_stt")
+REPORTS = ReportLog(LOCAL_STT_DIR)
+SOCKET_PATH = os.getenv("LOCAL_STT_SOCKET", os.path.join(RUNTIME_DIR, "local_stt.sock"))
+# started by the supervisor next to the agent workers; PIPELINE_STT=local has no other way to transcribe
+SERVER_ENABLED = os.getenv("LOCAL_STT_SERVER", "on" if os.getenv("PIPELINE_STT") == "local" else "off") == "on"
+
+# faster-whisper (CTranslate2) model, int8 on CPU
+MODEL = os.getenv("LOCAL_STT_MODEL", "small")
+COMPUTE_TYPE = os.getenv("LOCAL_STT_COMPUTE_TYPE", "int8")
+# threads per decode, and decodes in flight at once; together about the host's cores
+CPU_THREADS = int(os.getenv("LOCAL_STT_THREADS", "4"))
+WORKERS = int(os.getenv("LOCAL_STT_WORKERS", str(max(1, (os.cpu_count() or 1) // CPU_THREADS))))
+# utterances from different calls decoded in one encoder/decoder pass
+MAX_BATCH = int(os.getenv("LOCAL_STT_MAX_BATCH", "8"))
+# how often a speaking caller's utterance is re-decoded for an interim transcript
+INTERIM_MS = float(os.getenv("LOCAL_STT_INTERIM_MS", "500"))
+# languages detection may pick from; Hindi is otherwise often heard as Urdu
+LANGUAGES = tuple(os.getenv("LOCAL_STT_LANGUAGES", "en,hi,kn").split(","))
+# time from the VAD's end of speech to the final transcript we aim for
+FINAL_TARGET_MS = 300
+
+SAMPLE_RATE = SILERO_SAMPLE_RATE
+# Whisper sees at most 30s; longer utterances are finalized in windows of this length
+WINDOW_SECONDS = 28
+# interim decodes need this much audio to say anything useful
+_MIN_INTERIM_SECONDS = 0.3
+# a tail this much quieter than the utterance is treated as the silence that ended it
+_QUIET_TAIL_RATIO = 0.1
+_SCHEDULER_TICK = 0.05
+
+# client -> server: kind byte and payload length, then the payload
+# S: start of utterance, A: 16kHz mono int16 audio, E: end of utterance
+_FRAME = struct.Struct("<cI")
+
+
+def _write_message(writer: asyncio.StreamWriter, kind: bytes, payload: bytes = b""):
+    writer.write(_FRAME.pack(kind, len(payload)) + payload)
+
+
+# --- the server: one per host, shared by every call ---
+
+
+class WhisperDecoder:
+    """
+    Batched greedy decoding with faster-whisper's CTranslate2 model, without its
+    segment/VAD pipeline. This uses faster-whisper internals (the model's
+    `model`, `get_ctranslate2_storage`), tested with the version pinned in
+    requirements.txt.
+    """
+
+    def __init__(self, model_name: str = MODEL, compute_type: str = COMPUTE_TYPE, cpu_threads: int = CPU_THREADS, workers: int = WORKERS):
+        from faster_whisper import WhisperModel
+
+        self.model = WhisperModel(model_name, device="cpu", compute_type=compute_type, cpu_threads=cpu_threads, num_workers=workers)
+        self._tokenizers = {}
+
+    def _tokenizer(self, language: str):
+        from faster_whisper.tokenizer import Tokenizer
+
+        tokenizer = self._tokenizers.get(language)
+        if tokenizer is None:
+            tokenizer = Tokenizer(self.model.hf_tokenizer, self.model.model.is_multilingual, task="transcribe", language=language)
+            self._tokenizers[language] = tokenizer
+        return tokenizer
+
+    def decode(self, items: list[tuple[np.ndarray, Optional[str]]]) -> list[tuple[str, str]]:
+        """(text, language) for each (16kHz int16 audio up to 30s, language or None to detect)"""
+        from faster_whisper.audio import pad_or_trim
+        from faster_whisper.transcribe import get_ctranslate2_storage
+
+        features = np.stack(
+            [pad_or_trim(self.model.feature_extractor(audio.astype(np.float32) / 32768.0)) for audio, _ in items]
+        )
+        encoded = self.model.model.encode(get_ctranslate2_storage(features), to_cpu=False)
+        languages = [language for _, language in items]
+        if any(language is None for language in languages):
+            detected = self.model.model.detect_language(encoded)
+            for i, candidates in enumerate(detected):
+                if languages[i] is None:
+                    allowed = [(token[2:-2], p) for token, p in candidates if token[2:-2] in LANGUAGES]
+                    languages[i] = max(allowed, key=lambda c: c[1])[0] if allowed else candidates[0][0][2:-2]
+        prompts = []
+        for language in languages:
+            tokenizer = self._tokenizer(language)
+            prompts.append([*tokenizer.sot_sequence, tokenizer.no_timestamps])
+        results = self.model.model.generate(encoded, prompts, beam_size=1, max_length=224, suppress_blank=True, suppress_tokens=[-1])
+        return [
+            (self._tokenizer(language).decode(result.sequences_ids[0]).strip(), language)
+            for result, language in zip(results, languages)
+        ]
+
+
+@dataclass(eq=False)
+class _Session:
+    writer: asyncio.StreamWriter
+    language: Optional[str]
+    audio: bytearray = field(default_factory=bytearray)
+    utterance: int = 0
+    speaking: bool = False
+    ended: bool = False
+    # samples covered by the last decode, and what it said
+    decoded: int = 0
+    hypothesis: str = ""
+    hypothesis_language: str = ""
+    in_flight: bool = False
+    ended_at: float = 0.0
+
+    @property
+    def samples(self) -> int:
+        return len(self.audio) // 2
+
+    def window_full(self) -> bool:
+        return self.samples >= WINDOW_SECONDS * SAMPLE_RATE
+
+    def due_final(self) -> bool:
+        return not self.in_flight and (self.ended or self.window_full())
+
+    def due_interim(self) -> bool:
+        return (
+            not self.in_flight
+            and self.speaking
+            and self.samples >= _MIN_INTERIM_SECONDS * SAMPLE_RATE
+            and self.samples - self.decoded >= INTERIM_MS * SAMPLE_RATE / 1000
+        )
+
+    def quiet_tail(self) -> bool:
+        """Whether everything after the last decode is quieter than the speech before it"""
+        audio = np.frombuffer(bytes(self.audio), dtype=np.int16).astype(np.float32)
+        head, tail = audio[: self.decoded], audio[self.decoded :]
+        if not len(head):
+            return False
+        if not len(tail):
+            return True
+        return np.sqrt(np.mean(tail**2)) < _QUIET_TAIL_RATIO * np.sqrt(np.mean(head**2))
+
+
+class LocalSTTServer:
+    """
+    Transcribes the utterances of every call on the host with one model. While a
+    caller speaks, their utterance is re-decoded every INTERIM_MS for interim
+    transcripts. At end of speech the final is the last interim when the audio
+    since was silence, and a decode of the whole utterance otherwise. Due
+    utterances from different calls are decoded together in batches of up to
+    MAX_BATCH, finals first.
+    """
+
+    def __init__(self, decoder, *, workers: int = WORKERS, max_batch: int = MAX_BATCH):
+        self.decoder = decoder
+        self.max_batch = max_batch
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="stt-decode")
+        self._free = workers
+        self._sessions: set[_Session] = set()
+        self._wake = asyncio.Event()
+        self.stats = {"batches": 0, "items": 0, "decode_s": 0.0, "audio_s": 0.0, "fast_finals": 0, "finals": 0}
+
+    async def serve(self, path: str = SOCKET_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if os.path.exists(path):
+            os.remove(path)
+        server = await asyncio.start_unix_server(self._handle, path)
+        logger.info(f"local STT listening on {path}")
+        scheduler = asyncio.create_task(self._schedule())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            scheduler.cancel()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            header = json.loads(await reader.readline())
+        except ValueError:
+            writer.close()
+            return
+        session = _Session(writer=writer, language=header.get("language"))
+        self._sessions.add(session)
+        try:
+            while True:
+                kind, size = _FRAME.unpack(await reader.readexactly(_FRAME.size))
+                payload = await reader.readexactly(size) if size else b""
+                if kind == b"S":
+                    session.utterance += 1
+                    session.audio.clear()
+                    session.decoded, session.hypothesis = 0, ""
+                    session.speaking, session.ended = True, False
+                elif kind == b"A":
+                    session.audio += payload
+                elif kind == b"E":
+                    session.speaking, session.ended = False, True
+                    session.ended_at = time.perf_counter()
+                    self._try_fast_final(session)
+                self._wake.set()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._sessions.discard(session)
+            writer.close()
+
+    def _send(self, session: _Session, message: dict):
+        try:
+            session.writer.write(json.dumps(message).encode() + b"\n")
+        except (ConnectionError, RuntimeError):
+            self._sessions.discard(session)
+
+    def _finish(self, session: _Session, text: str, language: str, samples: int, *, fast: bool, split: bool = False):
+        self.stats["finals"] += 1
+        self.stats["fast_finals"] += fast
+        self._send(
+            session,
+            {
+                "type": "final",
+                "utterance": session.utterance,
+                "text": text,
+                "language": language,
+                "audio_ms": samples * 1000 / SAMPLE_RATE,
+                "fast": fast,
+                "final_ms": (time.perf_counter() - session.ended_at) * 1000 if session.ended else 0.0,
+            },
+        )
+        # audio that arrived while this was being decoded belongs to the next window
+        del session.audio[: samples * 2]
+        session.decoded, session.hypothesis = 0, ""
+        # a full window is finalized mid-utterance; the caller is still speaking
+        session.ended = False
+        session.speaking = split
+
+    def _try_fast_final(self, session: _Session):
+        if session.ended and not session.in_flight and session.hypothesis and session.quiet_tail():
+            self._finish(session, session.hypothesis, session.hypothesis_language, session.samples, fast=True)
+
+    async def _schedule(self):
+        last_log = time.monotonic()
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=_SCHEDULER_TICK)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            while self._free > 0:
+                batch = sorted((s for s in self._sessions if s.due_final()), key=lambda s: s.ended_at)
+                interims = sorted((s for s in self._sessions if s.due_interim()), key=lambda s: s.decoded - s.samples)
+                batch = (batch + interims)[: self.max_batch]
+                if not batch:
+                    break
+                self._free -= 1
+                asyncio.create_task(self._run_batch(batch))
+            if time.monotonic() - last_log > 60 and self.stats["audio_s"]:
+                logger.info(f"local STT: {self.stats}, RTF {self.stats['decode_s'] / self.stats['audio_s']:.3f}")
+                last_log = time.monotonic()
+
+    async def _run_batch(self, batch: list[_Session]):
+        jobs = []
+        for session in batch:
+            session.in_flight = True
+            final = session.due_final()
+            audio = np.frombuffer(bytes(session.audio), dtype=np.int16)
+            jobs.append((session, session.utterance, final, len(audio), audio))
+        started = time.perf_counter()
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                self._pool, self.decoder.decode, [(audio, session.language) for session, _, _, _, audio in jobs]
+            )
+        except Exception:
+            logger.exception("decode failed")
+            results = [("", session.language or "en") for session, *_ in jobs]
+        finally:
+            self._free += 1
+            self._wake.set()
+        self.stats["batches"] += 1
+        self.stats["items"] += len(jobs)
+        self.stats["decode_s"] += time.perf_counter() - started
+        self.stats["audio_s"] += sum(n for *_, n, _ in jobs) / SAMPLE_RATE
+        for (session, utterance, final, samples, _), (text, language) in zip(jobs, results):
+            session.in_flight = False
+            if utterance != session.utterance or session not in self._sessions:
+                continue
+            if final:
+                self._finish(session, text, language, samples, fast=False, split=not session.ended)
+                continue
+            session.decoded = samples
+            if text != session.hypothesis:
+                session.hypothesis, session.hypothesis_language = text, language
+                self._send(session, {"type": "interim", "utterance": utterance, "text": text, "language": language})
+            self._try_fast_final(session)
+
+
+def require_server(supervised: bool) -> None:
+    """Fail at startup, not on every call, when nothing will serve SOCKET_PATH"""
+    if (supervised and SERVER_ENABLED) or os.path.exists(SOCKET_PATH):
+        return
+    raise RuntimeError(
+        f"PIPELINE_STT=local but nothing serves {SOCKET_PATH}: "
+        "run the supervisor with LOCAL_STT_SERVER=on, or local_stt.py --serve"
+    )
+
+
+def start_server() -> subprocess.Popen:
+    """Run the server in its own process, for the supervisor"""
+    os.makedirs(RUNTIME_DIR, exist_ok=True)
+    with open(os.path.join(RUNTIME_DIR, "local_stt.log"), "ab") as log:
+        return subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve"], stdout=log, stderr=subprocess.STDOUT)
+
+
+# --- the client: a streaming STT for VoicePipelineAgent ---
+
+
+class LocalSTT(stt.STT):
+    """
+    Streaming STT backed by the host's LocalSTTServer, so no audio leaves the
+    host. Utterance boundaries come from the call's SharedVAD and the audio is
+    read from its ring, so the caller's audio is neither inferred nor buffered
+    a second time. Interim transcripts arrive while the caller is speaking.
+    """
+
+    def __init__(self, vad: SharedVAD, *, language: Optional[str] = None, socket_path: str = SOCKET_PATH):
+        super().__init__(capabilities=stt.STTCapabilities(streaming=True, interim_results=True))
+        self.vad = vad
+        self.language = language
+        self.socket_path = socket_path
+        self.utterances: list[dict] = []
+        # audio before START_OF_SPEECH that silero also keeps
+        self._prefix_seconds = getattr(getattr(vad.inner, "_opts", None), "prefix_padding_duration", 0.5)
+
+    def attach(self, job_ctx) -> "LocalSTT":
+        async def report():
+            if not self.utterances:
+                return
+            data = {"call_id": job_ctx.room.name, "ts": time.time(), "utterances": self.utterances}
+            await asyncio.to_thread(REPORTS.write, os.getenv("AGENT_WORKER_ID", "dev"), data)
+
+        job_ctx.add_shutdown_callback(report)
+        return self
+
+    async def _recognize_impl(self, buffer: utils.AudioBuffer, *, language: Optional[str], conn_options: APIConnectOptions) -> stt.SpeechEvent:
+        frame = utils.merge_frames(buffer)
+        if frame.sample_rate != SAMPLE_RATE or frame.num_channels != 1:
+            raise ValueError(f"local STT takes {SAMPLE_RATE}Hz mono audio")
+        try:
+            reader, writer = await asyncio.open_unix_connection(self.socket_path)
+        except OSError as e:
+            raise APIConnectionError(f"local STT server not reachable at {self.socket_path}") from e
+        try:
+            writer.write(json.dumps({"language": language or self.language}).encode() + b"\n")
+            _write_message(writer, b"S")
+            _write_message(writer, b"A", bytes(frame.data))
+            _write_message(writer, b"E")
+            await writer.drain()
+            while True:
+                message = json.loads(await reader.readline())
+                if message["type"] == "final":
+                    return stt.SpeechEvent(
+                        type=stt.SpeechEventType.FINAL_TRANSCRIPT,
+                        alternatives=[stt.SpeechData(language=message["language"], text=message["text"])],
+                    )
+        except (ValueError, ConnectionError) as e:
+            raise APIConnectionError("local STT server closed the connection") from e
+        finally:
+            writer.close()
+
+    def stream(self, *, language: Optional[str] = None, conn_options: APIConnectOptions = DEFAULT_API_CONNECT_OPTIONS) -> "_LocalSpeechStream":
+        return _LocalSpeechStream(stt_=self, language=language or self.language, conn_options=conn_options)
+
+
+class _LocalSpeechStream(stt.SpeechStream):
+    def __init__(self, *, stt_: LocalSTT, language: Optional[str], conn_options: APIConnectOptions):
+        super().__init__(stt=stt_, conn_options=conn_options)
+        self._local = stt_
+        self._language = language
+        self._id = utils.shortuuid()
+        self._outbox: asyncio.Queue[tuple[bytes, bytes]] = asyncio.Queue()
+        # ring position sent up to while the caller is speaking, None between utterances
+        self._sent: Optional[int] = None
+        self._utterance = 0
+        self._ended_at: dict[int, float] = {}
+        self._interims = 0
+
+    def _request_id(self, utterance: int) -> str:
+        return f"{self._id}-{utterance}"
+
+    def _on_vad_event(self, event: vad.VADEvent):
+        ring = self._local.vad.ring
+        if ring is None or ring.sample_rate != SAMPLE_RATE:
+            return
+        if event.type == vad.VADEventType.START_OF_SPEECH:
+            start = event.samples_index - int((event.speech_duration + self._local._prefix_seconds) * SAMPLE_RATE)
+            self._sent = max(start, ring.written - ring.capacity, 0)
+            self._utterance += 1
+            self._interims = 0
+            self._outbox.put_nowait((b"S", b""))
+            self._event_ch.send_nowait(
+                stt.SpeechEvent(type=stt.SpeechEventType.START_OF_SPEECH, request_id=self._request_id(self._utterance))
+            )
+        if self._sent is None:
+            return
+        try:
+            if ring.written > self._sent:
+                self._outbox.put_nowait((b"A", ring.view(self._sent, ring.written).tobytes()))
+        except Overrun:
+            logger.warning("local STT fell behind the audio ring, audio dropped")
+        self._sent = ring.written
+        if event.type == vad.VADEventType.END_OF_SPEECH:
+            self._outbox.put_nowait((b"E", b""))
+            self._ended_at[self._utterance] = time.perf_counter()
+            self._sent = None
+
+    async def _run(self) -> None:
+        try:
+            reader, writer = await asyncio.open_unix_connection(self._local.socket_path)
+        except OSError as e:
+            raise APIConnectionError(f"local STT server not reachable at {self._local.socket_path}") from e
+        writer.write(json.dumps({"language": self._language}).encode() + b"\n")
+        # a retry starts over on a new connection: the server numbers utterances per connection
+        self._id, self._utterance, self._sent = utils.shortuuid(), 0, None
+        self._ended_at.clear()
+        self._outbox = asyncio.Queue()
+        self._local.vad.add_listener(self._on_vad_event)
+
+        async def send():
+            while True:
+                kind, payload = await self._outbox.get()
+                _write_message(writer, kind, payload)
+                await writer.drain()
+
+        async def receive():
+            while True:
+                line = await reader.readline()
+                if not line:
+                    raise APIConnectionError("local STT server closed the connection")
+                self._on_message(json.loads(line))
+
+        async def drain_input():
+            # the audio is read from the VAD's ring; frames pushed here are only drained
+            async for _ in self._input_ch:
+                pass
+
+        tasks = [asyncio.create_task(send()), asyncio.create_task(receive()), asyncio.create_task(drain_input())]
+        try:
+            # send and receive only return by failing; the input ending is the normal way out
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                error = task.exception()
+                if isinstance(error, APIConnectionError):
+                    raise error
+                if error is not None:
+                    raise APIConnectionError("local STT connection failed") from error
+        finally:
+            self._local.vad.remove_listener(self._on_vad_event)
+            await utils.aio.gracefully_cancel(*tasks)
+            writer.close()
+
+    def _on_message(self, message: dict):
+        utterance = message["utterance"]
+        data = [stt.SpeechData(language=message["language"], text=message["text"])]
+        request_id = self._request_id(utterance)
+        if message["type"] == "interim":
+            self._interims += 1
+            self._event_ch.send_nowait(
+                stt.SpeechEvent(type=stt.SpeechEventType.INTERIM_TRANSCRIPT, request_id=request_id, alternatives=data)
+            )
+            return
+        self._event_ch.send_nowait(stt.SpeechEvent(type=stt.SpeechEventType.FINAL_TRANSCRIPT, request_id=request_id, alternatives=data))
+        ended_at = self._ended_at.pop(utterance, None)
+        if ended_at is None:
+            # a 28s window finalized while the caller is still talking
+            return
+        self._event_ch.send_nowait(stt.SpeechEvent(type=stt.SpeechEventType.END_OF_SPEECH, request_id=request_id))
+        self._local.utterances.append(
+            {
+                "audio_ms": round(message["audio_ms"]),
+                # VAD end of speech to final, as the pipeline sees it
+                "final_ms": round((time.perf_counter() - ended_at) * 1000, 1),
+                "fast": message["fast"],
+                "interims": self._interims,
+                "language": message["language"],
+            }
+        )
+
+
+def summarize(reports: list[dict]) -> dict:
+    utterances = [u for r in reports for u in r["utterances"]]
+    final_ms = [u["final_ms"] for u in utterances]
+    return {
+        "calls": len(reports),
+        "utterances": len(utterances),
+        "final_p50_ms": quantile(final_ms, 0.5),
+        "final_p95_ms": quantile(final_ms, 0.95),
+        "fast_finals": sum(u["fast"] for u in utterances),
+        "interims_per_utterance": sum(u["interims"] for u in utterances) / len(utterances) if utterances else 0.0,
+    }
+
+
+# --- benchmark ---
+
+
+def _load(path: str) -> np.ndarray:
+    import av
+
+    with av.open(path) as container:
+        stream = container.streams.audio[0]
+        resampler = av.AudioResampler(format="s16", layout="mono", rate=SAMPLE_RATE)
+        return np.concatenate([f.to_ndarray().reshape(-1) for frame in container.decode(stream) for f in resampler.resample(frame)])
+
+
+async def _caller(socket_path: str, audio: np.ndarray, offset: float, silence_s: float = 0.55) -> dict:
+    """One call speaking `audio` in real time over the server protocol, then the VAD's trailing silence"""
+    await asyncio.sleep(offset)
+    reader, writer = await asyncio.open_unix_connection(socket_path)
+    writer.write(json.dumps({"language": None}).encode() + b"\n")
+    chunk = SAMPLE_RATE * 32 // 1000
+    spoken = np.concatenate([audio, np.zeros(int(silence_s * SAMPLE_RATE), dtype=np.int16)])
+    interims = []
+
+    async def receive():
+        while True:
+            message = json.loads(await reader.readline())
+            if message["type"] == "final":
+                return message
+            interims.append(message)
+
+    receiver = asyncio.create_task(receive())
+    _write_message(writer, b"S")
+    started = time.perf_counter()
+    for i, start in enumerate(range(0, len(spoken), chunk)):
+        _write_message(writer, b"A", spoken[start : start + chunk].tobytes())
+        await writer.drain()
+        await asyncio.sleep(max(0.0, started + (i + 1) * chunk / SAMPLE_RATE - time.perf_counter()))
+    ended = time.perf_counter()
+    _write_message(writer, b"E")
+    await writer.drain()
+    final = await receiver
+    final_ms = (time.perf_counter() - ended) * 1000
+    writer.close()
+    return {"final_ms": final_ms, "interims": len(interims), "fast": final["fast"], "text": final["text"]}
+
+
+async def _bench(path: str, streams: list[int], workers: int, threads: int):
+    import tempfile
+
+    audio = _load(path)
+    seconds = len(audio) / SAMPLE_RATE
+    decoder = WhisperDecoder(cpu_threads=threads, workers=workers)
+    decoder.decode([(audio[: SAMPLE_RATE], None)])
+    started = time.perf_counter()
+    for _ in range(3):
+        text, language = decoder.decode([(audio, None)])[0]
+    rtf = (time.perf_counter() - started) / 3 / seconds
+    print(f"{path}: {seconds:.1f}s, {MODEL} {COMPUTE_TYPE}, {workers} workers x {threads} threads, {os.cpu_count()} cores")
+    print(f"[{language}] {text}")
+    print(f"real-time factor, one utterance decoded whole: {rtf:.3f}")
+    print("streams  final p50   p95  fast finals  interims/utt  cpu cores busy  batch size")
+    best = 0
+    for n in streams:
+        server = LocalSTTServer(decoder, workers=workers)
+        socket_path = os.path.join(tempfile.mkdtemp(), "stt.sock")
+        serving = asyncio.create_task(server.serve(socket_path))
+        while not os.path.exists(socket_path):
+            await asyncio.sleep(0.01)
+        cpu, wall = time.process_time(), time.perf_counter()
+        # callers start staggered, as on a busy host
+        results = await asyncio.gather(*(_caller(socket_path, audio, offset=i * seconds / n) for i in range(n)))
+        cores = (time.process_time() - cpu) / (time.perf_counter() - wall)
+        serving.cancel()
+        final = [r["final_ms"] for r in results]
+        print(
+            f"{n:7d} {quantile(final, 0.5):10.0f} {quantile(final, 0.95):5.0f} {sum(r['fast'] for r in results):7d}/{n:<4d}"
+            f" {sum(r['interims'] for r in results) / n:13.1f} {cores:15.2f} {server.stats['items'] / max(1, server.stats['batches']):11.1f}"
+        )
+        if quantile(final, 0.95) <= FINAL_TARGET_MS:
+            best = n
+    print(f"streams per core with final p95 <= {FINAL_TARGET_MS}ms: {best / (os.cpu_count() or 1):.1f}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="On-host streaming STT: the shared server, recent calls, or a benchmark")
+    parser.add_argument("--serve", action="store_true", help=f"run the host's STT server on {SOCKET_PATH}")
+    parser.add_argument("--worker", default="dev")
+    parser.add_argument("-n", type=int, default=100, help="number of recent calls")
+    parser.add_argument("--bench", metavar="AUDIO_FILE", help="real-time factor and concurrent streams for one utterance")
+    parser.add_argument("--streams", default="1,2,4,8,16")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--threads", type=int, default=CPU_THREADS)
+    args = parser.parse_args()
+
+    if args.serve:
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+        asyncio.run(LocalSTTServer(WhisperDecoder()).serve())
+        raise SystemExit
+    if args.bench:
+        asyncio.run(_bench(args.bench, [int(n) for n in args.streams.split(",")], args.workers, args.threads))
+        raise SystemExit
+    summary = summarize(REPORTS.read(args.worker, args.n))
+    if not summary["utterances"]:
+        print("no reports")
+        raise SystemExit
+    print(
+        f"{summary['utterances']} utterances over {summary['calls']} calls: end of speech -> final"
+        f" p50 {summary['final_p50_ms']:.0f}ms p95 {summary['final_p95_ms']:.0f}ms,"
+        f" {summary['fast_finals']} from the last interim, {summary['interims_per_utterance']:.1f} interims per utterance"
+    )
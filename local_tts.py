@@ -0,0 +1,437 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import numpy as np
+from livekit import rtc
+from livekit.agents import APIConnectionError, APIConnectOptions, APIError, tts, utils
+
+from clause_tts import language_of
+from runtime_reports import RUNTIME_DIR, quantile
+from tts_cache import AudioLRU
+
+
+logger = logging.getLogger("local-tts")
+
+SOCKET_PATH = os.getenv("LOCAL_TTS_SOCKET", os.path.join(RUNTIME_DIR, "local_tts.sock"))
+# started by the supervisor next to the agent workers; PIPELINE_TTS=local has no other way to speak
+_PIPELINE_LOCAL = "local" in (os.getenv("PIPELINE_TTS"), os.getenv("PIPELINE_TTS_FALLBACK"))
+SERVER_ENABLED = os.getenv("LOCAL_TTS_SERVER", "on" if _PIPELINE_LOCAL else "off") == "on"
+
+# Piper voices: <name>.onnx and <name>.onnx.json in VOICES_DIR, one per language
+VOICES_DIR = os.getenv("LOCAL_TTS_VOICES_DIR", os.path.join("data", "piper_voices"))
+VOICES = dict(
+    item.split("=", 1)
+    for item in os.getenv("LOCAL_TTS_VOICES", "en=en_US-lessac-medium,hi=hi_IN-pratham-medium").split(",")
+)
+# medium-quality Piper voices; a TTS it falls back to sets its own rate
+SAMPLE_RATE = 22050
+# one synthesis process per core, each running onnxruntime on one thread
+PROCESSES = int(os.getenv("LOCAL_TTS_PROCESSES", "0")) or os.cpu_count() or 1
+CACHE_MB = float(os.getenv("LOCAL_TTS_CACHE_MB", "64"))
+# first audio of a reply we aim for
+TTFB_TARGET_MS = 250
+
+
+def _voice_path(name: str, voices_dir: str = VOICES_DIR) -> str:
+    return os.path.join(voices_dir, f"{name}.onnx")
+
+
+def available_languages(voices_dir: str = VOICES_DIR) -> set[str]:
+    return {
+        language
+        for language, name in VOICES.items()
+        if os.path.exists(_voice_path(name, voices_dir)) and os.path.exists(_voice_path(name, voices_dir) + ".json")
+    }
+
+
+def _load_voice(path: str, *, with_model: bool):
+    from piper import PiperVoice
+    from piper.config import PiperConfig
+
+    with open(path + ".json", "r", encoding="utf-8") as f:
+        config = PiperConfig.from_dict(json.load(f))
+    if not with_model:
+        # enough to phonemize
+        return PiperVoice(session=None, config=config)
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    # the pool already runs one process per core
+    options.intra_op_num_threads = 1
+    options.inter_op_num_threads = 1
+    session = onnxruntime.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+    return PiperVoice(session=session, config=config)
+
+
+# --- synthesis processes ---
+
+_voices: dict = {}
+
+
+def _init_process(paths: dict[str, str]):
+    for language, path in paths.items():
+        _voices[language] = _load_voice(path, with_model=True)
+
+
+def _synthesize(language: str, phonemes: list[str], sample_rate: int) -> bytes:
+    """16-bit PCM at `sample_rate` for one sentence's phonemes"""
+    voice = _voices[language]
+    audio = voice.phoneme_ids_to_audio(voice.phonemes_to_ids(phonemes))
+    if isinstance(audio, tuple):
+        audio = audio[0]
+    # Piper's own peak normalization per sentence
+    peak = np.max(np.abs(audio))
+    audio = audio / peak if peak > 1e-8 else np.zeros_like(audio)
+    pcm = (np.clip(audio, -1.0, 1.0) * 32767).astype(np.int16).tobytes()
+    rate = voice.config.sample_rate
+    if rate == sample_rate:
+        return pcm
+    resampler = rtc.AudioResampler(rate, sample_rate, quality=rtc.AudioResamplerQuality.HIGH)
+    frames = resampler.push(rtc.AudioFrame(data=pcm, sample_rate=rate, num_channels=1, samples_per_channel=len(pcm) // 2))
+    return b"".join(bytes(frame.data) for frame in [*frames, *resampler.flush()])
+
+
+# --- the server: one per host, shared by every call ---
+
+
+class LocalTTSServer:
+    """
+    Synthesizes for every call on the host. Text is phonemized here and split
+    into sentences the way Piper would, and each sentence is synthesized in a
+    pool of single-threaded processes, one per core, so a reply's sentences
+    render in parallel and the first is sent as soon as it is ready. Sentence
+    audio is kept in an LRU keyed by phonemes, so recurring phrases and names
+    are served from memory whatever their spelling or surrounding text, and
+    concurrent requests for the same sentence share one synthesis.
+    """
+
+    def __init__(self, *, processes: int = PROCESSES, cache_mb: float = CACHE_MB, voices_dir: str = VOICES_DIR):
+        paths = {language: _voice_path(VOICES[language], voices_dir) for language in available_languages(voices_dir)}
+        if not paths:
+            raise FileNotFoundError(f"no Piper voices in {voices_dir}, expected {', '.join(VOICES.values())}")
+        self.languages = set(paths)
+        self._phonemizers = {language: _load_voice(path, with_model=False) for language, path in paths.items()}
+        self.processes = processes
+        self._pool = ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_process,
+            initargs=(paths,),
+        )
+        self.cache = AudioLRU(int(cache_mb * 1024 * 1024))
+        self._pending: dict[str, asyncio.Future] = {}
+        self.stats = {"requests": 0, "sentences": 0, "shared": 0, "synth_s": 0.0, "audio_s": 0.0}
+
+    async def warm(self):
+        """Start every process and run each voice once, so the first call does not pay for it"""
+        loop = asyncio.get_running_loop()
+        jobs = []
+        for language, voice in self._phonemizers.items():
+            phonemes = next(p for p in voice.phonemize("Hello.") if p)
+            jobs += [loop.run_in_executor(self._pool, _synthesize, language, phonemes, SAMPLE_RATE) for _ in range(self.processes)]
+        await asyncio.gather(*jobs)
+
+    async def serve(self, path: str = SOCKET_PATH):
+        await self.warm()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if os.path.exists(path):
+            os.remove(path)
+        server = await asyncio.start_unix_server(self._handle, path)
+        logger.info(f"local TTS listening on {path} with {self.processes} processes, voices for {sorted(self.languages)}")
+        reporter = asyncio.create_task(self._report())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            reporter.cancel()
+            self._pool.shutdown(cancel_futures=True)
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(60)
+            if self.stats["audio_s"]:
+                logger.info(
+                    f"local TTS: {self.stats}, RTF {self.stats['synth_s'] / self.stats['audio_s']:.3f},"
+                    f" cache {len(self.cache)} sentences {self.cache.bytes / 1e6:.1f}MB, {self.cache.hits} hits / {self.cache.misses} misses"
+                )
+
+    async def _sentence(self, language: str, phonemes: list[str], sample_rate: int) -> tuple[bytes, bool]:
+        key = hashlib.sha1(f"{language}|{sample_rate}|{''.join(phonemes)}".encode("utf-8")).hexdigest()
+        pcm = self.cache.get(key)
+        if pcm is not None:
+            return pcm, True
+        future = self._pending.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._render(key, language, phonemes, sample_rate))
+            self._pending[key] = future
+            future.add_done_callback(lambda _: self._pending.pop(key, None))
+        else:
+            self.stats["shared"] += 1
+        # a caller hanging up must not cancel a synthesis others are waiting on
+        return await asyncio.shield(future), False
+
+    async def _render(self, key: str, language: str, phonemes: list[str], sample_rate: int) -> bytes:
+        started = time.perf_counter()
+        pcm = await asyncio.get_running_loop().run_in_executor(self._pool, _synthesize, language, phonemes, sample_rate)
+        self.stats["sentences"] += 1
+        self.stats["synth_s"] += time.perf_counter() - started
+        self.stats["audio_s"] += len(pcm) / 2 / sample_rate
+        self.cache.put(key, pcm)
+        return pcm
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        sentences = []
+        try:
+            request = json.loads(await reader.readline())
+            language, sample_rate = request["language"], request["sample_rate"]
+            self.stats["requests"] += 1
+            if language not in self.languages:
+                writer.write(json.dumps({"error": f"no local voice for {language!r}"}).encode() + b"\n")
+                return
+            started = time.perf_counter()
+            # every sentence starts now; they are sent in order as they finish
+            sentences = [
+                asyncio.ensure_future(self._sentence(language, phonemes, sample_rate))
+                for phonemes in self._phonemizers[language].phonemize(request["text"])
+                if phonemes
+            ]
+            for sentence in sentences:
+                pcm, cached = await sentence
+                writer.write(json.dumps({"bytes": len(pcm), "cached": cached}).encode() + b"\n" + pcm)
+                await writer.drain()
+            writer.write(json.dumps({"done": True, "ms": (time.perf_counter() - started) * 1000}).encode() + b"\n")
+        except (ValueError, KeyError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.exception("synthesis failed")
+            writer.write(json.dumps({"error": str(e)}).encode() + b"\n")
+        finally:
+            for sentence in sentences:
+                sentence.cancel()
+            writer.close()
+
+
+def require_server(supervised: bool) -> None:
+    """Fail at startup, not on every reply, when nothing will serve SOCKET_PATH"""
+    if (supervised and SERVER_ENABLED) or os.path.exists(SOCKET_PATH):
+        return
+    raise RuntimeError(
+        f"PIPELINE_TTS=local but nothing serves {SOCKET_PATH}: "
+        "run the supervisor with LOCAL_TTS_SERVER=on, or local_tts.py --serve"
+    )
+
+
+def start_server() -> subprocess.Popen:
+    """Run the server in its own process, for the supervisor"""
+    os.makedirs(RUNTIME_DIR, exist_ok=True)
+    with open(os.path.join(RUNTIME_DIR, "local_tts.log"), "ab") as log:
+        return subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve"], stdout=log, stderr=subprocess.STDOUT)
+
+
+# --- the client: a TTS for VoicePipelineAgent ---
+
+
+class _LocalChunkedStream(tts.ChunkedStream):
+    def __init__(self, *, tts: "LocalTTS", input_text: str, language: str, conn_options: Optional[APIConnectOptions]):
+        super().__init__(tts=tts, input_text=input_text, conn_options=conn_options)
+        self._local = tts
+        self._language = language
+
+    async def _run(self) -> None:
+        if self._language not in self._local.languages:
+            # FallbackAdapter moves on to the next TTS
+            raise APIError(f"no local voice for {self._language!r}", body=None, retryable=False)
+        try:
+            reader, writer = await asyncio.open_unix_connection(self._local.socket_path)
+        except OSError as e:
+            raise APIConnectionError(f"local TTS server not reachable at {self._local.socket_path}") from e
+        request_id = uuid.uuid4().hex
+        sample_rate = self._local.sample_rate
+        audio = utils.audio.AudioByteStream(sample_rate=sample_rate, num_channels=1, samples_per_channel=sample_rate // 10)
+        try:
+            request = {"text": self._input_text, "language": self._language, "sample_rate": sample_rate}
+            writer.write(json.dumps(request).encode() + b"\n")
+            while True:
+                line = await reader.readline()
+                if not line:
+                    raise APIConnectionError("local TTS server closed the connection")
+                header = json.loads(line)
+                if "error" in header:
+                    raise APIError(header["error"], body=header, retryable=False)
+                if header.get("done"):
+                    break
+                for frame in audio.push(await reader.readexactly(header["bytes"])):
+                    self._event_ch.send_nowait(tts.SynthesizedAudio(request_id=request_id, frame=frame))
+            for frame in audio.flush():
+                self._event_ch.send_nowait(tts.SynthesizedAudio(request_id=request_id, frame=frame))
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            raise APIConnectionError("local TTS server closed the connection") from e
+        finally:
+            writer.close()
+
+
+class LocalTTS(tts.TTS):
+    """
+    TTS backed by the host's LocalTTSServer. Each chunk is spoken with the
+    Piper voice for its script. Chunks in a language with no local voice go
+    to `other` when given, which also sets the output sample rate, so one
+    reply can mix both without resampling; without `other` they fail.
+    """
+
+    def __init__(self, *, other: Optional[tts.TTS] = None, socket_path: str = SOCKET_PATH, voices_dir: str = VOICES_DIR):
+        super().__init__(
+            capabilities=tts.TTSCapabilities(streaming=False),
+            sample_rate=other.sample_rate if other is not None else SAMPLE_RATE,
+            num_channels=1,
+        )
+        self._other = other
+        self.socket_path = socket_path
+        self.languages = available_languages(voices_dir)
+
+    def synthesize(self, text: str, *, conn_options: Optional[APIConnectOptions] = None) -> tts.ChunkedStream:
+        language = language_of(text)
+        if language not in self.languages and self._other is not None:
+            return self._other.synthesize(text, conn_options=conn_options)
+        return _LocalChunkedStream(tts=self, input_text=text, language=language, conn_options=conn_options)
+
+    async def aclose(self):
+        if self._other is not None:
+            await self._other.aclose()
+
+
+# --- benchmark ---
+
+# replies as the clause tokenizer splits them
+_BENCH_REPLIES = {
+    "en": [
+        ["Okay,", "your appointment is booked for Monday at five.", "Is there anything else I can help with?"],
+        ["Sure,", "let me check the doctor's availability.", "We have slots on Tuesday morning and Thursday afternoon."],
+        ["Thank you for calling,", "have a great day."],
+    ],
+    "hi": [
+        ["ठीक है,", "आपकी अपॉइंटमेंट सोमवार को पाँच बजे बुक हो गई है।", "क्या मैं और कुछ मदद कर सकती हूँ?"],
+        ["जी,", "मैं डॉक्टर की उपलब्धता देखती हूँ।"],
+    ],
+}
+
+
+async def _speak(tts_: tts.TTS, reply: list[str]) -> dict:
+    """Synthesize a reply's chunks in order as the StreamAdapter does, with playout starting at the first audio"""
+    started = time.perf_counter()
+    first_audio = None
+    # when the audio received so far finishes playing
+    played_until = None
+    underruns = 0
+    for chunk in reply:
+        chunk_first = True
+        async with tts_.synthesize(chunk) as stream:
+            async for audio in stream:
+                now = time.perf_counter()
+                if first_audio is None:
+                    first_audio = played_until = now
+                if chunk_first and now > played_until + 0.01:
+                    underruns += 1
+                chunk_first = False
+                played_until = max(played_until, now) + audio.frame.samples_per_channel / audio.frame.sample_rate
+    return {"ttfb_ms": (first_audio - started) * 1000, "underruns": underruns}
+
+
+async def _callers(tts_: tts.TTS, n: int, replies: list[list[str]], rounds: int) -> list[dict]:
+    async def caller(i: int):
+        results = []
+        await asyncio.sleep(i * 0.05)
+        for r in range(rounds):
+            results.append(await _speak(tts_, replies[(i + r) % len(replies)]))
+            # the caller answers before the next reply
+            await asyncio.sleep(0.5)
+        return results
+
+    return [result for results in await asyncio.gather(*(caller(i) for i in range(n))) for result in results]
+
+
+def _pool_cpu() -> float:
+    import psutil
+
+    return sum(sum(child.cpu_times()[:2]) for child in psutil.Process().children(recursive=True))
+
+
+async def _bench(streams: list[int], processes: int, rounds: int, cloud: list[str]):
+    import tempfile
+
+    from livekit.agents.utils import http_context
+
+    replies = [reply for language in available_languages() for reply in _BENCH_REPLIES.get(language, [])]
+    print(f"{processes} synthesis processes, {os.cpu_count()} cores, voices for {sorted(available_languages())}")
+    rows = []
+    for cache_mb, sweep in ((0, streams), (CACHE_MB, streams[:1])):
+        server = LocalTTSServer(processes=processes, cache_mb=cache_mb)
+        socket_path = os.path.join(tempfile.mkdtemp(), "tts.sock")
+        serving = asyncio.create_task(server.serve(socket_path))
+        while not os.path.exists(socket_path):
+            await asyncio.sleep(0.05)
+        local = LocalTTS(socket_path=socket_path)
+        if cache_mb:
+            # a first pass fills the cache
+            await _callers(local, 1, replies, len(replies))
+        for n in sweep:
+            cpu, wall = _pool_cpu(), time.perf_counter()
+            results = await _callers(local, n, replies, rounds)
+            cores = (_pool_cpu() - cpu) / (time.perf_counter() - wall)
+            rows.append(("local, cached" if cache_mb else "local", n, results, cores))
+        if not cache_mb:
+            print(f"real-time factor: {server.stats['synth_s'] / server.stats['audio_s']:.3f} per process")
+        serving.cancel()
+        await asyncio.gather(serving, return_exceptions=True)
+    if cloud:
+        from providers import TTS_PROVIDERS, plugin
+
+        http_context._new_session_ctx()
+        for name in cloud:
+            plugin_name, factory = TTS_PROVIDERS[name]
+            remote = factory(plugin(plugin_name))
+            for n in sorted({streams[0], streams[-1]}):
+                rows.append((name, n, await _callers(remote, n, _BENCH_REPLIES["en"], rounds), 0.0))
+        await http_context._close_http_ctx()
+    print("tts             streams  ttfb p50   p95  underruns  cpu cores busy")
+    best = 0
+    for name, n, results, cores in rows:
+        ttfb = [r["ttfb_ms"] for r in results]
+        underruns = sum(r["underruns"] for r in results)
+        print(f"{name:15s} {n:7d} {quantile(ttfb, 0.5):9.0f} {quantile(ttfb, 0.95):5.0f} {underruns:10d} {cores:15.2f}")
+        if name == "local" and quantile(ttfb, 0.95) <= TTFB_TARGET_MS and not underruns:
+            best = max(best, n)
+    print(f"streams per core with ttfb p95 <= {TTFB_TARGET_MS}ms and no underruns: {best / processes:.1f}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="On-host Piper TTS: the shared server or a benchmark")
+    parser.add_argument("--serve", action="store_true", help=f"run the host's TTS server on {SOCKET_PATH}")
+    parser.add_argument("--bench", action="store_true", help="time to first audio and concurrent streams per core")
+    parser.add_argument("--streams", default="1,2,4,8,16")
+    parser.add_argument("--processes", type=int, default=PROCESSES)
+    parser.add_argument("--rounds", type=int, default=3, help="replies per simulated caller")
+    parser.add_argument("--cloud", default="", help="cloud providers to compare, e.g. openai,cartesia")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if args.serve:
+        asyncio.run(LocalTTSServer().serve())
+    elif args.bench:
+        cloud = [name for name in args.cloud.split(",") if name]
+        asyncio.run(_bench([int(n) for n in args.streams.split(",")], args.processes, args.rounds, cloud))
+    else:
+        parser.print_help()
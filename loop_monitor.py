@@ -0,0 +1,331 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Callable, Optional
+
+from runtime_reports import RUNTIME_DIR, ReportLog
+
+
+logger = logging.getLogger("loop-monitor")
+
+ENABLED = os.getenv("LOOP_MONITOR", "on") != "off"
+# how often the loop is probed; lag is how late the probe wakes up
+TICK_SECONDS = 0.05
+# a callback holding the loop this long has its stack recorded
+SLOW_CALLBACK_MS = float(os.getenv("LOOP_SLOW_CALLBACK_MS", "100"))
+# an underrun is blamed on the loop when lag this high precedes it
+UNDERRUN_LAG_MS = 50.0
+UNDERRUN_WINDOW_SECONDS = 1.0
+LAG_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000)
+STACK_DEPTH = 15
+
+LOOP_DIR = os.path.join(RUNTIME_DIR, "loop")
+REPORTS = ReportLog(LOOP_DIR)
+
+
+class LagHistogram:
+    """Event-loop lag in fixed millisecond buckets, so jobs can be merged"""
+
+    def __init__(self):
+        self.counts = [0] * (len(LAG_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, ms: float):
+        i = 0
+        while i < len(LAG_BUCKETS_MS) and ms > LAG_BUCKETS_MS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile"""
+        if not self.count:
+            return 0.0
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= q * self.count:
+                return LAG_BUCKETS_MS[i] if i < len(LAG_BUCKETS_MS) else self.max_ms
+        return self.max_ms
+
+    def merge(self, data: dict):
+        for i, n in enumerate(data["counts"]):
+            self.counts[i] += n
+        self.count += data["count"]
+        self.total_ms += data["total_ms"]
+        self.max_ms = max(self.max_ms, data["max_ms"])
+
+    def to_dict(self) -> dict:
+        return {
+            "counts": self.counts,
+            "count": self.count,
+            "total_ms": self.total_ms,
+            "max_ms": self.max_ms,
+            "p50_ms": self.quantile(0.5),
+            "p99_ms": self.quantile(0.99),
+        }
+
+    def render(self) -> str:
+        labels = [f"<={b}ms" for b in LAG_BUCKETS_MS] + [f">{LAG_BUCKETS_MS[-1]}ms"]
+        peak = max(self.counts) or 1
+        return "\n".join(f"{label:>9} {n:8d} {'#' * round(40 * n / peak)}" for label, n in zip(labels, self.counts))
+
+
+def _frame_label(frame: traceback.FrameSummary) -> str:
+    return f"{os.path.basename(frame.filename)}:{frame.lineno} {frame.name}"
+
+
+class SlowCallbacks:
+    """Stacks of the code that held the loop, grouped by the callback it ran in"""
+
+    def __init__(self):
+        self._by_key: dict[str, dict] = {}
+
+    def record(self, stack: traceback.StackSummary, ms: float):
+        # the outermost frame above asyncio's own machinery is the callback or task step
+        frames = [f for f in stack if f"{os.sep}asyncio{os.sep}" not in f.filename and "threading.py" not in f.filename]
+        if not frames:
+            return
+        key = f"{_frame_label(frames[0])} -> {_frame_label(frames[-1])}"
+        entry = self._by_key.get(key)
+        if entry is None:
+            stack_lines = traceback.StackSummary.from_list(frames[-STACK_DEPTH:]).format()
+            entry = self._by_key[key] = {"callback": key, "count": 0, "total_ms": 0.0, "max_ms": 0.0, "stack": stack_lines}
+            logger.warning(f"event loop blocked {ms:.0f}ms in {key}\n{''.join(entry['stack'])}")
+        entry["count"] += 1
+        entry["total_ms"] += ms
+        entry["max_ms"] = max(entry["max_ms"], ms)
+
+    def top(self, n: int = 10) -> list[dict]:
+        return sorted(self._by_key.values(), key=lambda e: -e["total_ms"])[:n]
+
+
+class LoopMonitor:
+    """
+    Measures how late the event loop runs a probe every TICK_SECONDS and
+    keeps the lag in a histogram. A watchdog thread notices when the probe
+    is overdue by SLOW_CALLBACK_MS and records the loop thread's stack at
+    that moment, which is the callback that is blocking it. With an agent
+    attached it also counts audio underruns (the agent's audio source ran
+    dry in the middle of an utterance) and the lag that preceded each.
+    """
+
+    def __init__(self, name: str = "", *, tick: float = TICK_SECONDS, slow_ms: float = SLOW_CALLBACK_MS, enabled: bool = ENABLED):
+        self.name = name
+        self.tick = tick
+        self.slow_ms = slow_ms
+        self.enabled = enabled
+        self.lag = LagHistogram()
+        self.lag_before_underrun = LagHistogram()
+        self.slow = SlowCallbacks()
+        self.underruns = 0
+        self.underruns_after_lag = 0
+        self._recent: deque[tuple[float, float]] = deque()
+        self._heartbeat = 0.0
+        self._stall_stack: Optional[traceback.StackSummary] = None
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopped = threading.Event()
+        self._agent = None
+        self._speaking = False
+        self._source_drained = False
+
+    def start(self):
+        if not self.enabled or self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.perf_counter()
+        self._task = asyncio.create_task(self._probe())
+        threading.Thread(target=self._watchdog, name="loop-watchdog", daemon=True).start()
+
+    async def _probe(self):
+        while True:
+            before = time.perf_counter()
+            await asyncio.sleep(self.tick)
+            now = time.perf_counter()
+            lag_ms = max(0.0, (now - before - self.tick) * 1000)
+            self._heartbeat = now
+            self.lag.observe(lag_ms)
+            self._recent.append((now, lag_ms))
+            while self._recent[0][0] < now - UNDERRUN_WINDOW_SECONDS:
+                self._recent.popleft()
+            stack, self._stall_stack = self._stall_stack, None
+            if stack is not None and lag_ms >= self.slow_ms:
+                self.slow.record(stack, lag_ms)
+            if self._speaking:
+                self._check_audio()
+
+    def _watchdog(self):
+        stalled = False
+        while not self._stopped.wait(self.tick / 2):
+            overdue_ms = (time.perf_counter() - self._heartbeat - self.tick) * 1000
+            if overdue_ms < self.slow_ms:
+                stalled = False
+            elif not stalled:
+                stalled = True
+                frame = sys._current_frames().get(self._loop_thread)
+                if frame is not None:
+                    self._stall_stack = traceback.extract_stack(frame)
+
+    # --- audio underruns ---
+
+    def watch_audio(self, agent):
+        """Count gaps in `agent`'s (VoicePipelineAgent) audio output while it speaks"""
+        self._agent = agent
+        agent.on("agent_started_speaking", self._on_started_speaking)
+        agent.on("agent_stopped_speaking", self._on_stopped_speaking)
+
+    def _on_started_speaking(self):
+        self._speaking = True
+        self._source_drained = False
+
+    def _on_stopped_speaking(self):
+        self._speaking = False
+
+    def _audio_source(self):
+        output = getattr(self._agent, "_agent_output", None)
+        playout = getattr(output, "_agent_playout", None)
+        return getattr(playout, "_audio_source", None)
+
+    def _check_audio(self):
+        source = self._audio_source()
+        if source is None:
+            return
+        queued = source.queued_duration
+        if queued <= 0:
+            self._source_drained = True
+        elif self._source_drained:
+            # the queue ran dry and then got more audio for the same utterance: the caller heard a gap
+            self._source_drained = False
+            self.underruns += 1
+            lag_ms = max((lag for _, lag in self._recent), default=0.0)
+            self.lag_before_underrun.observe(lag_ms)
+            if lag_ms >= UNDERRUN_LAG_MS:
+                self.underruns_after_lag += 1
+
+    # --- reporting ---
+
+    def report(self) -> dict:
+        return {
+            "name": self.name,
+            "pid": os.getpid(),
+            "ended_at": time.time(),
+            "lag": self.lag.to_dict(),
+            "underruns": self.underruns,
+            "underruns_after_lag": self.underruns_after_lag,
+            "lag_before_underrun": self.lag_before_underrun.to_dict(),
+            "slow_callbacks": self.slow.top(),
+        }
+
+    def attach(self, agent, job_ctx):
+        """Start monitoring, watch `agent`'s audio and write the report when the job ends"""
+        if not self.enabled:
+            return
+        self.start()
+        self.watch_audio(agent)
+
+        async def report():
+            await self.aclose()
+            data = self.report()
+            logger.info(
+                f"event loop lag p50 {data['lag']['p50_ms']:.0f}ms p99 {data['lag']['p99_ms']:.0f}ms "
+                f"max {data['lag']['max_ms']:.0f}ms, {self.underruns} audio underruns "
+                f"({self.underruns_after_lag} after lag), {len(data['slow_callbacks'])} slow callbacks"
+            )
+            await asyncio.to_thread(REPORTS.write, os.getenv("AGENT_WORKER_ID", "dev"), data)
+
+        job_ctx.add_shutdown_callback(report)
+
+    async def aclose(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+
+
+def off_loop(fn: Callable) -> Callable:
+    """
+    Run a blocking function on a worker thread when it is called from the
+    event loop. Event handlers decorated with it return at once (with a
+    future that callers may await); the result of a failed run is logged.
+    """
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return fn(*args, **kwargs)
+        future = loop.run_in_executor(None, functools.partial(fn, *args, **kwargs))
+        future.add_done_callback(_log_failure)
+        return future
+
+    return wrapper
+
+
+def _log_failure(future: asyncio.Future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("off-loop handler failed", exc_info=future.exception())
+
+
+def summarize(reports: list[dict]) -> dict:
+    """Merge per-job reports: lag histograms, underrun correlation and the worst callbacks"""
+    lag, before_underrun = LagHistogram(), LagHistogram()
+    callbacks: dict[str, dict] = {}
+    underruns = after_lag = 0
+    for report in reports:
+        lag.merge(report["lag"])
+        before_underrun.merge(report["lag_before_underrun"])
+        underruns += report["underruns"]
+        after_lag += report["underruns_after_lag"]
+        for cb in report["slow_callbacks"]:
+            entry = callbacks.setdefault(cb["callback"], {**cb, "count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            entry["count"] += cb["count"]
+            entry["total_ms"] += cb["total_ms"]
+            entry["max_ms"] = max(entry["max_ms"], cb["max_ms"])
+    return {
+        "jobs": len(reports),
+        "lag": lag,
+        "lag_before_underrun": before_underrun,
+        "underruns": underruns,
+        "underruns_after_lag": after_lag,
+        "slow_callbacks": sorted(callbacks.values(), key=lambda e: -e["total_ms"]),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Event-loop lag and slow callbacks across recent jobs")
+    parser.add_argument("--worker", default="dev")
+    parser.add_argument("-n", type=int, default=100, help="number of recent jobs")
+    parser.add_argument("--stacks", action="store_true", help="print the stack of each slow callback")
+    args = parser.parse_args()
+
+    summary = summarize(REPORTS.read(args.worker, args.n))
+    if not summary["jobs"]:
+        print("no reports")
+        raise SystemExit
+    lag = summary["lag"]
+    print(f"{summary['jobs']} jobs, {lag.count} probes, lag p50 {lag.quantile(0.5):.0f}ms p99 {lag.quantile(0.99):.0f}ms max {lag.max_ms:.0f}ms")
+    print(lag.render())
+    print(f"\n{summary['underruns']} audio underruns, {summary['underruns_after_lag']} preceded by >= {UNDERRUN_LAG_MS:.0f}ms lag")
+    if summary["underruns"]:
+        print("lag in the second before each underrun:")
+        print(summary["lag_before_underrun"].render())
+    print("\nslow callbacks:")
+    for cb in summary["slow_callbacks"][:10]:
+        print(f"{cb['count']:5d}x  max {cb['max_ms']:6.0f}ms  total {cb['total_ms']:8.0f}ms  {cb['callback']}")
+        if args.stacks:
+            print("".join(cb["stack"]))
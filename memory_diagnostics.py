@@ -0,0 +1,567 @@
+from __future__ import annotations
+
+import asyncio
+import gc
+import json
+import logging
+import os
+import signal
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+import psutil
+
+from runtime_reports import RUNTIME_DIR, ReportLog
+
+
+logger = logging.getLogger("memory-diagnostics")
+
+ENABLED = os.getenv("MEMORY_DIAGNOSTICS", "off") == "on"
+# frames kept per allocation; more frames attribute better but cost memory and time
+TRACE_FRAMES = int(os.getenv("MEMORY_TRACE_FRAMES", "12"))
+# retained memory growing faster than this per job is reported as a leak
+LEAK_KB_PER_JOB = float(os.getenv("MEMORY_LEAK_KB_PER_JOB", "32"))
+# jobs needed before the growth trend means anything
+TREND_MIN_JOBS = 20
+# the debug endpoint listens on 127.0.0.1, this far above the worker's health check port
+DEBUG_PORT_OFFSET = 100
+SAMPLE_INTERVAL = 5.0
+TOP_N = 25
+
+MEMORY_DIR = os.path.join(RUNTIME_DIR, "memory")
+REPORTS = ReportLog(MEMORY_DIR)
+
+# where an allocation was made, innermost frame first; repo modules win over the libraries they call
+SUBSYSTEMS = (
+    ("booking_flow.py", "booking"),
+    ("context_budget.py", "chat context"),
+    ("caller_memory.py", "caller memory"),
+    ("call_events.py", "call events"),
+    ("faq_cache.py", "faq cache"),
+    ("tts_cache.py", "tts cache"),
+    ("recording.py", "recording"),
+    ("transcript_archive.py", "transcripts"),
+    ("hedged_llm.py", "llm"),
+    ("model_router.py", "llm"),
+    ("rate_limiter.py", "rate limiter"),
+    ("audio_ring.py", "audio ring"),
+    ("stt_upload.py", "stt upload"),
+    ("barge_in.py", "barge-in"),
+    ("clause_tts.py", "tts segmentation"),
+    ("tool_runner.py", "tools"),
+    ("local_stt.py", "local stt"),
+    ("local_tts.py", "local tts"),
+    ("call_trace.py", "call traces"),
+    ("agent2.py", "entrypoint"),
+    ("agent.py", "entrypoint"),
+    ("outbound.py", "entrypoint"),
+    ("marketing.py", "entrypoint"),
+    ("memory_diagnostics.py", "diagnostics"),
+)
+LIBRARY_SUBSYSTEMS = (
+    ("livekit/agents/pipeline", "pipeline"),
+    ("livekit/agents/llm", "llm"),
+    ("livekit/agents/stt", "stt"),
+    ("livekit/agents/tts", "tts"),
+    ("livekit/agents/vad", "vad"),
+    ("livekit/plugins/", "plugins"),
+    ("livekit/rtc", "audio/rtc"),
+    ("livekit/agents", "agents"),
+    ("aiohttp", "http"),
+    ("sqlite3", "sqlite"),
+    ("asyncio", "asyncio"),
+)
+# per-call objects that should not outlive the call
+WATCHED_TYPES = ("ChatMessage", "ChatContext", "AudioFrame", "VoicePipelineAgent", "CallEvents", "BookingTracker", "Connection", "Task", "Queue")
+
+_TRACE_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+def subsystem_of(traceback: tracemalloc.Traceback) -> str:
+    frames = [f.filename.replace(os.sep, "/") for f in reversed(traceback)]
+    for table in (SUBSYSTEMS, LIBRARY_SUBSYSTEMS):
+        for filename in frames:
+            for fragment, name in table:
+                if filename.endswith(fragment) if fragment.endswith(".py") else fragment in filename:
+                    return name
+    return "other"
+
+
+def _where(traceback: tracemalloc.Traceback) -> str:
+    frame = traceback[-1]
+    return f"{frame.filename}:{frame.lineno}"
+
+
+def rss_mb() -> float:
+    return psutil.Process().memory_info().rss / 1024 / 1024
+
+
+def start_tracing():
+    """
+    Start after imports and model loads: only allocations made after this
+    are traced, which keeps snapshots small enough to take around every job.
+    """
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACE_FRAMES)
+
+
+def take_snapshot() -> tracemalloc.Snapshot:
+    gc.collect()
+    return tracemalloc.take_snapshot().filter_traces(_TRACE_FILTERS)
+
+
+def top_allocators(snapshot: Optional[tracemalloc.Snapshot] = None, n: int = TOP_N) -> dict:
+    """Live traced memory grouped by subsystem and by allocating line"""
+    snapshot = snapshot or take_snapshot()
+    by_subsystem: dict[str, int] = defaultdict(int)
+    for stat in snapshot.statistics("traceback"):
+        by_subsystem[subsystem_of(stat.traceback)] += stat.size
+    return {
+        "by_subsystem_kb": {k: v / 1024 for k, v in sorted(by_subsystem.items(), key=lambda kv: -kv[1])},
+        "top_lines": [
+            {"where": _where(stat.traceback), "kb": stat.size / 1024, "count": stat.count}
+            for stat in snapshot.statistics("lineno")[:n]
+        ],
+    }
+
+
+def retained(before: tracemalloc.Snapshot, after: tracemalloc.Snapshot, n: int = 10) -> dict:
+    """Memory allocated between two snapshots and still alive at the second one"""
+    diffs = [d for d in after.compare_to(before, "traceback") if d.size_diff > 0]
+    by_subsystem: dict[str, int] = defaultdict(int)
+    by_line: dict[str, list] = {}
+    for diff in diffs:
+        subsystem = subsystem_of(diff.traceback)
+        by_subsystem[subsystem] += diff.size_diff
+        line = by_line.setdefault(_where(diff.traceback), [subsystem, 0, 0])
+        line[1] += diff.size_diff
+        line[2] += diff.count_diff
+    return {
+        "retained_kb": sum(d.size_diff for d in diffs) / 1024,
+        "by_subsystem_kb": {k: v / 1024 for k, v in sorted(by_subsystem.items(), key=lambda kv: -kv[1])},
+        "top_lines": [
+            {"where": where, "subsystem": subsystem, "kb": size / 1024, "count": count}
+            for where, (subsystem, size, count) in sorted(by_line.items(), key=lambda kv: -kv[1][1])[:n]
+        ],
+    }
+
+
+def live_objects() -> dict[str, int]:
+    counts: dict[str, int] = defaultdict(int)
+    # counting by type object runs in C; only the distinct types go through Python
+    for cls, n in Counter(map(type, gc.get_objects())).items():
+        if cls.__name__ in WATCHED_TYPES:
+            counts[cls.__name__] += n
+    return {name: counts[name] for name in WATCHED_TYPES}
+
+
+def slope(points: list[tuple[float, float]]) -> float:
+    """Least-squares slope of y over x"""
+    if len(points) < 2:
+        return 0.0
+    n = len(points)
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    var = sum((x - mean_x) ** 2 for x, _ in points)
+    if not var:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / var
+
+
+class GrowthTracker:
+    """
+    Memory left in this process after each job, both traced (Python objects)
+    and RSS (which also covers sqlite, audio and other native buffers). A
+    process that only ever runs one job has nothing to trend; one that runs
+    many (thread executor, the worker itself, the soak test) should stay flat.
+    """
+
+    def __init__(self, window: int = 200):
+        self.jobs = 0
+        self._traced: deque[tuple[float, float]] = deque(maxlen=window)
+        self._rss: deque[tuple[float, float]] = deque(maxlen=window)
+        self._warned = False
+
+    def record(self, traced_kb: float, rss_kb: float):
+        self.jobs += 1
+        self._traced.append((self.jobs, traced_kb))
+        self._rss.append((self.jobs, rss_kb))
+        if self.leaking and not self._warned:
+            self._warned = True
+            logger.warning(
+                f"memory grows {self.kb_per_job:.0f} KB traced / {self.rss_kb_per_job:.0f} KB RSS "
+                f"per job over the last {len(self._traced)} jobs"
+            )
+
+    @property
+    def kb_per_job(self) -> float:
+        return slope(list(self._traced))
+
+    @property
+    def rss_kb_per_job(self) -> float:
+        return slope(list(self._rss))
+
+    @property
+    def leaking(self) -> bool:
+        return len(self._traced) >= TREND_MIN_JOBS and max(self.kb_per_job, self.rss_kb_per_job) > LEAK_KB_PER_JOB
+
+    def summary(self) -> dict:
+        return {"jobs": self.jobs, "kb_per_job": self.kb_per_job, "rss_kb_per_job": self.rss_kb_per_job, "leaking": self.leaking}
+
+
+growth = GrowthTracker()
+_active_jobs: set[str] = set()
+
+
+class JobMemory:
+    """
+    Memory accounting around one job. Snapshots the traced heap when the job
+    starts and again after every other shutdown callback has run, and
+    reports what the job allocated and never released, by subsystem and by
+    line, plus the per-call objects still alive and the peak size of the
+    queues it was asked to watch. Without `detail` only the growth trend is
+    sampled. Does nothing unless MEMORY_DIAGNOSTICS=on.
+    """
+
+    def __init__(self, job_id: str, *, enabled: bool = ENABLED, detail: bool = True, worker_id: Optional[str] = None):
+        self.job_id = job_id
+        self.enabled = enabled
+        self.detail = detail
+        self.worker_id = worker_id or os.getenv("AGENT_WORKER_ID", "dev")
+        self._before: Optional[tracemalloc.Snapshot] = None
+        self._rss_before = 0.0
+        self._started_at = 0.0
+        self._overlapped: set[str] = set()
+        self._queues: dict[str, asyncio.Queue] = {}
+        self._queue_peaks: dict[str, int] = defaultdict(int)
+        self._agent = None
+        self._sampler: Optional[asyncio.Task] = None
+        self.report: Optional[dict] = None
+
+    async def start(self):
+        if not self.enabled:
+            return
+        start_tracing()
+        self._overlapped = set(_active_jobs)
+        _active_jobs.add(self.job_id)
+        self._rss_before = rss_mb()
+        if self.detail:
+            self._before = await asyncio.to_thread(take_snapshot)
+        tracemalloc.reset_peak()
+        self._started_at = time.monotonic()
+        self._sampler = asyncio.create_task(self._sample())
+
+    def watch(self, *, agent=None, **queues: asyncio.Queue):
+        """Track the agent's event handlers and the peak size of `queues`"""
+        self._agent = agent or self._agent
+        self._queues.update(queues)
+
+    async def _sample(self):
+        while True:
+            for name, queue in self._queues.items():
+                self._queue_peaks[name] = max(self._queue_peaks[name], queue.qsize())
+            await asyncio.sleep(SAMPLE_INTERVAL)
+
+    def _handlers(self) -> int:
+        events = getattr(self._agent, "_events", None) or {}
+        return sum(len(handlers) for handlers in events.values())
+
+    async def finish(self, *_):
+        """Shutdown callback; waits for the job's other shutdown callbacks before measuring"""
+        if not self.enabled or not self._started_at:
+            return
+        current = asyncio.current_task()
+        others = [t for t in asyncio.all_tasks() if t is not current and t.get_name() == "job_shutdown_callback"]
+        await asyncio.gather(*others, return_exceptions=True)
+        if self._sampler is not None:
+            self._sampler.cancel()
+        handlers = self._handlers()
+        # drop references this object holds before measuring what the job left behind
+        queue_sizes = {name: q.qsize() for name, q in self._queues.items()}
+        self._queues.clear()
+        self._agent = None
+
+        after = await asyncio.to_thread(take_snapshot) if self.detail else gc.collect()
+        _active_jobs.discard(self.job_id)
+        traced, peak = tracemalloc.get_traced_memory()
+        rss = rss_mb()
+        growth.record(traced / 1024, rss * 1024)
+        self.report = {
+            "job_id": self.job_id,
+            "pid": os.getpid(),
+            "ended_at": time.time(),
+            "duration_s": time.monotonic() - self._started_at,
+            "rss_mb": rss,
+            "rss_growth_mb": rss - self._rss_before,
+            "peak_traced_mb": peak / 1024 / 1024,
+            "traced_mb": traced / 1024 / 1024,
+            # jobs sharing this process muddle attribution (thread executor)
+            "overlapping_jobs": sorted(self._overlapped | (_active_jobs - {self.job_id})),
+            "agent_handlers": handlers,
+            "queues": {name: {"left": queue_sizes[name], "peak": self._queue_peaks[name]} for name in queue_sizes},
+            "growth": growth.summary(),
+        }
+        self._started_at = 0.0
+        if not self.detail:
+            return
+        self.report["live_objects"] = live_objects()
+        self.report.update(await asyncio.to_thread(retained, self._before, after))
+        self._before = None
+        logger.info(
+            f"job {self.job_id} retained {self.report['retained_kb']:.0f} KB "
+            f"(peak {self.report['peak_traced_mb']:.1f} MB traced), top: {list(self.report['by_subsystem_kb'].items())[:3]}"
+        )
+        await asyncio.to_thread(REPORTS.write, self.worker_id, self.report)
+
+
+def _dump_path(pid: int) -> str:
+    return os.path.join(MEMORY_DIR, f"top-{pid}.json")
+
+
+def _dump_on_signal(signum, frame):
+    # runs between bytecodes of the main thread; the snapshot is taken on a side thread
+    def dump():
+        os.makedirs(MEMORY_DIR, exist_ok=True)
+        tmp = _dump_path(os.getpid()) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"pid": os.getpid(), "rss_mb": rss_mb(), **top_allocators()}, f)
+        os.replace(tmp, _dump_path(os.getpid()))
+
+    threading.Thread(target=dump, daemon=True).start()
+
+
+def prewarm():
+    """Call at the end of the job process prewarm_fnc: traces from before the first job and dumps on SIGUSR2"""
+    if not ENABLED:
+        return
+    start_tracing()
+    try:
+        signal.signal(signal.SIGUSR2, _dump_on_signal)
+    except (ValueError, AttributeError):
+        # not the main thread (thread executor) or no SIGUSR2 on this platform
+        pass
+
+
+def job_allocators(pid: int, timeout: float = 10.0) -> Optional[dict]:
+    """Ask a job process of this worker for its top allocators"""
+    if psutil.Process(pid).ppid() != os.getpid():
+        return None
+    path = _dump_path(pid)
+    requested = time.time()
+    os.kill(pid, signal.SIGUSR2)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if os.path.getmtime(path) >= requested:
+                with open(path, "r", encoding="utf-8") as f:
+                    return json.load(f)
+        except (OSError, ValueError):
+            pass
+        time.sleep(0.1)
+    return None
+
+
+class _DebugHandler(BaseHTTPRequestHandler):
+    worker_id = "dev"
+    _last_snapshot: Optional[tracemalloc.Snapshot] = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        n = int(query.get("n", TOP_N))
+        if url.path == "/memory":
+            traced, peak = tracemalloc.get_traced_memory()
+            body = {
+                "pid": os.getpid(),
+                "rss_mb": rss_mb(),
+                "traced_mb": traced / 1024 / 1024,
+                "peak_traced_mb": peak / 1024 / 1024,
+                "growth": growth.summary(),
+                "job_processes": [p.pid for p in psutil.Process().children()],
+                **top_allocators(n=n),
+            }
+        elif url.path == "/memory/diff":
+            # what this process allocated and kept since the previous /memory/diff
+            snapshot = take_snapshot()
+            previous, _DebugHandler._last_snapshot = _DebugHandler._last_snapshot, snapshot
+            body = retained(previous, snapshot, n) if previous is not None else {"baseline": "taken"}
+        elif url.path == "/memory/jobs":
+            body = REPORTS.read(self.worker_id, n)
+        elif url.path == "/memory/job" and "pid" in query:
+            body = job_allocators(int(query["pid"]))
+        else:
+            self.send_error(404)
+            return
+        data = json.dumps(body, indent=2).encode()
+        self.send_response(200 if body is not None else 504)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def start_worker(port: int) -> Optional[ThreadingHTTPServer]:
+    """
+    Call from the worker process: traces its heap and serves the local
+    debug endpoint (/memory, /memory/diff, /memory/jobs, /memory/job?pid=)
+    on 127.0.0.1:port + DEBUG_PORT_OFFSET.
+    """
+    if not ENABLED:
+        return None
+    start_tracing()
+    _DebugHandler.worker_id = os.getenv("AGENT_WORKER_ID", "dev")
+    server = ThreadingHTTPServer(("127.0.0.1", port + DEBUG_PORT_OFFSET), _DebugHandler)
+    threading.Thread(target=server.serve_forever, name="memory-debug", daemon=True).start()
+    logger.info(f"memory diagnostics on http://127.0.0.1:{port + DEBUG_PORT_OFFSET}/memory")
+    return server
+
+
+# --- soak test ---
+
+class _SoakActions:
+    def __init__(self, events):
+        self.events = events
+
+    async def look_up_availability(self, date: str) -> str:
+        from call_events import AVAILABILITY_CHECKED
+
+        self.events.emit(AVAILABILITY_CHECKED, date=date)
+        return json.dumps({"available_times": ["1pm", "2pm", "3pm"]})
+
+    async def confirm_appointment(self, date: str, time: str, center: str = "") -> str:
+        from call_events import APPOINTMENT_CONFIRMED
+
+        self.events.emit(APPOINTMENT_CONFIRMED, date=date, time=time, center=center)
+        return "reservation confirmed"
+
+
+_SOAK_TURNS = (
+    "hi, I want to book an appointment",
+    "my name is Asha Rao",
+    "I have joint pain in my knees",
+    "Udupi please",
+    "next Tuesday",
+    "3pm",
+    "yes",
+    "what are your timings on Saturday?",
+    "and how much is the consultation?",
+    "okay thank you, bye",
+)
+
+
+async def _simulated_call(i: int, compactor_factory, transcript_dir: str, traced: bool = True, detail: bool = True):
+    job = JobMemory(f"soak-{i}", enabled=traced, detail=detail, worker_id="soak")
+    await job.start()
+    await _call(i, job, compactor_factory, transcript_dir)
+    # measured once the call's objects are out of scope, as when a job's tasks have ended
+    await job.finish()
+    return job.report
+
+
+async def _call(i: int, job: JobMemory, compactor_factory, transcript_dir: str):
+    """One call through the per-call objects agent2 builds, without audio or LiveKit"""
+    from livekit.agents import llm, utils
+
+    from booking_flow import BookingTracker
+    from call_events import CallEvents
+
+    events = CallEvents(call_id=f"soak-{i}", phone=f"91990000{i % 100:04d}", agent="soak")
+    events.started()
+    booking = BookingTracker(_SoakActions(events), events, enabled=True)
+    compactor = compactor_factory()
+    agent = utils.EventEmitter()
+    chat_ctx = llm.ChatContext().append(role="system", text="You are Urmi, an assistant for Dr. Ramesh's Ayurveda clinic. " * 20)
+    log_queue: asyncio.Queue = asyncio.Queue()
+
+    agent.on("user_speech_committed", lambda msg: log_queue.put_nowait(f"USER: {msg.content}\n"))
+    agent.on("agent_speech_committed", lambda msg: log_queue.put_nowait(f"AGENT: {msg.content}\n"))
+    job.watch(agent=agent, log_queue=log_queue)
+
+    async def write_transcription():
+        with open(os.path.join(transcript_dir, f"soak-{i % 10}.txt"), "w", encoding="utf-8") as f:
+            while (line := await log_queue.get()) is not None:
+                f.write(line)
+
+    writer = asyncio.create_task(write_transcription())
+    for turn in range(3):
+        for text in _SOAK_TURNS:
+            chat_ctx.append(role="user", text=text)
+            agent.emit("user_speech_committed", chat_ctx.messages[-1])
+            reply = await booking.reply_to(text) or f"Sure, happy to help with that ({turn})."
+            compactor.apply(chat_ctx)
+            chat_ctx.append(role="assistant", text=reply)
+            agent.emit("agent_speech_committed", chat_ctx.messages[-1])
+            await asyncio.sleep(0)
+
+    log_queue.put_nowait(None)
+    await writer
+    await compactor.aclose()
+    await events.finish()
+
+
+async def _soak(calls: int, warmup: int, detail_every: int) -> bool:
+    import tempfile
+
+    from livekit.plugins import openai
+
+    from context_budget import ContextCompactor
+    from mock_llm_server import create_app, start_server
+
+    server = await start_server(create_app(ttft=0.01, token_interval=0.0), 18961)
+    summarizer = openai.LLM(model="mock-summarizer", base_url="http://127.0.0.1:18961/v1", api_key="mock")
+    with tempfile.TemporaryDirectory() as tmp:
+        compactor = lambda: ContextCompactor(summarizer, budget=600)
+        # lazy imports, sqlite and http connection setup are paid once, before tracing starts
+        for i in range(warmup):
+            await _simulated_call(i, compactor, tmp, traced=False)
+        start_tracing()
+        for i in range(calls):
+            # snapshots and object counts are slow; the trend is sampled on every call
+            detailed = (i + 1) % detail_every == 0
+            report = await _simulated_call(warmup + i, compactor, tmp, detail=detailed)
+            if detailed:
+                last_detail = report
+            if (i + 1) % 50 == 0:
+                print(f"{i + 1:4d} calls: traced {report['traced_mb']:.2f} MB, rss {report['rss_mb']:.0f} MB, "
+                      f"trend {growth.kb_per_job:+.1f} KB traced / {growth.rss_kb_per_job:+.1f} KB RSS per call")
+    await server.cleanup()
+    await summarizer.aclose()
+
+    print(json.dumps({"growth": growth.summary(), "last_detailed_call": {k: last_detail[k] for k in ("retained_kb", "by_subsystem_kb", "top_lines", "live_objects")}}, indent=2))
+    return not growth.leaking
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    import tempfile
+
+    parser = argparse.ArgumentParser(description="Memory diagnostics for agent workers")
+    parser.add_argument("--soak", action="store_true", help="run simulated calls in one process and fail if memory keeps growing")
+    parser.add_argument("--calls", type=int, default=300)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--detail-every", type=int, default=25, help="take full snapshots on every n-th call")
+    parser.add_argument("--worker", default="dev", help="print the latest job reports of this worker")
+    parser.add_argument("-n", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.soak:
+        logging.basicConfig(level=logging.ERROR)
+        os.environ.setdefault("CALL_EVENTS_DB", os.path.join(tempfile.mkdtemp(), "soak_events.db"))
+        ok = asyncio.run(_soak(args.calls, args.warmup, args.detail_every))
+        print("memory bounded" if ok else f"memory grows more than {LEAK_KB_PER_JOB:.0f} KB per call")
+        sys.exit(0 if ok else 1)
+    print(json.dumps(REPORTS.read(args.worker, args.n), indent=2))
@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+from aiohttp import web
+
+
+def create_app(
+    *,
+    ttft: float = 0.2,
+    slow_rate: float = 0.0,
+    slow_ttft: float = 3.0,
+    fail_rate: float = 0.0,
+    fail_status: int = 429,
+    token_interval: float = 0.02,
+    reply: str = "Sure, let me help you with that.",
+    rate_limit: float = 0.0,
+    burst_seconds: float = 2.0,
+) -> web.Application:
+    """
+    OpenAI-compatible streaming chat completions endpoint with injectable
+    latency and failures, for exercising the hedged LLM adapter locally.
+    With `rate_limit` (requests per second) it enforces a token bucket like
+    a provider would and answers 429 when it is empty.
+    """
+    stats = {"requests": 0, "slow": 0, "failed": 0, "rate_limited": 0}
+    bucket = {"level": rate_limit * burst_seconds, "updated": time.monotonic()}
+
+    def over_limit() -> bool:
+        if not rate_limit:
+            return False
+        now = time.monotonic()
+        bucket["level"] = min(rate_limit * burst_seconds, bucket["level"] + (now - bucket["updated"]) * rate_limit)
+        bucket["updated"] = now
+        if bucket["level"] < 1:
+            return True
+        bucket["level"] -= 1
+        return False
+
+    async def chat_completions(request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        stats["requests"] += 1
+        if over_limit():
+            stats["rate_limited"] += 1
+            return web.json_response(
+                {"error": {"message": "rate limit reached", "type": "rate_limit_exceeded"}},
+                status=429,
+                headers={"Retry-After": "1"},
+            )
+        if random.random() < fail_rate:
+            stats["failed"] += 1
+            return web.json_response(
+                {"error": {"message": "injected failure", "type": "rate_limit_exceeded"}}, status=fail_status
+            )
+
+        delay = ttft
+        if random.random() < slow_rate:
+            stats["slow"] += 1
+            delay = slow_ttft
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await asyncio.sleep(delay)
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        try:
+            await _stream_reply(response, completion_id, body.get("model", "mock"))
+        except ConnectionResetError:
+            # the hedged client cancels the losing request mid-stream
+            pass
+        return response
+
+    async def _stream_reply(response: web.StreamResponse, completion_id: str, model: str):
+        for i, token in enumerate(reply.split(" ")):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": token if i == 0 else f" {token}"}, "finish_reason": None}],
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            await asyncio.sleep(token_interval)
+        done = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        }
+        await response.write(f"data: {json.dumps(done)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+
+    async def get_stats(_: web.Request) -> web.Response:
+        return web.json_response(stats)
+
+    app = web.Application()
+    app["stats"] = stats
+    app.add_routes([web.post("/v1/chat/completions", chat_completions), web.get("/stats", get_stats)])
+    return app
+
+
+async def start_server(app: web.Application, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible LLM server with injected latency and failures")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--ttft", type=float, default=0.2, help="normal time to first token (s)")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="fraction of requests that are slow")
+    parser.add_argument("--slow-ttft", type=float, default=3.0, help="time to first token of slow requests (s)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument("--fail-status", type=int, default=429)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="requests per second before answering 429")
+    args = parser.parse_args()
+
+    web.run_app(
+        create_app(
+            ttft=args.ttft,
+            slow_rate=args.slow_rate,
+            slow_ttft=args.slow_ttft,
+            fail_rate=args.fail_rate,
+            fail_status=args.fail_status,
+            rate_limit=args.rate_limit,
+        ),
+        host="127.0.0.1",
+        port=args.port,
+    )
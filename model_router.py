@@ -0,0 +1,242 @@
+from __future__ import annotations
+
+import logging
+import os
+import re
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Optional
+
+from livekit.agents import APIConnectOptions, llm
+
+
+logger = logging.getLogger("model-router")
+
+FAST = "fast"
+LARGE = "large"
+
+FAST_MODEL = os.getenv("LLM_FAST_MODEL", "llama-3.1-8b-instant")
+LARGE_MODEL = os.getenv("LLM_LARGE_MODEL", "llama-3.3-70b-versatile")
+
+# caller wording that usually leads to a tool call or needs careful handling
+_INTENT_WORDS = re.compile(
+    r"\b(book|booking|appointment|schedule|reschedule|cancel|available|availability|slot|confirm|"
+    r"change|instead|another|other|bye|goodbye|hang ?up|disconnect|complain|problem with|refund|price|cost|fee)\b"
+)
+_QUESTION_WORDS = re.compile(r"\b(what|why|how|which|where|when|who|can you|could you|do you|is there|are there|tell me)\b")
+# agent turns that ask the caller to confirm, so the reply likely triggers confirm_appointment
+_CONFIRM_PROMPT = re.compile(r"\b(confirm|shall i|should i|book it|lock (it|that) in|is that (right|correct)|all set)\b")
+_MAX_FAST_WORDS = 8
+
+
+@dataclass
+class Route:
+    target: str
+    reason: str
+
+
+def _text(msg: llm.ChatMessage) -> str:
+    return msg.content if isinstance(msg.content, str) else ""
+
+
+def classify_turn(chat_ctx: llm.ChatContext) -> Route:
+    """
+    Decide locally whether the next reply can come from the fast model.
+    Anything involving tools, confirmation, long or open-ended input, or a
+    non-Latin script goes to the large model.
+    """
+    messages = chat_ctx.messages
+    if not messages:
+        return Route(LARGE, "empty context")
+
+    last = messages[-1]
+    if last.role == "tool" or last.tool_calls:
+        # the model has to turn a tool result into a reply or continue a tool chain
+        return Route(LARGE, "pending tool call")
+    if last.role != "user":
+        return Route(LARGE, f"last message is {last.role}")
+
+    text = _text(last).strip().lower()
+    if not text:
+        return Route(LARGE, "non-text input")
+    if not text.isascii():
+        return Route(LARGE, "non-latin script")
+    words = text.split()
+    if len(words) > _MAX_FAST_WORDS:
+        return Route(LARGE, "long turn")
+    if _INTENT_WORDS.search(text):
+        return Route(LARGE, "booking or call-control intent")
+    if "?" in text or _QUESTION_WORDS.search(text):
+        return Route(LARGE, "open question")
+
+    previous_agent = next((m for m in reversed(messages[:-1]) if m.role == "assistant"), None)
+    if previous_agent is not None and _CONFIRM_PROMPT.search(_text(previous_agent).lower()):
+        return Route(LARGE, "answer to confirmation prompt")
+    if previous_agent is None:
+        return Route(LARGE, "first turn")
+    return Route(FAST, "short slot answer")
+
+
+@dataclass
+class RouteStats:
+    requests: int = 0
+    ttft_total: float = 0.0
+    ttft_count: int = 0
+    errors: int = 0
+    reasons: dict[str, int] = field(default_factory=lambda: defaultdict(int))
+
+    @property
+    def avg_ttft(self) -> float:
+        return self.ttft_total / self.ttft_count if self.ttft_count else 0.0
+
+
+class ModelRouter(llm.LLM):
+    """
+    Route each turn to `fast` or `large` based on classify_turn. The fast
+    model never calls tools (tool_choice="none"); turns that may need a tool
+    are classified as large.
+    """
+
+    def __init__(self, *, fast: llm.LLM, large: llm.LLM):
+        super().__init__()
+        self.fast = fast
+        self.large = large
+        self.stats = {FAST: RouteStats(), LARGE: RouteStats()}
+
+    def chat(
+        self,
+        *,
+        chat_ctx: llm.ChatContext,
+        conn_options: APIConnectOptions = APIConnectOptions(),
+        fnc_ctx: Optional[llm.FunctionContext] = None,
+        **kwargs,
+    ) -> "RoutedLLMStream":
+        route = classify_turn(chat_ctx)
+        stats = self.stats[route.target]
+        stats.requests += 1
+        stats.reasons[route.reason] += 1
+        logger.info(f"routing turn to {route.target} model ({route.reason})")
+
+        kwargs = {k: v for k, v in kwargs.items() if v is not None}
+        if route.target == FAST:
+            inner = self.fast.chat(chat_ctx=chat_ctx, conn_options=conn_options, fnc_ctx=fnc_ctx, **{**kwargs, "tool_choice": "none"})
+        else:
+            inner = self.large.chat(chat_ctx=chat_ctx, conn_options=conn_options, fnc_ctx=fnc_ctx, **kwargs)
+        return RoutedLLMStream(self, inner, route=route, chat_ctx=chat_ctx, fnc_ctx=fnc_ctx, conn_options=conn_options)
+
+    def summary(self) -> dict:
+        return {
+            target: {"requests": s.requests, "avg_ttft_ms": s.avg_ttft * 1000, "errors": s.errors, "reasons": dict(s.reasons)}
+            for target, s in self.stats.items()
+        }
+
+
+class RoutedLLMStream(llm.LLMStream):
+    def __init__(
+        self,
+        router: ModelRouter,
+        inner: llm.LLMStream,
+        *,
+        route: Route,
+        chat_ctx: llm.ChatContext,
+        fnc_ctx: Optional[llm.FunctionContext],
+        conn_options: APIConnectOptions,
+    ):
+        # the inner stream already retries on its own
+        super().__init__(router, chat_ctx=chat_ctx, fnc_ctx=fnc_ctx, conn_options=APIConnectOptions(max_retry=0, timeout=conn_options.timeout))
+        self._router = router
+        self._inner = inner
+        self._route = route
+
+    async def _run(self) -> None:
+        stats = self._router.stats[self._route.target]
+        started = time.perf_counter()
+        first = True
+        try:
+            async for chunk in self._inner:
+                if first:
+                    first = False
+                    stats.ttft_total += time.perf_counter() - started
+                    stats.ttft_count += 1
+                for choice in chunk.choices:
+                    if choice.delta.tool_calls:
+                        self._function_calls_info.extend(choice.delta.tool_calls)
+                self._event_ch.send_nowait(chunk)
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            await self._inner.aclose()
+
+
+def routed_groq(temperature: float = 0.8) -> llm.LLM:
+    """
+    Groq fast/large pair behind a ModelRouter, each hedged by with_fallback.
+    LLM_ROUTING=off sends every turn to the large model.
+    """
+    from livekit.plugins import openai
+
+    from hedged_llm import with_fallback
+    from rate_limiter import limited
+
+    large = with_fallback(limited(openai.LLM.with_groq(model=LARGE_MODEL, temperature=temperature), "groq", LARGE_MODEL))
+    if os.getenv("LLM_ROUTING", "on") == "off":
+        return large
+    fast = with_fallback(limited(openai.LLM.with_groq(model=FAST_MODEL, temperature=temperature), "groq", FAST_MODEL))
+    return ModelRouter(fast=fast, large=large)
+
+
+def evaluate(calls: list[list[dict]], fast_ttft: float, large_ttft: float) -> dict:
+    """
+    Replay recorded calls through classify_turn. Reports the route split and
+    the time to first token saved if each model performs at the given TTFT.
+    Turns that the agent answered with a booking confirmation but that would
+    have gone to the fast model are counted as likely misroutes.
+    """
+    routes: dict[str, int] = defaultdict(int)
+    reasons: dict[str, int] = defaultdict(int)
+    misroutes = 0
+    for call in calls:
+        ctx = llm.ChatContext()
+        for i, turn in enumerate(call):
+            role = "user" if turn["speaker"] == "User" else "assistant"
+            ctx.append(role=role, text=turn["text"])
+            if role != "user":
+                continue
+            route = classify_turn(ctx)
+            routes[route.target] += 1
+            reasons[f"{route.target}: {route.reason}"] += 1
+            reply = call[i + 1]["text"].lower() if i + 1 < len(call) else ""
+            if route.target == FAST and ("confirmed" in reply or "booked" in reply):
+                misroutes += 1
+    total = sum(routes.values())
+    saved = routes[FAST] * (large_ttft - fast_ttft)
+    return {
+        "turns": total,
+        "fast_share": routes[FAST] / total if total else 0.0,
+        "likely_misroutes": misroutes,
+        "ttft_saved_per_turn_ms": saved / total * 1000 if total else 0.0,
+        "reasons": dict(sorted(reasons.items(), key=lambda kv: -kv[1])),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    from transcript_archive import TranscriptArchive, parse_log_content
+
+    parser = argparse.ArgumentParser(description="Evaluate per-turn model routing on recorded transcripts")
+    parser.add_argument("--fast-ttft", type=float, default=0.15, help="measured fast model TTFT (s)")
+    parser.add_argument("--large-ttft", type=float, default=0.45, help="measured large model TTFT (s)")
+    args = parser.parse_args()
+
+    archive = TranscriptArchive()
+    calls = []
+    for entry in archive.list_calls():
+        try:
+            calls.extend(parse_log_content(archive.read_text(entry["file"])))
+        except OSError:
+            pass
+    print(json.dumps(evaluate(calls, args.fast_ttft, args.large_ttft), indent=2))
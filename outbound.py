@@ -16,11 +16,19 @@ from livekit.agents import (
     cli,
     llm,
 )
-from livekit.agents.multimodal import MultimodalAgent
 from livekit.agents.pipeline import VoicePipelineAgent
-from livekit.plugins import openai, google, silero, turn_detector
-from livekit.plugins.openai import stt, llm as LLM
-from livekit.plugins.cartesia import tts
+
+from context_budget import groq_compactor
+from loop_monitor import LoopMonitor
+from model_router import routed_groq
+from call_events import ANSWERING_MACHINE, APPOINTMENT_CONFIRMED, AVAILABILITY_CHECKED, CallEvents
+from providers import Pipeline, plugin
+from stt_upload import compact_stt
+from audio_ring import SharedVAD
+from barge_in import BargeIn
+from clause_tts import clause_tts
+from call_trace import CallTrace
+from tool_runner import ToolRunner, filler, read_only
 
 
 # load environment variables, this is optional, only used for local development
@@ -28,6 +36,17 @@ load_dotenv(dotenv_path=".env.local")
 logger = logging.getLogger("outbound-caller")
 logger.setLevel(logging.INFO)
 
+PIPELINE = Pipeline(
+    stt="groq",
+    stt_options={"model": "whisper-large-v3-turbo", "detect_language": True},
+    tts="cartesia",
+    tts_options={
+        "model": "sonic",
+        "voice": "c2ac25f9-ecc4-4f56-9095-651354df60c0",
+        "emotion": ["curiosity:high", "positivity:high"],
+    },
+).from_env().load()
+
 outbound_trunk_id = os.getenv("SIP_OUTBOUND_TRUNK_ID")
 _default_instructions = (
     "You are a scheduling assistant for a dental practice. Your interface with user will be voice."
@@ -42,8 +61,10 @@ _default_instructions = (
 
 async def entrypoint(ctx: JobContext):
     global _default_instructions, outbound_trunk_id
+    trace = CallTrace(ctx.room.name, agent="outbound-caller").attach(ctx)
     logger.info(f"connecting to room {ctx.room.name}")
-    await ctx.connect(auto_subscribe=AutoSubscribe.AUDIO_ONLY)
+    with trace.span("connect"):
+        await ctx.connect(auto_subscribe=AutoSubscribe.AUDIO_ONLY)
 
     user_identity = "phone_user"
     # the phone number to dial is provided in the job metadata
@@ -57,43 +78,54 @@ async def entrypoint(ctx: JobContext):
     )
 
     # `create_sip_participant` starts dialing the user
-    await ctx.api.sip.create_sip_participant(
-        api.CreateSIPParticipantRequest(
-            room_name=ctx.room.name,
-            sip_trunk_id=outbound_trunk_id,
-            sip_call_to=phone_number,
-            participant_identity=user_identity,
+    with trace.span("sip dial"):
+        await ctx.api.sip.create_sip_participant(
+            api.CreateSIPParticipantRequest(
+                room_name=ctx.room.name,
+                sip_trunk_id=outbound_trunk_id,
+                sip_call_to=phone_number,
+                participant_identity=user_identity,
+            )
         )
-    )
 
     # a participant is created as soon as we start dialing
-    participant = await ctx.wait_for_participant(identity=user_identity)
+    with trace.span("wait_for_participant"):
+        participant = await ctx.wait_for_participant(identity=user_identity)
+
+    call_events = CallEvents(call_id=ctx.room.name, phone=phone_number, agent="outbound-caller")
+    call_events.started()
+    ctx.add_shutdown_callback(call_events.finish)
 
     # start the agent, either a VoicePipelineAgent or MultimodalAgent
     # this can be started before the user picks up. The agent will only start
     # speaking once the user answers the call.
-    run_voice_pipeline_agent(ctx, participant, instructions)
-    #run_multimodal_agent(ctx, participant, instructions)
+    run_voice_pipeline_agent(ctx, participant, instructions, call_events, trace)
+    #run_multimodal_agent(ctx, participant, instructions, call_events)
 
     # in addition, you can monitor the call status separately
     start_time = perf_counter()
-    while perf_counter() - start_time < 30:
-        call_status = participant.attributes.get("sip.callStatus")
-        if call_status == "active":
-            logger.info("user has picked up")
-            return
-        elif call_status == "automation":
-            # if DTMF is used in the `sip_call_to` number, typically used to dial
-            # an extension or enter a PIN.
-            # during DTMF dialing, the participant will be in the "automation" state
-            pass
-        elif participant.disconnect_reason == rtc.DisconnectReason.USER_REJECTED:
-            logger.info("user rejected the call, exiting job")
-            break
-        elif participant.disconnect_reason == rtc.DisconnectReason.USER_UNAVAILABLE:
-            logger.info("user did not pick up, exiting job")
-            break
-        await asyncio.sleep(0.1)
+    with trace.span("ringing", outcome="timeout") as ringing:
+        while perf_counter() - start_time < 30:
+            call_status = participant.attributes.get("sip.callStatus")
+            if call_status == "active":
+                logger.info("user has picked up")
+                ringing["outcome"] = "answered"
+                trace.instant("pickup")
+                return
+            elif call_status == "automation":
+                # if DTMF is used in the `sip_call_to` number, typically used to dial
+                # an extension or enter a PIN.
+                # during DTMF dialing, the participant will be in the "automation" state
+                pass
+            elif participant.disconnect_reason == rtc.DisconnectReason.USER_REJECTED:
+                logger.info("user rejected the call, exiting job")
+                ringing["outcome"] = "rejected"
+                break
+            elif participant.disconnect_reason == rtc.DisconnectReason.USER_UNAVAILABLE:
+                logger.info("user did not pick up, exiting job")
+                ringing["outcome"] = "unanswered"
+                break
+            await asyncio.sleep(0.1)
 
     logger.info("session timed out, exiting job")
     ctx.shutdown()
@@ -105,13 +137,20 @@ class CallActions(llm.FunctionContext):
     """
 
     def __init__(
-        self, *, api: api.LiveKitAPI, participant: rtc.RemoteParticipant, room: rtc.Room
+        self,
+        *,
+        api: api.LiveKitAPI,
+        participant: rtc.RemoteParticipant,
+        room: rtc.Room,
+        events: CallEvents,
     ):
         super().__init__()
 
         self.api = api
         self.participant = participant
         self.room = room
+        self.events = events
+        self.tools = ToolRunner()
 
     async def hangup(self):
         try:
@@ -129,9 +168,12 @@ class CallActions(llm.FunctionContext):
     async def end_call(self):
         """Called when the user wants to end the call"""
         logger.info(f"ending the call for {self.participant.identity}")
+        self.events.ended_by_agent()
         await self.hangup()
 
     @llm.ai_callable()
+    @filler("check")
+    @read_only
     async def look_up_availability(
         self,
         date: Annotated[str, "The date of the appointment to check availability for"],
@@ -140,6 +182,7 @@ class CallActions(llm.FunctionContext):
         logger.info(
             f"looking up availability for {self.participant.identity} on {date}"
         )
+        self.events.emit(AVAILABILITY_CHECKED, date=date)
         await asyncio.sleep(3)
         return json.dumps(
             {
@@ -148,6 +191,7 @@ class CallActions(llm.FunctionContext):
         )
 
     @llm.ai_callable()
+    @filler("book")
     async def confirm_appointment(
         self,
         date: Annotated[str, "date of the appointment"],
@@ -157,17 +201,23 @@ class CallActions(llm.FunctionContext):
         logger.info(
             f"confirming appointment for {self.participant.identity} on {date} at {time}"
         )
+        self.events.emit(APPOINTMENT_CONFIRMED, date=date, time=time)
         return "reservation confirmed"
 
     @llm.ai_callable()
     async def detected_answering_machine(self):
         """Called when the call reaches voicemail. Use this tool AFTER you hear the voicemail greeting"""
         logger.info(f"detected answering machine for {self.participant.identity}")
+        self.events.emit(ANSWERING_MACHINE)
         await self.hangup()
 
 
 def run_voice_pipeline_agent(
-    ctx: JobContext, participant: rtc.RemoteParticipant, instructions: str
+    ctx: JobContext,
+    participant: rtc.RemoteParticipant,
+    instructions: str,
+    call_events: CallEvents,
+    trace: CallTrace,
 ):
     logger.info("starting voice pipeline agent")
 
@@ -176,43 +226,53 @@ def run_voice_pipeline_agent(
         text=instructions,
     )
 
+    compactor = groq_compactor()
+    vad = SharedVAD(ctx.proc.userdata["vad"])
+    call_actions = CallActions(api=ctx.api, participant=participant, room=ctx.room, events=call_events)
     agent = VoicePipelineAgent(
-        vad=ctx.proc.userdata["vad"],
-        stt=stt.STT.with_groq(model="whisper-large-v3-turbo", detect_language=True),
-        llm=LLM.LLM.with_groq(model="llama-3.3-70b-versatile", temperature=0.8),
-        tts=tts.TTS(
-            model="sonic",
-            voice="c2ac25f9-ecc4-4f56-9095-651354df60c0",
-            emotion=["curiosity:high", "positivity:high"]
-        ),
+        vad=vad,
+        stt=compact_stt(PIPELINE, vad, ctx),
+        llm=routed_groq(temperature=0.8),
+        tts=clause_tts(PIPELINE.make_tts()),
         chat_ctx=initial_ctx,
-        fnc_ctx=CallActions(api=ctx.api, participant=participant, room=ctx.room),
-        turn_detector=turn_detector.EOUModel(),
+        fnc_ctx=call_actions,
+        turn_detector=PIPELINE.make_turn_detector(),
+        before_llm_cb=compactor.before_llm,
         min_endpointing_delay=0.3,
         max_endpointing_delay=1.0
     )
+    compactor.attach(agent, ctx)
+    LoopMonitor(ctx.room.name).attach(agent, ctx)
+    BargeIn(agent, vad).attach(ctx)
+    trace.watch(agent)
+    call_actions.tools.attach(agent, ctx)
 
     agent.start(ctx.room, participant)
 
 
 def run_multimodal_agent(
-    ctx: JobContext, participant: rtc.RemoteParticipant, instructions: str
+    ctx: JobContext,
+    participant: rtc.RemoteParticipant,
+    instructions: str,
+    call_events: CallEvents,
 ):
     logger.info("starting multimodal agent")
+    # imported here so pipeline-only jobs never load the multimodal agent
+    from livekit.agents.multimodal import MultimodalAgent
 
-    model = openai.realtime.RealtimeModel(
+    model = plugin("openai").realtime.RealtimeModel(
         instructions=instructions,
         modalities=["audio", "text"],
     )
     agent = MultimodalAgent(
         model=model,
-        fnc_ctx=CallActions(api=ctx.api, participant=participant, room=ctx.room),
+        fnc_ctx=CallActions(api=ctx.api, participant=participant, room=ctx.room, events=call_events),
     )
     agent.start(ctx.room, participant)
 
 
 def prewarm(proc: JobProcess):
-    proc.userdata["vad"] = silero.VAD.load()
+    proc.userdata["vad"] = PIPELINE.make_vad()
 
 
 if __name__ == "__main__":
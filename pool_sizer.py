@@ -0,0 +1,289 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Optional
+
+import psutil
+
+from call_events import CallEventStore
+from runtime_reports import RUNTIME_DIR
+
+
+logger = logging.getLogger("pool-sizer")
+
+POOL_DIR = os.path.join(RUNTIME_DIR, "pool")
+
+MIN_IDLE = int(os.getenv("POOL_MIN_IDLE", "1"))
+MAX_IDLE = int(os.getenv("POOL_MAX_IDLE", "16"))
+# memory kept free for running calls when sizing the idle pool
+MEMORY_RESERVE_MB = float(os.getenv("POOL_MEMORY_RESERVE_MB", "1024"))
+# used until an idle process has been measured
+DEFAULT_PROCESS_MB = 450.0
+# used until a process start has been timed
+DEFAULT_WARM_SECONDS = 8.0
+# probability that more calls arrive while a replacement process warms up than we hold idle
+COLD_START_RISK = 0.001
+
+SLOT_MINUTES = 15
+# the forecast looks this far ahead, so the pool grows before a ramp, not during it
+LOOKAHEAD_MINUTES = 30
+HISTORY_WEEKS = 4
+HISTORY_REFRESH_SECONDS = 3600
+# an idle pool larger than needed is only shrunk after this long
+SHRINK_AFTER_SECONDS = 300
+# livekit-agents ProcPool internals the sizer drives (tested with 0.12.21, pinned in requirements.txt);
+# without them the pool keeps its starting size
+_POOL_ATTRIBUTES = ("launch_job", "on", "_num_idle_processes", "_proc_needed_sem", "_warmed_proc_queue")
+
+
+def poisson_quantile(mean: float, p: float) -> int:
+    """Smallest k with P(X <= k) >= p for X ~ Poisson(mean)"""
+    if mean <= 0:
+        return 0
+    term = math.exp(-mean)
+    cdf = term
+    k = 0
+    while cdf < p and k < 1000:
+        k += 1
+        term *= mean / k
+        cdf += term
+    return k
+
+
+class ArrivalForecast:
+    """
+    Call arrival rate for one worker: the larger of the recent observed rate
+    and the time-of-day rate from the last few weeks of call_started events,
+    over the next LOOKAHEAD_MINUTES.
+    """
+
+    def __init__(self, store: Optional[CallEventStore] = None, num_workers: int = 1):
+        self.store = store or CallEventStore()
+        self.num_workers = max(1, num_workers)
+        self._arrivals: deque[float] = deque()
+        self._history: dict[tuple[int, int], float] = {}
+        self._history_loaded_at = 0.0
+
+    def record_arrival(self):
+        self._arrivals.append(time.monotonic())
+
+    def recent_rate(self) -> float:
+        now = time.monotonic()
+        while self._arrivals and self._arrivals[0] < now - 300:
+            self._arrivals.popleft()
+        last_minute = sum(1 for t in self._arrivals if t >= now - 60)
+        # the one-minute rate reacts to a ramp, the five-minute rate smooths noise
+        return max(len(self._arrivals) / 300, last_minute / 60)
+
+    def _refresh_history(self):
+        if time.time() - self._history_loaded_at < HISTORY_REFRESH_SECONDS:
+            return
+        self._history_loaded_at = time.time()
+        since = time.time() - HISTORY_WEEKS * 7 * 86400
+        try:
+            counts = self.store.arrivals_by_slot(since, SLOT_MINUTES)
+            first = self.store.first_event_ts() or time.time()
+        except Exception as e:
+            logger.warning(f"could not load call history: {e}")
+            return
+        weeks = min(HISTORY_WEEKS, max(1, math.ceil((time.time() - max(first, since)) / (7 * 86400))))
+        slot_seconds = SLOT_MINUTES * 60
+        # calls per second per worker, averaged over the weeks of history
+        self._history = {slot: n / weeks / slot_seconds / self.num_workers for slot, n in counts.items()}
+
+    def historical_rate(self, now: Optional[datetime] = None) -> float:
+        self._refresh_history()
+        now = now or datetime.now()
+        rate = 0.0
+        for minutes in range(0, LOOKAHEAD_MINUTES + 1, SLOT_MINUTES):
+            t = now + timedelta(minutes=minutes)
+            slot = (t.weekday(), (t.hour * 60 + t.minute) // SLOT_MINUTES)
+            rate = max(rate, self._history.get(slot, 0.0))
+        return rate
+
+    def rate(self) -> float:
+        return max(self.recent_rate(), self.historical_rate())
+
+
+class PoolSizer:
+    """
+    Sizes the worker's pool of prewarmed idle job processes. Plugged in as
+    WorkerOptions.load_fnc, which the worker calls every few seconds with
+    itself as argument: the target is the number of calls that can arrive
+    (with 1 - COLD_START_RISK confidence) while one replacement process
+    warms up, capped by the memory free on the host. Every job launch that
+    had to wait for a process is counted as a cold start.
+    """
+
+    def __init__(self, forecast: Optional[ArrivalForecast] = None, worker_id: Optional[str] = None):
+        self.forecast = forecast or ArrivalForecast(num_workers=int(os.getenv("AGENT_NUM_WORKERS", "1")))
+        self.worker_id = worker_id or os.getenv("AGENT_WORKER_ID", "dev")
+        self.launches = 0
+        self.cold_starts = 0
+        self.cold_wait_total = 0.0
+        self._warm_times: deque[float] = deque(maxlen=20)
+        self._process_mb: deque[float] = deque(maxlen=20)
+        self._created_at: dict[int, float] = {}
+        self._shrink_since: Optional[float] = None
+        self._pool = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+        self.target = self.initial_idle()
+
+    def initial_idle(self) -> int:
+        """Starting pool size, from history alone (WorkerOptions.num_idle_processes)"""
+        return self._clamp(poisson_quantile(self.forecast.historical_rate() * DEFAULT_WARM_SECONDS, 1 - COLD_START_RISK))
+
+    @property
+    def warm_seconds(self) -> float:
+        return sum(self._warm_times) / len(self._warm_times) if self._warm_times else DEFAULT_WARM_SECONDS
+
+    @property
+    def process_mb(self) -> float:
+        return sum(self._process_mb) / len(self._process_mb) if self._process_mb else DEFAULT_PROCESS_MB
+
+    def memory_cap(self) -> int:
+        available_mb = psutil.virtual_memory().available / 1024 / 1024
+        return max(MIN_IDLE, int((available_mb - MEMORY_RESERVE_MB) / self.process_mb))
+
+    def _clamp(self, n: int) -> int:
+        return max(MIN_IDLE, min(MAX_IDLE, n, self.memory_cap()))
+
+    def desired(self) -> int:
+        return self._clamp(poisson_quantile(self.forecast.rate() * self.warm_seconds, 1 - COLD_START_RISK))
+
+    # --- runs on the worker's event loop ---
+
+    def _attach(self, worker):
+        pool = getattr(worker, "_proc_pool", None)
+        missing = [name for name in _POOL_ATTRIBUTES if not hasattr(pool, name)]
+        if not missing and not hasattr(pool._proc_needed_sem, "_value"):
+            missing.append("_proc_needed_sem._value")
+        if missing:
+            logger.warning(f"process pool has no {', '.join(missing)}; keeping a static pool of {self.target}")
+            return
+        self._pool = pool
+        launch_job = pool.launch_job
+
+        async def timed_launch_job(info):
+            self.forecast.record_arrival()
+            cold = pool._warmed_proc_queue.empty()
+            started = time.monotonic()
+            await launch_job(info)
+            self.launches += 1
+            if cold:
+                waited = time.monotonic() - started
+                self.cold_starts += 1
+                self.cold_wait_total += waited
+                logger.warning(f"cold start: job waited {waited:.1f}s for a process (pool target {self.target})")
+            # a call just took an idle process; react now rather than at the next load tick
+            self._resize(self.desired())
+
+        pool.launch_job = timed_launch_job
+        pool.on("process_created", lambda proc: self._created_at.__setitem__(id(proc), time.monotonic()))
+        pool.on("process_ready", self._on_process_ready)
+
+    def _on_process_ready(self, proc):
+        created = self._created_at.pop(id(proc), None)
+        if created is not None:
+            self._warm_times.append(time.monotonic() - created)
+        try:
+            self._process_mb.append(psutil.Process(proc.pid).memory_info().rss / 1024 / 1024)
+        except (psutil.Error, TypeError, AttributeError):
+            pass
+
+    def _resize(self, desired: int):
+        pool = self._pool
+        current = pool._num_idle_processes
+        if desired > current:
+            self._shrink_since = None
+            pool._num_idle_processes = desired
+            for _ in range(desired - current):
+                # every release makes the pool start one more process
+                pool._proc_needed_sem.release()
+            logger.info(f"growing idle pool {current} -> {desired}")
+        elif desired < current:
+            now = time.monotonic()
+            self._shrink_since = self._shrink_since or now
+            if now - self._shrink_since < SHRINK_AFTER_SECONDS:
+                return
+            self._shrink_since = None
+            surplus = current - desired
+            pool._num_idle_processes = desired
+            # first cancel processes that have not been started yet, then close idle ones
+            while surplus and not pool._proc_needed_sem.locked():
+                pool._proc_needed_sem._value -= 1
+                surplus -= 1
+            while surplus and not pool._warmed_proc_queue.empty():
+                asyncio.ensure_future(pool._warmed_proc_queue.get_nowait().aclose())
+                surplus -= 1
+            logger.info(f"shrinking idle pool {current} -> {desired}")
+        else:
+            self._shrink_since = None
+        self.target = desired
+
+    # --- WorkerOptions.load_fnc, called on an executor thread ---
+
+    def load_fnc(self, worker) -> float:
+        with self._lock:
+            if self._loop is None:
+                self._loop = worker._loop
+                self._loop.call_soon_threadsafe(self._attach, worker)
+            elif self._pool is not None:
+                self._loop.call_soon_threadsafe(self._resize, self.desired())
+                self.write_stats()
+        try:
+            from livekit.agents.worker import _DefaultLoadCalc
+        except ImportError:
+            return psutil.cpu_percent() / 100
+        return _DefaultLoadCalc.get_load(worker)
+
+    def stats(self) -> dict:
+        pool = self._pool
+        return {
+            "worker_id": self.worker_id,
+            "target_idle": self.target,
+            "idle": pool._warmed_proc_queue.qsize() if pool else 0,
+            "launches": self.launches,
+            "cold_starts": self.cold_starts,
+            "avg_cold_wait_ms": self.cold_wait_total / self.cold_starts * 1000 if self.cold_starts else 0.0,
+            "warm_seconds": self.warm_seconds,
+            "process_mb": self.process_mb,
+            "recent_rate_per_min": self.forecast.recent_rate() * 60,
+            "forecast_rate_per_min": self.forecast.historical_rate() * 60,
+            "memory_cap": self.memory_cap(),
+            "updated_at": time.time(),
+        }
+
+    def write_stats(self):
+        os.makedirs(POOL_DIR, exist_ok=True)
+        path = os.path.join(POOL_DIR, f"{self.worker_id}.json")
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.stats(), f)
+        os.replace(tmp, path)
+
+
+def read_stats(worker_id) -> Optional[dict]:
+    try:
+        with open(os.path.join(POOL_DIR, f"{worker_id}.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+if __name__ == "__main__":
+    forecast = ArrivalForecast(num_workers=int(os.getenv("AGENT_NUM_WORKERS", "1")))
+    now = datetime.now().replace(minute=0, second=0, microsecond=0)
+    print("hour  calls/min/worker  idle processes")
+    for hour in range(24):
+        rate = forecast.historical_rate(now.replace(hour=hour))
+        print(f"{hour:02d}:00 {rate * 60:16.2f}  {poisson_quantile(rate * DEFAULT_WARM_SECONDS, 1 - COLD_START_RISK):14d}")
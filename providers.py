@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import importlib
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field, replace
+from types import ModuleType
+from typing import Optional
+
+
+logger = logging.getLogger("providers")
+
+PLUGIN_MODULES = {
+    "openai": "livekit.plugins.openai",
+    "google": "livekit.plugins.google",
+    "deepgram": "livekit.plugins.deepgram",
+    "cartesia": "livekit.plugins.cartesia",
+    "silero": "livekit.plugins.silero",
+    "turn_detector": "livekit.plugins.turn_detector",
+    "local_stt": "local_stt",
+    "local_tts": "local_tts",
+}
+
+# provider name -> (plugin, factory taking the plugin module and the provider options)
+STT_PROVIDERS = {
+    "groq": ("openai", lambda m, **o: m.STT.with_groq(**o)),
+    "openai": ("openai", lambda m, **o: m.STT(**o)),
+    "deepgram": ("deepgram", lambda m, **o: m.STT(**o)),
+    "google": ("google", lambda m, **o: m.STT(**o)),
+    # the host's faster-whisper server; needs the call's SharedVAD, see stt_upload.compact_stt
+    "local": ("local_stt", lambda m, **o: m.LocalSTT(**o)),
+}
+TTS_PROVIDERS = {
+    "openai": ("openai", lambda m, **o: m.TTS(**o)),
+    "cartesia": ("cartesia", lambda m, **o: m.TTS(**o)),
+    "deepgram": ("deepgram", lambda m, **o: m.TTS(**o)),
+    "google": ("google", lambda m, **o: m.TTS(**o)),
+    # the host's Piper server
+    "local": ("local_tts", lambda m, **o: m.LocalTTS(**o)),
+}
+VAD_PROVIDERS = {
+    "silero": ("silero", lambda m, **o: m.VAD.load(**o)),
+}
+TURN_DETECTORS = {
+    "eou": ("turn_detector", lambda m, **o: m.EOUModel(**o)),
+}
+
+_import_ms: dict[str, float] = {}
+
+
+def plugin(name: str) -> ModuleType:
+    """
+    The plugin module, imported on first use. livekit only accepts plugin
+    registration on the main thread, so anything a job will need must be
+    loaded at module import through Pipeline.load(), not from a job.
+    """
+    module_name = PLUGIN_MODULES[name]
+    if name not in _import_ms and threading.current_thread() is not threading.main_thread():
+        raise RuntimeError(f"plugin {name!r} was not loaded at startup; add it to the pipeline")
+    started = time.perf_counter()
+    module = importlib.import_module(module_name)
+    _import_ms.setdefault(name, (time.perf_counter() - started) * 1000)
+    return module
+
+
+def import_times() -> dict[str, float]:
+    """Milliseconds each plugin took to import in this process (0 if something else imported it first)"""
+    return dict(_import_ms)
+
+
+@dataclass(frozen=True)
+class Pipeline:
+    """
+    Providers one entrypoint uses. Only their plugins are imported, so a
+    job process does not pay for SDKs it never calls. PIPELINE_STT and
+    PIPELINE_TTS switch providers without a code change; the options of the
+    replaced provider are dropped, so the new one runs with its defaults.
+    PIPELINE_TTS_FALLBACK adds a TTS that takes over when the first fails.
+    """
+
+    stt: str = "groq"
+    tts: str = "openai"
+    vad: str = "silero"
+    turn_detector: str = "eou"
+    stt_options: dict = field(default_factory=dict)
+    tts_options: dict = field(default_factory=dict)
+    tts_fallback: Optional[str] = None
+    tts_fallback_options: dict = field(default_factory=dict)
+    # plugins the entrypoint uses directly, e.g. openai for its LLM
+    extra_plugins: tuple[str, ...] = ("openai",)
+
+    def from_env(self) -> Pipeline:
+        pipeline = self
+        fallback = os.getenv("PIPELINE_TTS_FALLBACK", self.tts_fallback or "") or None
+        if fallback != self.tts_fallback:
+            # the entrypoint's own provider keeps its options as the fallback
+            options = self.tts_options if fallback == self.tts else {}
+            pipeline = replace(pipeline, tts_fallback=fallback, tts_fallback_options=options)
+        stt = os.getenv("PIPELINE_STT", self.stt)
+        if stt != self.stt:
+            pipeline = replace(pipeline, stt=stt, stt_options={})
+        tts = os.getenv("PIPELINE_TTS", self.tts)
+        if tts != self.tts:
+            pipeline = replace(pipeline, tts=tts, tts_options={})
+        return pipeline
+
+    def plugins(self) -> list[str]:
+        names = [
+            STT_PROVIDERS[self.stt][0],
+            TTS_PROVIDERS[self.tts][0],
+            *([TTS_PROVIDERS[self.tts_fallback][0]] if self.tts_fallback else []),
+            VAD_PROVIDERS[self.vad][0],
+            TURN_DETECTORS[self.turn_detector][0],
+            *self.extra_plugins,
+        ]
+        return list(dict.fromkeys(names))
+
+    def load(self) -> Pipeline:
+        """Import this pipeline's plugins; call at module import (main thread)"""
+        for name in self.plugins():
+            plugin(name)
+        if self.stt == "local":
+            # workers the supervisor spawns have an id; it runs the server for them
+            plugin("local_stt").require_server(supervised="AGENT_WORKER_ID" in os.environ)
+        if "local" in (self.tts, self.tts_fallback):
+            plugin("local_tts").require_server(supervised="AGENT_WORKER_ID" in os.environ)
+        return self
+
+    @property
+    def tts_label(self) -> str:
+        """Provider and options, e.g. openai-gpt-4o-mini-tts-alloy"""
+        return "-".join([self.tts, *(str(v) for v in self.tts_options.values())])
+
+    def make_stt(self, **extra):
+        name, factory = STT_PROVIDERS[self.stt]
+        return factory(plugin(name), **self.stt_options, **extra)
+
+    def make_tts(self):
+        name, factory = TTS_PROVIDERS[self.tts]
+        if not self.tts_fallback:
+            return factory(plugin(name), **self.tts_options)
+        from livekit.agents import tts
+
+        fallback_name, fallback_factory = TTS_PROVIDERS[self.tts_fallback]
+        fallback = fallback_factory(plugin(fallback_name), **self.tts_fallback_options)
+        options = dict(self.tts_options)
+        if self.tts == "local":
+            # languages without a Piper voice go straight to the fallback
+            options["other"] = fallback
+        return tts.FallbackAdapter([factory(plugin(name), **options), fallback])
+
+    def make_vad(self):
+        name, factory = VAD_PROVIDERS[self.vad]
+        return factory(plugin(name))
+
+    def make_turn_detector(self):
+        name, factory = TURN_DETECTORS[self.turn_detector]
+        return factory(plugin(name))
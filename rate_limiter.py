@@ -0,0 +1,490 @@
+from __future__ import annotations
+
+import asyncio
+import fcntl
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from livekit.agents import APIConnectOptions, APIStatusError, llm, tts
+
+
+logger = logging.getLogger("rate-limiter")
+
+SHM_PATH = os.getenv("RATE_LIMIT_SHM", os.path.join("runtime", "rate_limits.shm"))
+LIMITS_FILE = os.getenv("RATE_LIMITS_FILE", os.path.join("data", "rate_limits.json"))
+# a request that would wait longer than this is rejected so the caller can reroute
+MAX_QUEUE_SECONDS = float(os.getenv("RATE_LIMIT_MAX_QUEUE", "0.5"))
+# bucket depth, in seconds of the sustained rate
+BURST_SECONDS = 2.0
+
+# Per provider:model limits for the whole host, in requests and tokens per
+# minute. Keep them a little under the account's real limits; override with
+# data/rate_limits.json. Models without an entry are not limited.
+DEFAULT_LIMITS = {
+    "groq:llama-3.3-70b-versatile": {"rpm": 900, "tpm": 270_000},
+    "groq:llama-3.1-8b-instant": {"rpm": 900, "tpm": 230_000},
+    "groq:llama3-8b-8192": {"rpm": 900, "tpm": 27_000},
+    "openai:gpt-4o-mini": {"rpm": 4500, "tpm": 1_800_000},
+    # TTS budgets count characters in the token bucket
+    "openai:gpt-4o-mini-tts": {"rpm": 450, "tpm": 900_000},
+}
+
+_MAGIC = b"RLv2"
+# magic, slots, boot id: the file outlives a reboot, the buckets should not
+_HEADER = struct.Struct("<4sI36s")
+# name, rate (units/s), capacity, level, updated, admitted, queued, rejected, wait_total
+_SLOT = struct.Struct("<48sdddd3Qd")
+_SLOTS = 64
+_SIZE = _HEADER.size + _SLOT.size * _SLOTS
+
+
+def _boot_id() -> bytes:
+    try:
+        with open("/proc/sys/kernel/random/boot_id", "rb") as f:
+            return f.read().strip()[:36]
+    except OSError:
+        return b""
+
+
+class RateLimited(APIStatusError):
+    """The host-wide budget is exhausted for longer than the caller is willing to queue"""
+
+    def __init__(self, key: str, wait: float):
+        super().__init__(f"{key} rate limited locally, would queue {wait:.1f}s", status_code=429, retryable=False)
+        self.key = key
+        self.wait = wait
+
+
+@dataclass
+class BucketStats:
+    name: str
+    rate: float
+    capacity: float
+    level: float
+    admitted: int
+    queued: int
+    rejected: int
+    wait_total: float
+
+    @property
+    def utilization(self) -> float:
+        """Share of the bucket in use; above 1.0 means requests are queued"""
+        return (self.capacity - self.level) / self.capacity if self.capacity else 0.0
+
+    @property
+    def backlog_seconds(self) -> float:
+        return max(0.0, -self.level) / self.rate if self.rate else 0.0
+
+
+def load_limits(path: str = LIMITS_FILE) -> dict[str, dict]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return {**DEFAULT_LIMITS, **json.load(f)}
+    except (OSError, ValueError):
+        return dict(DEFAULT_LIMITS)
+
+
+class HostRateLimiter:
+    """
+    Token buckets shared by every job process on the host through a small
+    memory-mapped file; each update holds an flock for a few microseconds.
+    Admission takes the budget up front and lets the bucket go negative, so
+    waiters are served in arrival order across processes without polling.
+    A request whose wait would exceed `max_queue` is rejected instead.
+    """
+
+    def __init__(self, path: str = SHM_PATH, limits: Optional[dict[str, dict]] = None, max_queue: float = MAX_QUEUE_SECONDS):
+        self.path = path
+        self.limits = limits if limits is not None else load_limits()
+        self.max_queue = max_queue
+        self._map: Optional[mmap.mmap] = None
+        self._fd: Optional[int] = None
+        self._slots: dict[str, int] = {}
+
+    def _open(self):
+        if self._map is not None:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_size < _SIZE:
+                os.ftruncate(fd, _SIZE)
+            self._map = mmap.mmap(fd, _SIZE)
+            boot_id = _boot_id()
+            magic, _, stored_boot_id = _HEADER.unpack_from(self._map, 0)
+            if magic != _MAGIC or stored_boot_id.rstrip(b"\0") != boot_id:
+                self._map[:] = bytes(_SIZE)
+                _HEADER.pack_into(self._map, 0, _MAGIC, _SLOTS, boot_id)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        self._fd = fd
+
+    def _slot(self, name: str, rate: float, capacity: float) -> int:
+        """Offset of the bucket called `name`, creating it (full) on first use; caller holds the lock"""
+        offset = self._slots.get(name)
+        if offset is not None:
+            return offset
+        encoded = name.encode()[:48]
+        for i in range(_SLOTS):
+            offset = _HEADER.size + i * _SLOT.size
+            slot_name = _SLOT.unpack_from(self._map, offset)[0].rstrip(b"\0")
+            if slot_name == encoded:
+                break
+            if not slot_name:
+                _SLOT.pack_into(self._map, offset, encoded, rate, capacity, capacity, time.time(), 0, 0, 0, 0.0)
+                break
+        else:
+            raise RuntimeError("rate limiter has no free bucket slots")
+        self._slots[name] = offset
+        return offset
+
+    def _buckets(self, key: str, tokens: float) -> list[tuple[str, float, float, float]]:
+        """(name, rate, capacity, amount) for every bucket a request to `key` draws from"""
+        limit = self.limits.get(key)
+        if not limit:
+            return []
+        buckets = []
+        for unit, amount in (("rpm", 1.0), ("tpm", tokens)):
+            if limit.get(unit) and amount > 0:
+                rate = limit[unit] / 60.0
+                buckets.append((f"{key}:{unit}", rate, max(amount, rate * BURST_SECONDS), amount))
+        return buckets
+
+    def _take(self, key: str, tokens: float, max_wait: float) -> float:
+        """Reserve budget and return how long to wait for it; raises RateLimited"""
+        buckets = self._buckets(key, tokens)
+        if not buckets:
+            return 0.0
+        self._open()
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            # wall clock, as the file is shared across processes and restarts
+            now = time.time()
+            states = []
+            wait = 0.0
+            for name, rate, capacity, amount in buckets:
+                offset = self._slot(name, rate, capacity)
+                _, _, _, level, updated, admitted, queued, rejected, wait_total = _SLOT.unpack_from(self._map, offset)
+                # limits may have been edited since the bucket was created
+                level = min(capacity, level + max(0.0, now - updated) * rate)
+                states.append((offset, name, rate, capacity, amount, level, admitted, queued, rejected, wait_total))
+                if level < amount:
+                    wait = max(wait, (amount - level) / rate)
+            rejected_now = wait > max_wait
+            for offset, name, rate, capacity, amount, level, admitted, queued, rejected, wait_total in states:
+                if rejected_now:
+                    rejected += 1
+                else:
+                    level -= amount
+                    admitted += 1
+                    queued += wait > 0
+                    wait_total += wait
+                _SLOT.pack_into(
+                    self._map, offset, name.encode()[:48], rate, capacity, level, now, admitted, queued, rejected, wait_total
+                )
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        if rejected_now:
+            raise RateLimited(key, wait)
+        return wait
+
+    def refund(self, key: str, tokens: float):
+        """Return budget that was reserved but not used (cancelled or over-estimated)"""
+        self.adjust(key, -tokens, requests=-1)
+
+    def adjust(self, key: str, tokens: float, *, requests: int = 0):
+        """Charge (or, if negative, credit) budget after the fact, e.g. once real usage is known"""
+        self._open()
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            for name, rate, capacity, _ in self._buckets(key, 1.0):
+                amount = requests if name.endswith(":rpm") else tokens
+                if not amount:
+                    continue
+                offset = self._slot(name, rate, capacity)
+                fields = list(_SLOT.unpack_from(self._map, offset))
+                fields[3] = min(fields[2], fields[3] - amount)
+                _SLOT.pack_into(self._map, offset, *fields)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    async def acquire(self, key: str, tokens: float = 0.0, max_wait: Optional[float] = None) -> float:
+        """Wait for budget for one request of `tokens`; returns the time spent queued"""
+        wait = self._take(key, tokens, self.max_queue if max_wait is None else max_wait)
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                self.refund(key, tokens)
+                raise
+        return wait
+
+    def stats(self) -> list[BucketStats]:
+        if not os.path.exists(self.path):
+            return []
+        self._open()
+        now = time.time()
+        out = []
+        for i in range(_SLOTS):
+            name, rate, capacity, level, updated, admitted, queued, rejected, wait_total = _SLOT.unpack_from(
+                self._map, _HEADER.size + i * _SLOT.size
+            )
+            if not name.rstrip(b"\0"):
+                break
+            level = min(capacity, level + max(0.0, now - updated) * rate)
+            out.append(BucketStats(name.rstrip(b"\0").decode(), rate, capacity, level, admitted, queued, rejected, wait_total))
+        return out
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            os.close(self._fd)
+            self._map = None
+            self._fd = None
+
+
+_limiter: Optional[HostRateLimiter] = None
+
+
+def host_limiter() -> HostRateLimiter:
+    """The process-wide limiter instance"""
+    global _limiter
+    if _limiter is None:
+        _limiter = HostRateLimiter()
+    return _limiter
+
+
+def read_stats() -> list[dict]:
+    """Bucket utilization for the dashboard"""
+    return [
+        {
+            "bucket": s.name,
+            "utilization": s.utilization,
+            "backlog_seconds": s.backlog_seconds,
+            "admitted": s.admitted,
+            "queued": s.queued,
+            "rejected": s.rejected,
+            "avg_wait_ms": s.wait_total / s.queued * 1000 if s.queued else 0.0,
+        }
+        for s in host_limiter().stats()
+    ]
+
+
+# completion tokens reserved per request until real usage is known
+_EXPECTED_COMPLETION = 150
+
+
+class RateLimitedLLM(llm.LLM):
+    """
+    Admits each request through the host-wide limiter before it reaches
+    `inner`. A rejection surfaces as a non-retryable 429, so HedgedLLM fails
+    over to its secondary model instead of hammering the limited one.
+    """
+
+    def __init__(self, inner: llm.LLM, key: str, limiter: Optional[HostRateLimiter] = None):
+        super().__init__()
+        self.inner = inner
+        self.key = key
+        self.limiter = limiter or host_limiter()
+
+    def chat(
+        self,
+        *,
+        chat_ctx: llm.ChatContext,
+        conn_options: APIConnectOptions = APIConnectOptions(),
+        fnc_ctx: Optional[llm.FunctionContext] = None,
+        **kwargs,
+    ) -> "RateLimitedLLMStream":
+        return RateLimitedLLMStream(self, chat_ctx=chat_ctx, fnc_ctx=fnc_ctx, conn_options=conn_options, chat_kwargs=kwargs)
+
+
+class RateLimitedLLMStream(llm.LLMStream):
+    def __init__(
+        self,
+        limited: RateLimitedLLM,
+        *,
+        chat_ctx: llm.ChatContext,
+        fnc_ctx: Optional[llm.FunctionContext],
+        conn_options: APIConnectOptions,
+        chat_kwargs: dict,
+    ):
+        super().__init__(limited, chat_ctx=chat_ctx, fnc_ctx=fnc_ctx, conn_options=APIConnectOptions(max_retry=0, timeout=conn_options.timeout))
+        self._limited = limited
+        self._inner_conn_options = conn_options
+        self._chat_kwargs = {k: v for k, v in chat_kwargs.items() if v is not None}
+
+    async def _run(self) -> None:
+        from context_budget import message_tokens
+
+        limited = self._limited
+        estimate = sum(message_tokens(m) for m in self._chat_ctx.messages) + _EXPECTED_COMPLETION
+        await limited.limiter.acquire(limited.key, estimate)
+
+        used = None
+        stream = limited.inner.chat(
+            chat_ctx=self._chat_ctx, fnc_ctx=self._fnc_ctx, conn_options=self._inner_conn_options, **self._chat_kwargs
+        )
+        try:
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    used = chunk.usage.total_tokens
+                for choice in chunk.choices:
+                    if choice.delta.tool_calls:
+                        self._function_calls_info.extend(choice.delta.tool_calls)
+                self._event_ch.send_nowait(chunk)
+        finally:
+            await stream.aclose()
+            if used is not None:
+                limited.limiter.adjust(limited.key, used - estimate)
+
+
+def limited(inner: llm.LLM, provider: str, model: str) -> llm.LLM:
+    """Wrap `inner` when there is a host-wide limit configured for provider:model"""
+    limiter = host_limiter()
+    key = f"{provider}:{model}"
+    if key not in limiter.limits or os.getenv("RATE_LIMITING", "on") == "off":
+        return inner
+    return RateLimitedLLM(inner, key, limiter)
+
+
+class _RateLimitedChunkedStream(tts.ChunkedStream):
+    def __init__(self, *, tts: "RateLimitedTTS", input_text: str, conn_options: Optional[APIConnectOptions]):
+        super().__init__(tts=tts, input_text=input_text, conn_options=conn_options)
+        self._limited = tts
+
+    async def _run(self) -> None:
+        limited = self._limited
+        await limited.limiter.acquire(limited.key, len(self._input_text))
+        async for audio in limited.inner.synthesize(self._input_text):
+            self._event_ch.send_nowait(audio)
+
+
+class RateLimitedTTS(tts.TTS):
+    """Non-streaming TTS admitted through the host-wide limiter; characters count as tokens"""
+
+    def __init__(self, inner: tts.TTS, key: str, limiter: Optional[HostRateLimiter] = None):
+        super().__init__(
+            capabilities=tts.TTSCapabilities(streaming=False),
+            sample_rate=inner.sample_rate,
+            num_channels=inner.num_channels,
+        )
+        self.inner = inner
+        self.key = key
+        self.limiter = limiter or host_limiter()
+
+    def synthesize(self, text: str, *, conn_options: Optional[APIConnectOptions] = None) -> tts.ChunkedStream:
+        return _RateLimitedChunkedStream(tts=self, input_text=text, conn_options=conn_options)
+
+    async def aclose(self):
+        await self.inner.aclose()
+
+
+def limited_tts(inner: tts.TTS, provider: str, model: str) -> tts.TTS:
+    limiter = host_limiter()
+    key = f"{provider}:{model}"
+    if key not in limiter.limits or os.getenv("RATE_LIMITING", "on") == "off":
+        return inner
+    return RateLimitedTTS(inner, key, limiter)
+
+
+def _simulate_calls(args: tuple) -> list[tuple[float, str]]:
+    """One worker process running its share of simulated calls; returns (latency, outcome) per turn"""
+    worker, calls, use_limiter, shm_path, seed = args
+    import random
+
+    from livekit.plugins import openai
+
+    random.seed(seed)
+
+    async def run() -> list[tuple[float, str]]:
+        # max_retry=0: the baseline does its own jittered retries like the job processes do today
+        primary = openai.LLM(model="mock-limited", base_url="http://127.0.0.1:18941/v1", api_key="mock")
+        fallback = openai.LLM(model="mock-fallback", base_url="http://127.0.0.1:18942/v1", api_key="mock")
+        limiter = HostRateLimiter(shm_path, limits={"mock:limited": {"rpm": _BENCH_RPS * 0.9 * 60}})
+        model = RateLimitedLLM(primary, "mock:limited", limiter) if use_limiter else primary
+        no_retry = APIConnectOptions(max_retry=0)
+        results: list[tuple[float, str]] = []
+
+        async def turn() -> tuple[float, str]:
+            started = time.perf_counter()
+            ctx = llm.ChatContext().append(role="user", text="hello")
+            for attempt in range(5):
+                try:
+                    async for _ in model.chat(chat_ctx=ctx, conn_options=no_retry):
+                        return time.perf_counter() - started, "ok" if attempt == 0 else "retried"
+                except RateLimited:
+                    async for _ in fallback.chat(chat_ctx=ctx, conn_options=no_retry):
+                        return time.perf_counter() - started, "rerouted"
+                except Exception:
+                    await asyncio.sleep(random.uniform(0.5, 2.0) * (attempt + 1))
+            return time.perf_counter() - started, "failed"
+
+        async def call():
+            await asyncio.sleep(random.uniform(0, 5))
+            for _ in range(6):
+                results.append(await turn())
+                await asyncio.sleep(random.uniform(2, 4))
+
+        await asyncio.gather(*(call() for _ in range(calls)))
+        return results
+
+    return asyncio.run(run())
+
+
+_BENCH_RPS = 12.0
+
+
+def _bench(calls: int, processes: int):
+    import subprocess
+    import sys
+    import tempfile
+    from concurrent.futures import ProcessPoolExecutor
+
+    servers = [
+        subprocess.Popen([sys.executable, "mock_llm_server.py", "--port", "18941", "--rate-limit", str(_BENCH_RPS)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL),
+        subprocess.Popen([sys.executable, "mock_llm_server.py", "--port", "18942", "--ttft", "0.3"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL),
+    ]
+    time.sleep(2)
+    try:
+        for use_limiter in (False, True):
+            shm = os.path.join(tempfile.mkdtemp(), "bench.shm")
+            shares = [calls // processes + (i < calls % processes) for i in range(processes)]
+            with ProcessPoolExecutor(processes) as pool:
+                per_worker = pool.map(_simulate_calls, [(i, n, use_limiter, shm, i * 7 + use_limiter) for i, n in enumerate(shares)])
+                results = [r for worker in per_worker for r in worker]
+            latencies = sorted(r[0] for r in results)
+            outcomes = {o: sum(1 for r in results if r[1] == o) for o in ("ok", "retried", "rerouted", "failed")}
+
+            def pct(p: float) -> str:
+                return f"{latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000:.0f}ms"
+
+            name = "host limiter" if use_limiter else "no limiter"
+            print(f"{name:>12}: {len(results)} turns  p50 {pct(0.5)}  p95 {pct(0.95)}  p99 {pct(0.99)}  {outcomes}")
+            if use_limiter:
+                print(f"{'':>12}  {HostRateLimiter(shm).stats()}")
+    finally:
+        for server in servers:
+            server.terminate()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Show host-wide rate limiter utilization, or benchmark it")
+    parser.add_argument("--bench", action="store_true", help="simulate calls against a mock provider that enforces limits")
+    parser.add_argument("--calls", type=int, default=50)
+    parser.add_argument("--processes", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.bench:
+        logging.basicConfig(level=logging.CRITICAL)
+        _bench(args.calls, args.processes)
+    else:
+        print(json.dumps(read_stats(), indent=2))
@@ -0,0 +1,374 @@
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+from livekit import api
+
+from runtime_reports import RUNTIME_DIR
+
+
+logger = logging.getLogger("recording")
+
+STATS_FILE = os.path.join(RUNTIME_DIR, "recording_uploader.json")
+# sidecar written next to each segment while it is being uploaded, used to resume after a crash
+STATE_SUFFIX = ".upload"
+_SKIP_SUFFIXES = (STATE_SUFFIX, ".tmp")
+
+
+@dataclass
+class RecordingConfig:
+    # "local": egress writes segments to spool_dir and SegmentUploader ships them
+    # "s3": egress uploads directly to the bucket
+    mode: str = "local"
+    spool_dir: str = "recordings"
+    segment_duration: int = 5
+    bucket: str = "sip-bot"
+    region: str = "ap-south-1"
+    endpoint: Optional[str] = None
+    access_key: Optional[str] = None
+    secret_key: Optional[str] = None
+    upload_concurrency: int = 4
+    part_size: int = 8 * 1024 * 1024
+    settle_seconds: float = 10.0
+    keep_local: bool = False
+
+    @classmethod
+    def from_env(cls) -> "RecordingConfig":
+        return cls(
+            mode=os.getenv("RECORDING_MODE", "local"),
+            spool_dir=os.getenv("RECORDING_SPOOL_DIR", "recordings"),
+            segment_duration=int(os.getenv("RECORDING_SEGMENT_DURATION", "5")),
+            bucket=os.getenv("RECORDING_S3_BUCKET", "sip-bot"),
+            region=os.getenv("RECORDING_S3_REGION", "ap-south-1"),
+            # e.g. http://localhost:9000 for a local MinIO stand-in
+            endpoint=os.getenv("RECORDING_S3_ENDPOINT") or None,
+            access_key=os.getenv("RECORDING_S3_ACCESS_KEY") or os.getenv("AWS_ACCESS_KEY_ID"),
+            secret_key=os.getenv("RECORDING_S3_SECRET_KEY") or os.getenv("AWS_SECRET_ACCESS_KEY"),
+            upload_concurrency=int(os.getenv("RECORDING_UPLOAD_CONCURRENCY", "4")),
+            # S3 rejects multipart parts smaller than 5 MiB
+            part_size=max(5, int(os.getenv("RECORDING_PART_SIZE_MB", "8"))) * 1024 * 1024,
+            settle_seconds=float(os.getenv("RECORDING_SETTLE_SECONDS", "10")),
+            keep_local=os.getenv("RECORDING_KEEP_LOCAL", "0") == "1",
+        )
+
+
+def egress_request(room_name: str, config: Optional[RecordingConfig] = None) -> api.RoomCompositeEgressRequest:
+    """Audio-only room composite egress writing segments according to `config`"""
+    config = config or RecordingConfig.from_env()
+    if config.mode == "s3":
+        output = api.SegmentedFileOutput(
+            filename_prefix=f"{room_name}/output",
+            playlist_name=f"{room_name}/playlist.m3u8",
+            live_playlist_name=f"{room_name}/live-playlist.m3u8",
+            segment_duration=config.segment_duration,
+            s3=api.S3Upload(
+                access_key=config.access_key or "",
+                secret=config.secret_key or "",
+                region=config.region,
+                endpoint=config.endpoint or "",
+                bucket=config.bucket,
+                force_path_style=bool(config.endpoint),
+            ),
+        )
+    else:
+        # without an upload target the egress service writes to its local disk;
+        # spool_dir must be a volume shared between egress and the uploader
+        output = api.SegmentedFileOutput(
+            filename_prefix=os.path.join(config.spool_dir, room_name, "output"),
+            playlist_name=os.path.join(config.spool_dir, room_name, "playlist.m3u8"),
+            live_playlist_name=os.path.join(config.spool_dir, room_name, "live-playlist.m3u8"),
+            segment_duration=config.segment_duration,
+        )
+    return api.RoomCompositeEgressRequest(
+        room_name=room_name,
+        layout="speaker",
+        audio_only=True,
+        segment_outputs=[output],
+    )
+
+
+class SegmentUploader:
+    """
+    Ship recording segments from the local spool directory to S3 with a
+    bounded pool of concurrent multipart uploads. Upload ids and finished
+    parts are journaled next to each segment so a restart resumes instead
+    of starting over.
+    """
+
+    def __init__(self, config: Optional[RecordingConfig] = None, client=None):
+        self.config = config or RecordingConfig.from_env()
+        self._client = client
+        self._pool = ThreadPoolExecutor(max_workers=self.config.upload_concurrency, thread_name_prefix="segment-upload")
+        self._in_flight: set[str] = set()
+        self._retry_at: dict[str, float] = {}
+        # consecutive failures per segment; once `max_attempts` is reached it is given up on
+        self._failures: dict[str, int] = {}
+        self.max_attempts: Optional[int] = None
+        self.abandoned: set[str] = set()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        # (finished_at, bytes) of recent uploads, for throughput
+        self._recent: deque[tuple[float, int]] = deque(maxlen=512)
+        self.uploaded_files = 0
+        self.uploaded_bytes = 0
+        self.failed_uploads = 0
+        self.backlog_files = 0
+        self.backlog_bytes = 0
+
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3
+
+            self._client = boto3.client(
+                "s3",
+                region_name=self.config.region,
+                endpoint_url=self.config.endpoint,
+                aws_access_key_id=self.config.access_key,
+                aws_secret_access_key=self.config.secret_key,
+            )
+        return self._client
+
+    def _key(self, path: str) -> str:
+        return os.path.relpath(path, self.config.spool_dir).replace(os.sep, "/")
+
+    def _load_state(self, path: str) -> dict:
+        try:
+            with open(path + STATE_SUFFIX, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self, path: str, state: dict):
+        tmp = path + STATE_SUFFIX + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp, path + STATE_SUFFIX)
+
+    def _pending(self) -> list[tuple[str, int]]:
+        """Settled files that still need uploading, oldest first"""
+        now = time.time()
+        pending = []
+        for dirpath, _, filenames in os.walk(self.config.spool_dir):
+            for name in filenames:
+                if name.endswith(_SKIP_SUFFIXES):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                state = self._load_state(path)
+                if state.get("done") and state.get("mtime") == st.st_mtime:
+                    continue
+                if now - st.st_mtime < self.config.settle_seconds:
+                    # egress may still be writing this segment or rewriting the playlist
+                    continue
+                pending.append((path, st.st_mtime, st.st_size))
+        pending.sort(key=lambda p: p[1])
+        return [(path, size) for path, _, size in pending]
+
+    def upload_file(self, path: str):
+        size = os.path.getsize(path)
+        mtime = os.path.getmtime(path)
+        key = self._key(path)
+        if size <= self.config.part_size:
+            with open(path, "rb") as f:
+                self.client.put_object(Bucket=self.config.bucket, Key=key, Body=f)
+        else:
+            self._multipart_upload(path, key, size, mtime)
+        self._finish(path, size, mtime)
+
+    def _multipart_upload(self, path: str, key: str, size: int, mtime: float):
+        state = self._load_state(path)
+        parts = []
+        if state.get("upload_id") and state.get("mtime") == mtime:
+            upload_id = state["upload_id"]
+            try:
+                # trust the server's view of what made it, not only our journal
+                listed = self.client.list_parts(Bucket=self.config.bucket, Key=key, UploadId=upload_id)
+                parts = [{"PartNumber": p["PartNumber"], "ETag": p["ETag"]} for p in listed.get("Parts", [])]
+                logger.info(f"resuming upload of {key} after {len(parts)} parts")
+            except Exception:
+                upload_id = None
+        else:
+            upload_id = None
+        if upload_id is None:
+            upload_id = self.client.create_multipart_upload(Bucket=self.config.bucket, Key=key)["UploadId"]
+            self._save_state(path, {"upload_id": upload_id, "mtime": mtime})
+
+        done = {p["PartNumber"] for p in parts}
+        with open(path, "rb") as f:
+            part_number = 1
+            while True:
+                chunk_start = (part_number - 1) * self.config.part_size
+                if chunk_start >= size:
+                    break
+                if part_number not in done:
+                    f.seek(chunk_start)
+                    res = self.client.upload_part(
+                        Bucket=self.config.bucket,
+                        Key=key,
+                        UploadId=upload_id,
+                        PartNumber=part_number,
+                        Body=f.read(self.config.part_size),
+                    )
+                    parts.append({"PartNumber": part_number, "ETag": res["ETag"]})
+                if self._stopping.is_set():
+                    # leave the upload open; the journal lets the next run pick it up
+                    raise InterruptedError(f"upload of {key} interrupted")
+                part_number += 1
+
+        parts.sort(key=lambda p: p["PartNumber"])
+        self.client.complete_multipart_upload(
+            Bucket=self.config.bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts}
+        )
+
+    def _finish(self, path: str, size: int, mtime: float):
+        with self._lock:
+            self.uploaded_files += 1
+            self.uploaded_bytes += size
+            self._recent.append((time.time(), size))
+        is_playlist = path.endswith(".m3u8")
+        if self.config.keep_local or is_playlist:
+            # playlists are kept so later rewrites by egress get re-uploaded
+            self._save_state(path, {"done": True, "mtime": mtime})
+        else:
+            os.remove(path)
+            try:
+                os.remove(path + STATE_SUFFIX)
+            except FileNotFoundError:
+                pass
+
+    def _run_upload(self, path: str):
+        try:
+            self.upload_file(path)
+            with self._lock:
+                self._failures.pop(path, None)
+        except InterruptedError:
+            pass
+        except Exception as e:
+            with self._lock:
+                self.failed_uploads += 1
+                self._failures[path] = self._failures.get(path, 0) + 1
+                if self.max_attempts is not None and self._failures[path] >= self.max_attempts:
+                    self.abandoned.add(path)
+                else:
+                    self._retry_at[path] = time.time() + 30.0
+            if path in self.abandoned:
+                logger.error(f"failed to upload {path} {self._failures[path]} times, giving up: {e}")
+            else:
+                logger.warning(f"failed to upload {path}, will retry: {e}")
+        finally:
+            with self._lock:
+                self._in_flight.discard(path)
+
+    def throughput(self, window: float = 60.0) -> float:
+        """Uploaded bytes per second over the last `window` seconds"""
+        cutoff = time.time() - window
+        with self._lock:
+            return sum(size for ts, size in self._recent if ts >= cutoff) / window
+
+    def stats(self) -> dict:
+        return {
+            "updated_at": time.time(),
+            "uploaded_files": self.uploaded_files,
+            "uploaded_bytes": self.uploaded_bytes,
+            "failed_uploads": self.failed_uploads,
+            "in_flight": len(self._in_flight),
+            "backlog_files": self.backlog_files,
+            "backlog_bytes": self.backlog_bytes,
+            "throughput_bytes_per_sec": self.throughput(),
+        }
+
+    def poll(self):
+        """Queue every settled segment that isn't already uploading"""
+        pending = self._pending()
+        self.backlog_files = len(pending)
+        self.backlog_bytes = sum(size for _, size in pending)
+        for path, _ in pending:
+            with self._lock:
+                if path in self._in_flight or path in self.abandoned or len(self._in_flight) >= self.config.upload_concurrency:
+                    continue
+                if self._retry_at.get(path, 0.0) > time.time():
+                    continue
+                self._retry_at.pop(path, None)
+                self._in_flight.add(path)
+            self._pool.submit(self._run_upload, path)
+
+    def write_stats(self):
+        os.makedirs(os.path.dirname(STATS_FILE), exist_ok=True)
+        tmp = STATS_FILE + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.stats(), f)
+        os.replace(tmp, STATS_FILE)
+
+    def run(self, interval: float = 1.0):
+        os.makedirs(self.config.spool_dir, exist_ok=True)
+        logger.info(
+            f"uploading segments from {self.config.spool_dir} to {self.config.endpoint or 's3'}/{self.config.bucket} "
+            f"with {self.config.upload_concurrency} concurrent uploads"
+        )
+        while not self._stopping.is_set():
+            try:
+                self.poll()
+                self.write_stats()
+            except Exception as e:
+                logger.warning(f"segment upload poll failed: {e}")
+            self._stopping.wait(interval)
+        self._pool.shutdown(wait=True)
+        self.write_stats()
+
+    def stop(self):
+        self._stopping.set()
+
+
+def start_background_uploader(config: Optional[RecordingConfig] = None) -> SegmentUploader:
+    uploader = SegmentUploader(config)
+    threading.Thread(target=uploader.run, name="segment-uploader", daemon=True).start()
+    return uploader
+
+
+def read_stats() -> Optional[dict]:
+    try:
+        with open(STATS_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Upload locally spooled recording segments to S3")
+    parser.add_argument("--once", action="store_true", help="upload what is pending and exit")
+    parser.add_argument("--attempts", type=int, default=3, help="with --once, give up on a segment after this many failures")
+    args = parser.parse_args()
+
+    uploader = SegmentUploader()
+    if args.once:
+        uploader.config.settle_seconds = 0
+        uploader.max_attempts = args.attempts
+        uploader.poll()
+        # abandoned segments stay in the spool and in the backlog
+        while uploader.backlog_files > len(uploader.abandoned) or uploader._in_flight:
+            time.sleep(0.5)
+            uploader.poll()
+        uploader.write_stats()
+        print(json.dumps(uploader.stats(), indent=2))
+        if uploader.abandoned:
+            sys.exit("failed to upload:\n" + "\n".join(sorted(uploader.abandoned)))
+    else:
+        try:
+            uploader.run()
+        except KeyboardInterrupt:
+            uploader.stop()
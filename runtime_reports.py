@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import json
+import os
+from collections import deque
+
+
+RUNTIME_DIR = os.getenv("AGENT_RUNTIME_DIR", "runtime")
+# a report file past this size is moved to `<file>.1`, so each worker keeps at most two
+MAX_REPORT_BYTES = 5 * 1024 * 1024
+
+
+class ReportLog:
+    """
+    Per-worker jsonl files in one directory, one line per job. Workers run
+    for days, so files rotate and reads keep only the last lines asked for.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = MAX_REPORT_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def path(self, worker_id) -> str:
+        return os.path.join(self.directory, f"{worker_id}.jsonl")
+
+    def write(self, worker_id, report: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(worker_id)
+        try:
+            if os.path.getsize(path) > self.max_bytes:
+                os.replace(path, path + ".1")
+        except OSError:
+            pass
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(report) + "\n")
+
+    def read(self, worker_id, n: int = 100) -> list[dict]:
+        try:
+            with open(self.path(worker_id), "r", encoding="utf-8") as f:
+                lines = deque(f, maxlen=n)
+        except OSError:
+            return []
+        return [json.loads(line) for line in lines if line.strip()]
+
+
+def quantile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+from dataclasses import dataclass
+
+
+ENTRYPOINTS = ("agent2", "agent", "outbound", "marketing")
+# cumulative import time allowed per entrypoint, the best of RUNS cold imports
+IMPORT_BUDGET_MS = float(os.getenv("STARTUP_IMPORT_BUDGET_MS", "3500"))
+# RSS allowed after importing an entrypoint, before any model is loaded
+RSS_BUDGET_MB = float(os.getenv("STARTUP_RSS_BUDGET_MB", "250"))
+RUNS = 3
+# loaded on demand (providers.Pipeline), or only in the worker/supervisor, never at job startup
+NOT_AT_STARTUP = (
+    "livekit.plugins.google",
+    "livekit.plugins.deepgram",
+    "langdetect",
+    "faster_whisper",
+    "piper",
+    "supervisor",
+    "pool_sizer",
+    "local_stt",
+    "local_tts",
+)
+
+_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+# module-level clients need keys to be constructed, but nothing is sent at import
+_PLACEHOLDER_ENV = {"GROQ_API_KEY": "profile", "OPENAI_API_KEY": "profile", "CARTESIA_API_KEY": "profile"}
+
+
+@dataclass
+class ImportProfile:
+    module: str
+    total_ms: float
+    rss_mb: float
+    modules: list[tuple[str, int, float, float]]  # name, depth, self ms, cumulative ms
+    loaded: set[str]
+
+    def packages(self) -> dict[str, float]:
+        """Self import time summed per package (livekit.plugins.x, livekit.agents, openai, ...)"""
+        totals: dict[str, float] = defaultdict(float)
+        for name, _, self_ms, _ in self.modules:
+            parts = name.split(".")
+            totals[".".join(parts[:3] if parts[0] == "livekit" and len(parts) > 2 and parts[1] == "plugins" else parts[:2] if parts[0] == "livekit" else parts[:1])] += self_ms
+        return dict(sorted(totals.items(), key=lambda kv: -kv[1]))
+
+    def slowest(self, n: int = 20) -> list[tuple[str, float]]:
+        return sorted(((name, cum) for name, _, _, cum in self.modules), key=lambda kv: -kv[1])[:n]
+
+
+def profile(module: str) -> ImportProfile:
+    """Import `module` in a fresh interpreter with -X importtime"""
+    code = (
+        f"import {module}, sys, psutil\n"
+        "print(psutil.Process().memory_info().rss)\n"
+        "print('\\n'.join(sys.modules))\n"
+    )
+    env = {**_PLACEHOLDER_ENV, **os.environ}
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, env=env, timeout=300)
+    if result.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{result.stderr[-2000:]}")
+    modules = []
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            self_us, cum_us, indent, name = match.groups()
+            modules.append((name, len(indent) // 2, int(self_us) / 1000, int(cum_us) / 1000))
+    total = next(cum for name, _, _, cum in modules if name == module)
+    rss, *loaded = result.stdout.splitlines()
+    return ImportProfile(module, total, int(rss) / 1024 / 1024, modules, set(loaded))
+
+
+def best_of(module: str, runs: int = RUNS) -> ImportProfile:
+    """Fastest of a few cold imports; import time on a shared host is noisy upward only"""
+    return min((profile(module) for _ in range(runs)), key=lambda p: p.total_ms)
+
+
+def check(profile: ImportProfile) -> list[str]:
+    problems = []
+    if profile.total_ms > IMPORT_BUDGET_MS:
+        problems.append(f"imports take {profile.total_ms:.0f}ms, budget {IMPORT_BUDGET_MS:.0f}ms")
+    if profile.rss_mb > RSS_BUDGET_MB:
+        problems.append(f"RSS after import is {profile.rss_mb:.0f}MB, budget {RSS_BUDGET_MB:.0f}MB")
+    for name in NOT_AT_STARTUP:
+        if name in profile.loaded:
+            problems.append(f"{name} is imported at startup")
+    return problems
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Per-module import time of the worker entrypoints")
+    parser.add_argument("modules", nargs="*", default=list(ENTRYPOINTS))
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--check", action="store_true", help="exit non-zero when an entrypoint is over budget")
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        result = best_of(module)
+        print(f"\n{module}: {result.total_ms:.0f}ms, RSS {result.rss_mb:.0f}MB after import")
+        if not args.check:
+            print("  by package (self time):")
+            for package, ms in list(result.packages().items())[: args.top]:
+                print(f"    {ms:8.0f}ms  {package}")
+            print("  slowest modules (cumulative):")
+            for name, ms in result.slowest(args.top):
+                print(f"    {ms:8.0f}ms  {name}")
+        for problem in check(result):
+            failed = True
+            print(f"  OVER BUDGET: {problem}")
+    sys.exit(1 if failed else 0)
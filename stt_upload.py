@@ -0,0 +1,308 @@
+from __future__ import annotations
+
+import asyncio
+import io
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import av
+import httpx
+import numpy as np
+import openai
+from livekit import rtc
+from livekit.agents import (
+    APIConnectionError,
+    APIConnectOptions,
+    APIStatusError,
+    APITimeoutError,
+    stt,
+    utils,
+    vad,
+)
+
+from runtime_reports import RUNTIME_DIR, ReportLog
+
+
+logger = logging.getLogger("stt-upload")
+
+STT_DIR = os.path.join(RUNTIME_DIR, "stt")
+REPORTS = ReportLog(STT_DIR)
+
+# "compact" trims and encodes each utterance; "raw" uploads the VAD buffer as WAV, as the plugin does
+MODE = os.getenv("STT_UPLOAD", "compact")
+# flac is lossless; opus is ~5x smaller again at a small accuracy cost
+CODEC = os.getenv("STT_UPLOAD_CODEC", "flac")
+OPUS_BITRATE = int(os.getenv("STT_UPLOAD_OPUS_BITRATE", "32000"))
+# Whisper resamples everything to 16kHz, so anything above it is uploaded for nothing
+UPLOAD_SAMPLE_RATE = 16000
+# silence kept on each side of the speech so the first and last phonemes are not clipped
+KEEP_MS = int(os.getenv("STT_TRIM_KEEP_MS", "200"))
+# uplink used to estimate upload time in the report
+UPLINK_KBPS = float(os.getenv("STT_UPLINK_KBPS", "256"))
+
+# batch providers that take an uploaded file, as opposed to streaming ones (deepgram, google)
+BATCH_PROVIDERS = ("groq", "openai")
+
+_CODECS = {
+    # codec -> (container, encoder, filename, mime type)
+    "flac": ("flac", "flac", "audio.flac", "audio/flac"),
+    "opus": ("ogg", "libopus", "audio.ogg", "audio/ogg"),
+}
+
+_encoder = ThreadPoolExecutor(max_workers=2, thread_name_prefix="stt-encode")
+
+
+def trim(samples: np.ndarray, sample_rate: int, lead: float, tail: float, keep_ms: int = KEEP_MS) -> np.ndarray:
+    """Drop `lead` and `tail` seconds of silence from mono samples, keeping keep_ms of each (a view)"""
+    keep = keep_ms / 1000
+    start = int(max(0.0, lead - keep) * sample_rate)
+    end = len(samples) - int(max(0.0, tail - keep) * sample_rate)
+    if end - start < sample_rate // 10:
+        # the boundaries do not fit this buffer (e.g. a flushed partial utterance); leave it alone
+        return samples
+    return samples[start:end]
+
+
+def encode(samples: np.ndarray, sample_rate: int, codec: str = CODEC) -> tuple[bytes, str, str]:
+    """Encode mono samples to (data, filename, mime type); runs on the encoder pool, never on the event loop"""
+    if codec == "wav":
+        frame = rtc.AudioFrame(samples.tobytes(), sample_rate, 1, len(samples))
+        return frame.to_wav_bytes(), "audio.wav", "audio/wav"
+    container_format, encoder, filename, mime = _CODECS[codec]
+    source = av.AudioFrame.from_ndarray(samples.reshape(1, -1), format="s16", layout="mono")
+    source.sample_rate = sample_rate
+    resampler = av.AudioResampler(format="s16", layout="mono", rate=UPLOAD_SAMPLE_RATE)
+    out = io.BytesIO()
+    with av.open(out, "w", format=container_format) as container:
+        stream = container.add_stream(encoder, rate=UPLOAD_SAMPLE_RATE, layout="mono")
+        if codec == "opus":
+            stream.bit_rate = OPUS_BITRATE
+        for resampled in [*resampler.resample(source), *resampler.resample(None)]:
+            for packet in stream.encode(resampled):
+                container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+    return out.getvalue(), filename, mime
+
+
+class _TrimmingVADStream:
+    """Forwards to a VAD stream and attaches the silence boundaries to each END_OF_SPEECH event"""
+
+    def __init__(self, inner: vad.VADStream, trimming: "TrimmingVAD"):
+        self._inner = inner
+        self._trimming = trimming
+
+    def __getattr__(self, name):
+        return getattr(self._inner, name)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> vad.VADEvent:
+        event = await self._inner.__anext__()
+        if event.type == vad.VADEventType.END_OF_SPEECH:
+            self._trimming._on_end_of_speech(event)
+        return event
+
+
+class TrimmingVAD(vad.VAD):
+    """
+    VAD for the STT StreamAdapter only. The adapter recognizes whatever
+    buffer the END_OF_SPEECH event carries, leading padding and trailing
+    silence included; this records both so the STT can cut them off. Over
+    an audio_ring.SharedVAD it also records the utterance as a view into
+    the caller's ring, which saves copying the adapter's buffer.
+    """
+
+    def __init__(self, inner: vad.VAD):
+        super().__init__(capabilities=inner.capabilities)
+        self._inner = inner
+        opts = getattr(getattr(inner, "inner", inner), "_opts", None)
+        self.prefix_padding = getattr(opts, "prefix_padding_duration", 0.0)
+        # the adapter recognizes each END_OF_SPEECH buffer right after receiving the event, in order
+        self._boundaries: deque[tuple[float, float, Optional[np.ndarray]]] = deque()
+
+    def stream(self) -> _TrimmingVADStream:
+        return _TrimmingVADStream(self._inner.stream(), self)
+
+    def _on_end_of_speech(self, event: vad.VADEvent):
+        utterance = getattr(self._inner, "utterance", None)
+        # the speech buffer is [prefix padding][speech][silence that ended the turn]
+        self._boundaries.append((self.prefix_padding, event.silence_duration, utterance(event) if utterance else None))
+
+    def next_boundaries(self) -> Optional[tuple[float, float, Optional[np.ndarray]]]:
+        return self._boundaries.popleft() if self._boundaries else None
+
+
+class CompactUploadSTT(stt.STT):
+    """
+    Batch Whisper STT (groq or openai plugin) that uploads each utterance
+    trimmed to its VAD boundaries and encoded off the event loop, instead
+    of the full buffer as 48kHz WAV. Every utterance is recorded with the
+    bytes the plugin would have sent, the bytes actually sent and the STT
+    latency; STT_UPLOAD=raw records the same numbers for the plugin's own
+    behaviour, for comparison.
+    """
+
+    def __init__(self, inner: stt.STT, *, provider: str, trimming: Optional[TrimmingVAD] = None, mode: str = MODE, codec: str = CODEC):
+        super().__init__(capabilities=stt.STTCapabilities(streaming=False, interim_results=False))
+        self._inner = inner
+        self.provider = provider
+        self.trimming = trimming
+        self.mode = mode
+        self.codec = codec if mode == "compact" else "wav"
+        self.utterances: list[dict] = []
+
+    async def _recognize_impl(
+        self,
+        buffer: utils.AudioBuffer,
+        *,
+        language: Optional[str],
+        conn_options: APIConnectOptions,
+    ) -> stt.SpeechEvent:
+        inner = self._inner
+        lead, tail, samples = (self.trimming.next_boundaries() if self.trimming else None) or (0.0, 0.0, None)
+        if samples is None:
+            frame = rtc.combine_audio_frames(buffer)
+            samples, sample_rate = np.frombuffer(frame.data, dtype=np.int16), frame.sample_rate
+        else:
+            sample_rate = buffer.sample_rate if isinstance(buffer, rtc.AudioFrame) else buffer[0].sample_rate
+        raw_bytes = 44 + samples.nbytes
+        raw_ms = len(samples) / sample_rate * 1000
+        if self.mode == "compact":
+            samples = trim(samples, sample_rate, lead, tail)
+
+        started = time.perf_counter()
+        data, filename, mime = await asyncio.get_running_loop().run_in_executor(_encoder, encode, samples, sample_rate, self.codec)
+        encoded = time.perf_counter()
+        try:
+            config = inner._sanitize_options(language=language)
+            resp = await inner._client.audio.transcriptions.create(
+                file=(filename, data, mime),
+                model=inner._opts.model,
+                language=config.language,
+                response_format="verbose_json",
+                timeout=httpx.Timeout(30, connect=conn_options.timeout),
+            )
+        except openai.APITimeoutError:
+            raise APITimeoutError()
+        except openai.APIStatusError as e:
+            raise APIStatusError(e.message, status_code=e.status_code, request_id=e.request_id, body=e.body)
+        except Exception as e:
+            raise APIConnectionError() from e
+        finished = time.perf_counter()
+
+        self.utterances.append({
+            "mode": self.mode,
+            "codec": self.codec,
+            "audio_ms": len(samples) / sample_rate * 1000,
+            "trimmed_ms": raw_ms - len(samples) / sample_rate * 1000,
+            "raw_bytes": raw_bytes,
+            "upload_bytes": len(data),
+            "encode_ms": (encoded - started) * 1000,
+            "stt_ms": (finished - encoded) * 1000,
+        })
+        return stt.SpeechEvent(
+            type=stt.SpeechEventType.FINAL_TRANSCRIPT,
+            alternatives=[stt.SpeechData(text=resp.text or "", language=resp.language or config.language or "")],
+        )
+
+    def report(self) -> dict:
+        return {"provider": self.provider, "utterances": self.utterances}
+
+    def attach(self, job_ctx):
+        async def report():
+            if not self.utterances:
+                return
+            data = {"call_id": job_ctx.room.name, "ts": time.time(), **self.report()}
+            await asyncio.to_thread(REPORTS.write, os.getenv("AGENT_WORKER_ID", "dev"), data)
+
+        job_ctx.add_shutdown_callback(report)
+
+    async def aclose(self):
+        await self._inner.aclose()
+
+
+def compact_stt(pipeline, vad_: vad.VAD, job_ctx) -> stt.STT:
+    """The pipeline's STT; batch Whisper providers get trimmed, compressed uploads"""
+    if pipeline.stt == "local":
+        # streams straight from the shared VAD's ring, nothing is uploaded
+        return pipeline.make_stt(vad=vad_).attach(job_ctx)
+    inner = pipeline.make_stt()
+    if pipeline.stt not in BATCH_PROVIDERS:
+        return inner
+    trimming = TrimmingVAD(vad_)
+    compact = CompactUploadSTT(inner, provider=pipeline.stt, trimming=trimming)
+    compact.attach(job_ctx)
+    # built here rather than by VoicePipelineAgent so the adapter runs the trimming VAD
+    return stt.StreamAdapter(stt=compact, vad=trimming)
+
+
+def upload_ms(nbytes: int, uplink_kbps: float = UPLINK_KBPS) -> float:
+    return nbytes * 8 / uplink_kbps
+
+
+def summarize(reports: list[dict]) -> dict[str, dict]:
+    """Per upload mode: utterance count and mean audio, bytes and latencies"""
+    by_mode: dict[str, list[dict]] = {}
+    for report in reports:
+        for utterance in report["utterances"]:
+            by_mode.setdefault(utterance["mode"], []).append(utterance)
+    summary = {}
+    for mode, utterances in by_mode.items():
+        n = len(utterances)
+        mean = lambda key: sum(u[key] for u in utterances) / n
+        summary[mode] = {
+            "utterances": n,
+            **{key: mean(key) for key in ("audio_ms", "trimmed_ms", "raw_bytes", "upload_bytes", "encode_ms", "stt_ms")},
+        }
+    return summary
+
+
+def _bench(path: str, lead: float, tail: float, uplink_kbps: float):
+    with av.open(path) as container:
+        stream = container.streams.audio[0]
+        resampler = av.AudioResampler(format="s16", layout="mono", rate=stream.rate)
+        samples = np.concatenate([f.to_ndarray().reshape(-1) for frame in container.decode(stream) for f in resampler.resample(frame)])
+        sample_rate = stream.rate
+    print(f"{path}: {len(samples) / sample_rate:.2f}s at {sample_rate}Hz, uplink {uplink_kbps:.0f}kbps")
+    print("upload                  bytes  encode ms  upload ms")
+    cases = [("wav, untrimmed (plugin)", samples, "wav")]
+    trimmed = trim(samples, sample_rate, lead, tail)
+    cases += [(f"{codec}, trimmed", trimmed, codec) for codec in ("wav", *_CODECS)]
+    for label, audio, codec in cases:
+        started = time.perf_counter()
+        data, _, _ = encode(audio, sample_rate, codec)
+        print(f"{label:23s} {len(data):7d}  {(time.perf_counter() - started) * 1000:9.1f}  {upload_ms(len(data), uplink_kbps):9.0f}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="STT upload size and latency per utterance, before and after trimming/compression")
+    parser.add_argument("--worker", default="dev")
+    parser.add_argument("-n", type=int, default=100, help="number of recent calls")
+    parser.add_argument("--bench", metavar="AUDIO_FILE", help="encode one utterance every way and compare sizes")
+    parser.add_argument("--lead", type=float, default=0.5, help="leading silence in the benchmark file (s)")
+    parser.add_argument("--tail", type=float, default=0.55, help="trailing silence in the benchmark file (s)")
+    parser.add_argument("--uplink-kbps", type=float, default=UPLINK_KBPS)
+    args = parser.parse_args()
+
+    if args.bench:
+        _bench(args.bench, args.lead, args.tail, args.uplink_kbps)
+        raise SystemExit
+
+    summary = summarize(REPORTS.read(args.worker, args.n))
+    if not summary:
+        print("no reports")
+        raise SystemExit
+    print("mode     utterances  audio ms  trimmed ms  raw bytes  sent bytes  est upload ms  encode ms  stt ms")
+    for mode, s in summary.items():
+        print(
+            f"{mode:8s} {s['utterances']:10d} {s['audio_ms']:9.0f} {s['trimmed_ms']:11.0f} {s['raw_bytes']:10.0f} "
+            f"{s['upload_bytes']:11.0f} {upload_ms(s['upload_bytes'], args.uplink_kbps):14.0f} {s['encode_ms']:10.1f} {s['stt_ms']:7.0f}"
+        )
@@ -0,0 +1,331 @@
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+from dataclasses import dataclass, field
+from typing import Optional
+
+import pool_sizer
+import local_stt
+import local_tts
+import recording
+from runtime_reports import RUNTIME_DIR
+from transcript_archive import start_background_compaction
+from worker_calls import CALLS_DIR, DEFAULT_BASE_PORT
+
+
+logger = logging.getLogger("agent-supervisor")
+
+STATUS_FILE = os.path.join(RUNTIME_DIR, "supervisor.json")
+PID_FILE = os.path.join(RUNTIME_DIR, "supervisor.pid")
+
+DEFAULT_SCRIPT = "agent2.py"
+# per-worker call capacity, used only to express load as a fraction on the dashboard
+DEFAULT_CALLS_PER_WORKER = int(os.getenv("AGENT_CALLS_PER_WORKER", "4"))
+
+
+# --- helpers used from the dashboard ---
+
+def read_status() -> Optional[dict]:
+    """Return the last status snapshot written by a live supervisor, or None"""
+    pid = supervisor_pid()
+    if pid is None:
+        return None
+    try:
+        with open(STATUS_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"pid": pid, "state": "starting", "workers": []}
+
+
+def supervisor_pid() -> Optional[int]:
+    """PID of the running supervisor, None if it is not running"""
+    try:
+        with open(PID_FILE, "r") as f:
+            pid = int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return None
+    except PermissionError:
+        pass
+    return pid
+
+
+def launch_detached(num_workers: Optional[int] = None, script: str = DEFAULT_SCRIPT) -> int:
+    """Start the supervisor in its own session so it outlives the caller"""
+    cmd = [sys.executable, os.path.abspath(__file__), "--script", script]
+    if num_workers:
+        cmd += ["--workers", str(num_workers)]
+    os.makedirs(RUNTIME_DIR, exist_ok=True)
+    # the child keeps its own copy of the log handle
+    with open(os.path.join(RUNTIME_DIR, "supervisor.log"), "ab") as log:
+        process = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+    return process.pid
+
+
+def request_stop() -> bool:
+    """Ask the running supervisor to drain its workers and exit"""
+    pid = supervisor_pid()
+    if pid is None:
+        return False
+    os.kill(pid, signal.SIGTERM)
+    return True
+
+
+# --- the supervisor itself ---
+
+@dataclass
+class WorkerSlot:
+    worker_id: int
+    port: int
+    process: Optional[subprocess.Popen] = None
+    started_at: float = 0.0
+    restarts: int = 0
+    failed_checks: int = 0
+    next_start: float = 0.0
+    last_exit_code: Optional[int] = None
+    healthy: bool = False
+    crash_times: list[float] = field(default_factory=list)
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+
+class WorkerSupervisor:
+    """
+    Run a pool of production-mode agent workers, one per core by default.
+    Crashed or unresponsive workers are restarted with backoff, and stopping
+    sends SIGTERM so every worker drains its active calls before exiting.
+    """
+
+    def __init__(
+        self,
+        *,
+        script: str = DEFAULT_SCRIPT,
+        num_workers: Optional[int] = None,
+        base_port: int = DEFAULT_BASE_PORT,
+        health_interval: float = 5.0,
+        startup_grace: float = 30.0,
+        max_failed_checks: int = 3,
+        drain_timeout: float = 1800.0,
+    ):
+        self.script = script
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.health_interval = health_interval
+        self.startup_grace = startup_grace
+        self.max_failed_checks = max_failed_checks
+        self.drain_timeout = drain_timeout
+        self.slots = [WorkerSlot(worker_id=i, port=base_port + i) for i in range(self.num_workers)]
+        self.state = "starting"
+        self._stopping = False
+        # host-wide model servers the workers' calls connect to
+        self._server_starters = {
+            name: start
+            for name, enabled, start in (
+                ("local STT", local_stt.SERVER_ENABLED, local_stt.start_server),
+                ("local TTS", local_tts.SERVER_ENABLED, local_tts.start_server),
+            )
+            if enabled
+        }
+        self._servers: dict[str, subprocess.Popen] = {}
+        if os.getenv("PIPELINE_STT") == "local":
+            local_stt.require_server(supervised=True)
+        if "local" in (os.getenv("PIPELINE_TTS"), os.getenv("PIPELINE_TTS_FALLBACK")):
+            local_tts.require_server(supervised=True)
+
+    def _spawn(self, slot: WorkerSlot):
+        env = dict(os.environ)
+        env["AGENT_WORKER_ID"] = str(slot.worker_id)
+        env["AGENT_HTTP_PORT"] = str(slot.port)
+        # each worker sizes its idle process pool for its share of the calls
+        env["AGENT_NUM_WORKERS"] = str(self.num_workers)
+        # stale markers from a crashed worker would otherwise count as active calls
+        calls_dir = os.path.join(CALLS_DIR, str(slot.worker_id))
+        if os.path.isdir(calls_dir):
+            for name in os.listdir(calls_dir):
+                os.remove(os.path.join(calls_dir, name))
+        slot.process = subprocess.Popen([sys.executable, self.script, "start"], env=env)
+        slot.started_at = time.time()
+        slot.failed_checks = 0
+        slot.healthy = False
+        logger.info(f"started worker {slot.worker_id} (pid {slot.process.pid}, port {slot.port})")
+
+    def _health_check(self, slot: WorkerSlot) -> bool:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{slot.port}/", timeout=2) as res:
+                return res.status == 200
+        except Exception:
+            return False
+
+    def _restart_delay(self, slot: WorkerSlot) -> float:
+        now = time.time()
+        slot.crash_times = [t for t in slot.crash_times if now - t < 300] + [now]
+        # 1s, 2s, 4s ... capped at 60s while a worker keeps crashing
+        return min(60.0, 2.0 ** (len(slot.crash_times) - 1))
+
+    def check(self):
+        now = time.time()
+        for slot in self.slots:
+            if slot.process is None:
+                if now >= slot.next_start:
+                    self._spawn(slot)
+                continue
+
+            exit_code = slot.process.poll()
+            if exit_code is not None:
+                slot.last_exit_code = exit_code
+                slot.process = None
+                slot.healthy = False
+                slot.restarts += 1
+                slot.next_start = now + self._restart_delay(slot)
+                logger.warning(f"worker {slot.worker_id} exited with code {exit_code}, restarting in {slot.next_start - now:.0f}s")
+                continue
+
+            if self._health_check(slot):
+                slot.healthy = True
+                slot.failed_checks = 0
+            elif now - slot.started_at > self.startup_grace:
+                slot.healthy = False
+                slot.failed_checks += 1
+                if slot.failed_checks >= self.max_failed_checks:
+                    logger.warning(f"worker {slot.worker_id} failed {slot.failed_checks} health checks, killing it")
+                    slot.process.kill()
+
+    def active_calls(self, slot: WorkerSlot) -> list[dict]:
+        calls_dir = os.path.join(CALLS_DIR, str(slot.worker_id))
+        calls = []
+        if not os.path.isdir(calls_dir):
+            return calls
+        for name in os.listdir(calls_dir):
+            try:
+                with open(os.path.join(calls_dir, name), "r", encoding="utf-8") as f:
+                    calls.append(json.load(f))
+            except (OSError, ValueError):
+                pass
+        return calls
+
+    def snapshot(self) -> dict:
+        workers = []
+        for slot in self.slots:
+            calls = self.active_calls(slot) if slot.alive else []
+            pool = (pool_sizer.read_stats(slot.worker_id) if slot.alive else None) or {}
+            workers.append({
+                "worker_id": slot.worker_id,
+                "pid": slot.process.pid if slot.process else None,
+                "port": slot.port,
+                "alive": slot.alive,
+                "healthy": slot.healthy,
+                "uptime": time.time() - slot.started_at if slot.alive else 0.0,
+                "restarts": slot.restarts,
+                "last_exit_code": slot.last_exit_code,
+                "active_calls": len(calls),
+                "load": len(calls) / DEFAULT_CALLS_PER_WORKER,
+                "calls": calls,
+                "idle_processes": pool.get("idle", 0),
+                "target_idle": pool.get("target_idle", 0),
+                "cold_starts": pool.get("cold_starts", 0),
+            })
+        return {"pid": os.getpid(), "state": self.state, "updated_at": time.time(), "workers": workers}
+
+    def write_status(self):
+        tmp = STATUS_FILE + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp, STATUS_FILE)
+
+    def drain(self):
+        """Let every worker finish its active calls, then stop it"""
+        self.state = "draining"
+        for slot in self.slots:
+            if slot.alive:
+                # livekit workers in production mode stop accepting jobs and
+                # wait for running ones on SIGTERM
+                slot.process.send_signal(signal.SIGTERM)
+        deadline = time.time() + self.drain_timeout
+        while any(slot.alive for slot in self.slots) and time.time() < deadline:
+            self.write_status()
+            time.sleep(1.0)
+        for slot in self.slots:
+            if slot.alive:
+                logger.warning(f"worker {slot.worker_id} did not drain in time, killing it")
+                slot.process.kill()
+                slot.process.wait()
+        self.state = "stopped"
+        self.write_status()
+
+    def request_stop(self, *_):
+        self._stopping = True
+
+    def check_servers(self):
+        """Keep the host's model servers running; every worker's calls use them"""
+        for name, start in self._server_starters.items():
+            process = self._servers.get(name)
+            if process is not None and process.poll() is None:
+                continue
+            if process is not None:
+                logger.warning(f"{name} server exited with code {process.returncode}, restarting")
+            self._servers[name] = start()
+
+    def run(self):
+        os.makedirs(CALLS_DIR, exist_ok=True)
+        with open(PID_FILE, "w") as f:
+            f.write(str(os.getpid()))
+        signal.signal(signal.SIGTERM, self.request_stop)
+        signal.signal(signal.SIGINT, self.request_stop)
+
+        logger.info(f"starting {self.num_workers} workers running {self.script}")
+        start_background_compaction()
+        uploader = None
+        if recording.RecordingConfig.from_env().mode == "local":
+            uploader = recording.start_background_uploader()
+        try:
+            self.state = "running"
+            while not self._stopping:
+                self.check_servers()
+                self.check()
+                self.write_status()
+                # sleep in small steps so a stop request is picked up quickly
+                wake = time.time() + self.health_interval
+                while not self._stopping and time.time() < wake:
+                    time.sleep(0.2)
+            self.drain()
+            if uploader is not None:
+                uploader.stop()
+            # after the drain, so calls still running keep their STT and TTS
+            for process in self._servers.values():
+                process.terminate()
+                process.wait()
+        finally:
+            try:
+                os.remove(PID_FILE)
+            except FileNotFoundError:
+                pass
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    parser = argparse.ArgumentParser(description="Run a supervised pool of voice agent workers")
+    parser.add_argument("--script", default=os.getenv("AGENT_SCRIPT", DEFAULT_SCRIPT))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("AGENT_WORKERS", "0")) or None,
+                        help="number of worker processes (default: one per CPU core)")
+    parser.add_argument("--base-port", type=int, default=int(os.getenv("AGENT_BASE_PORT", DEFAULT_BASE_PORT)))
+    parser.add_argument("--drain-timeout", type=float, default=float(os.getenv("AGENT_DRAIN_TIMEOUT", "1800")))
+    args = parser.parse_args()
+
+    WorkerSupervisor(
+        script=args.script,
+        num_workers=args.workers,
+        base_port=args.base_port,
+        drain_timeout=args.drain_timeout,
+    ).run()
@@ -0,0 +1,356 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import inspect
+import json
+import logging
+import os
+import time
+from typing import Callable, Optional
+
+from clause_tts import language_of
+from runtime_reports import RUNTIME_DIR, ReportLog, quantile
+
+
+logger = logging.getLogger("tool-runner")
+
+TOOLS_DIR = os.path.join(RUNTIME_DIR, "tools")
+REPORTS = ReportLog(TOOLS_DIR)
+
+FILLERS_ENABLED = os.getenv("TOOL_FILLERS", "on") != "off"
+
+# what the agent says while a tool runs, by tool kind and caller language; Urmi speaks in the feminine
+FILLERS = {
+    "check": {
+        "en": ("Let me check that for you.", "One sec, let me look."),
+        "hinglish": ("Ek second, main check karti hoon.",),
+        "hi": ("एक मिनट, मैं देखती हूँ।",),
+        "kn": ("ಒಂದು ನಿಮಿಷ, ನೋಡುತ್ತೇನೆ.",),
+    },
+    "book": {
+        "en": ("Okay, booking that for you now.",),
+        "hinglish": ("Theek hai, main book kar rahi hoon.",),
+        "hi": ("ठीक है, मैं बुक कर रही हूँ।",),
+        "kn": ("ಸರಿ, ಬುಕ್ ಮಾಡುತ್ತಿದ್ದೇನೆ.",),
+    },
+}
+
+
+def filler_phrases() -> list[str]:
+    """Every filler, for pinning in a CachedTTS so they play from pre-rendered audio"""
+    return [phrase for by_language in FILLERS.values() for phrases in by_language.values() for phrase in phrases]
+
+
+def _key(name: str, arguments: dict) -> tuple[str, str]:
+    return name, json.dumps(arguments, sort_keys=True, default=str)
+
+
+def _arguments(fn, self, args: tuple, kwargs: dict) -> dict:
+    """Arguments by name with defaults filled in, so positional and keyword calls share a memo key"""
+    bound = inspect.signature(fn).bind(self, *args, **kwargs)
+    bound.apply_defaults()
+    arguments = dict(bound.arguments)
+    del arguments[next(iter(arguments))]
+    return arguments
+
+
+def read_only(fn):
+    """
+    For tools without side effects. The result is reused for the same
+    arguments for the rest of the call, and ToolRunner starts the tool as
+    soon as the model asks for it rather than after the calls ahead of it.
+    The FunctionContext needs a ToolRunner in `self.tools`.
+    """
+
+    @functools.wraps(fn)
+    async def wrapper(self, *args, **kwargs):
+        arguments = _arguments(fn, self, args, kwargs)
+        return await self.tools.run(fn.__name__, arguments, lambda: fn(self, **arguments))
+
+    wrapper.read_only = True
+    return wrapper
+
+
+def filler(kind: str):
+    """Play a FILLERS[kind] phrase while this tool and the answer after it are pending"""
+
+    def deco(fn):
+        fn.filler = kind
+        return fn
+
+    return deco
+
+
+class ToolRunner:
+    """
+    Tool execution for one call. VoicePipelineAgent runs the model's tool
+    calls one after another and says nothing until the tools have returned
+    and a second LLM call has answered. On function_calls_collected the
+    runner starts every read-only call at once (the pipeline then awaits
+    tasks that are already running) and queues a filler as nested speech,
+    unless the model already said something with its tool calls. Each tool
+    turn's silence, from the end of the agent's last audio until the
+    answer starts, is recorded.
+    """
+
+    def __init__(self, fillers_enabled: bool = FILLERS_ENABLED):
+        self.fillers_enabled = fillers_enabled
+        self.turns: list[dict] = []
+        self._results: dict[tuple[str, str], asyncio.Task] = {}
+        self._agent = None
+        self._language: Optional[Callable[[], str]] = None
+        self._filler_index: dict[str, int] = {}
+        self._turn: Optional[dict] = None
+
+    async def run(self, name: str, arguments: dict, start: Callable):
+        key = _key(name, arguments)
+        task = self._results.get(key)
+        if task is None:
+            task = asyncio.ensure_future(start())
+            self._results[key] = task
+            # a failed lookup is retried the next time it is asked for
+            task.add_done_callback(lambda t: t.cancelled() or t.exception() is None or self._results.pop(key, None))
+        # the pipeline cancels its await on interruption; the result is still wanted later
+        return await asyncio.shield(task)
+
+    def attach(self, agent, job_ctx=None, *, language: Optional[Callable[[], str]] = None) -> "ToolRunner":
+        """`language` returns the caller's FILLERS language; by default the script of their last message"""
+        self._agent = agent
+        self._language = language
+        agent.on("function_calls_collected", self._on_collected)
+        agent.on("function_calls_finished", self._on_finished)
+        agent.on("agent_started_speaking", self._on_started_speaking)
+        agent.on("agent_stopped_speaking", self._on_stopped_speaking)
+        if job_ctx is not None:
+
+            async def report():
+                if not self.turns:
+                    return
+                data = {"call_id": job_ctx.room.name, "ts": time.time(), **self.report()}
+                logger.info(f"tool turns: {data}")
+                await asyncio.to_thread(REPORTS.write, os.getenv("AGENT_WORKER_ID", "dev"), data)
+
+            job_ctx.add_shutdown_callback(report)
+        return self
+
+    def _on_collected(self, calls):
+        now = time.perf_counter()
+        self._turn = {
+            "tools": [call.function_info.name for call in calls],
+            "early": 0,
+            "memo_hits": 0,
+            "filler": None,
+            "tool_ms": None,
+            "first_audio_ms": None,
+            "silence_ms": 0.0,
+            "_started": now,
+            "_silent_since": now,
+            "_speeches": 0,
+        }
+        for call in calls:
+            tool = call.function_info.callable
+            if getattr(tool, "read_only", False):
+                arguments = _arguments(tool.__wrapped__, tool.__self__, (), call.arguments)
+                if _key(tool.__name__, arguments) in self._results:
+                    self._turn["memo_hits"] += 1
+                else:
+                    self._turn["early"] += 1
+                asyncio.ensure_future(tool(**call.arguments))
+        kinds = [getattr(call.function_info.callable, "filler", None) for call in calls]
+        kind = next((k for k in kinds if k), None)
+        messages = self._agent.chat_ctx.messages
+        spoke = bool(messages) and messages[-1].role == "assistant" and bool(messages[-1].content)
+        if kind and self.fillers_enabled and not spoke:
+            phrase = self._filler(kind)
+            self._turn["filler"] = phrase
+            asyncio.ensure_future(self._agent.say(phrase, allow_interruptions=True, add_to_chat_ctx=False))
+
+    def _filler(self, kind: str) -> str:
+        by_language = FILLERS[kind]
+        phrases = by_language.get(self._caller_language(), by_language["en"])
+        index = self._filler_index.get(kind, 0)
+        self._filler_index[kind] = index + 1
+        return phrases[index % len(phrases)]
+
+    def _caller_language(self) -> str:
+        if self._language is not None:
+            return self._language()
+        users = [m for m in self._agent.chat_ctx.messages if m.role == "user" and isinstance(m.content, str)]
+        return language_of(users[-1].content) if users else "en"
+
+    def _on_finished(self, called_functions):
+        if self._turn is not None:
+            self._turn["tool_ms"] = (time.perf_counter() - self._turn["_started"]) * 1000
+
+    def _on_started_speaking(self):
+        turn = self._turn
+        if turn is None:
+            return
+        now = time.perf_counter()
+        # back to back with the filler, the answer may start before the filler's stop is seen
+        if turn["_silent_since"] is not None:
+            turn["silence_ms"] += (now - turn["_silent_since"]) * 1000
+        turn["_silent_since"] = None
+        turn["_speeches"] += 1
+        if turn["first_audio_ms"] is None:
+            turn["first_audio_ms"] = (now - turn["_started"]) * 1000
+        # the filler, when there is one, plays first; the next speech is the answer
+        if turn["_speeches"] > (1 if turn["filler"] else 0):
+            self.turns.append({k: v for k, v in turn.items() if not k.startswith("_")})
+            self._turn = None
+
+    def _on_stopped_speaking(self):
+        if self._turn is not None and self._turn["_silent_since"] is None:
+            self._turn["_silent_since"] = time.perf_counter()
+
+    def report(self) -> dict:
+        return {
+            "turns": self.turns,
+            "memoized": len(self._results),
+        }
+
+
+def summarize(reports: list[dict]) -> dict:
+    turns = [t for r in reports for t in r["turns"]]
+    silence = [t["silence_ms"] for t in turns]
+    first = [t["first_audio_ms"] for t in turns]
+    return {
+        "calls": len(reports),
+        "turns": len(turns),
+        "with_filler": sum(bool(t["filler"]) for t in turns),
+        "memo_hits": sum(t["memo_hits"] for t in turns),
+        "silence_p50_ms": quantile(silence, 0.5),
+        "silence_p95_ms": quantile(silence, 0.95),
+        "first_audio_p50_ms": quantile(first, 0.5),
+    }
+
+
+class _BenchAgent:
+    """The parts of VoicePipelineAgent a ToolRunner uses, with speech played on a simulated clock"""
+
+    def __init__(self, filler_ttfb_ms: float, speech_ms: float):
+        from livekit.agents import llm, utils
+
+        self._emitter = utils.EventEmitter()
+        self.on, self.emit = self._emitter.on, self._emitter.emit
+        self.chat_ctx = llm.ChatContext().append(role="user", text="do you have anything on Tuesday?")
+        self.filler_ttfb_ms, self.speech_ms = filler_ttfb_ms, speech_ms
+        self._busy_until = 0.0
+
+    async def say(self, text: str, **kwargs):
+        self.play(self.filler_ttfb_ms, speech_ms=len(text) * 55)
+
+    def play(self, ttfb_ms: float, speech_ms: Optional[float] = None) -> asyncio.Future:
+        """Nested speech plays in order: a speech starts once it is synthesized and the one before it ended"""
+        loop = asyncio.get_running_loop()
+        start = max(loop.time() + ttfb_ms / 1000, self._busy_until)
+        self._busy_until = end = start + (speech_ms or self.speech_ms) / 1000
+        loop.call_at(start, self.emit, "agent_started_speaking")
+        loop.call_at(end, self.emit, "agent_stopped_speaking")
+        done = loop.create_future()
+        loop.call_at(end, done.set_result, None)
+        return done
+
+
+def _bench_actions(tool_ms: float):
+    from livekit.agents import llm
+
+    async def look_up_availability(self, date: str):
+        await asyncio.sleep(tool_ms / 1000)
+        return json.dumps({"date": date, "available_times": ["1pm", "2pm", "3pm"]})
+
+    async def confirm_appointment(self, date: str, time: str):
+        await asyncio.sleep(0.15)
+        return "reservation confirmed"
+
+    class Plain(llm.FunctionContext):
+        def __init__(self):
+            super().__init__()
+            self.tools = ToolRunner(fillers_enabled=False)
+
+    Plain.look_up_availability = llm.ai_callable(description="availability")(look_up_availability)
+    Plain.confirm_appointment = llm.ai_callable(description="confirm")(confirm_appointment)
+
+    class Runner(llm.FunctionContext):
+        def __init__(self):
+            super().__init__()
+            self.tools = ToolRunner()
+
+    Runner.look_up_availability = llm.ai_callable(description="availability")(filler("check")(read_only(look_up_availability)))
+    Runner.confirm_appointment = llm.ai_callable(description="confirm")(filler("book")(confirm_appointment))
+    return Plain, Runner
+
+
+async def _bench(tool_ms: float, llm_ms: float, tts_ms: float, filler_ttfb_ms: float):
+    from livekit.agents.llm.function_context import FunctionCallInfo
+
+    # one call: a lookup, two dates in one model turn, a repeated date, then the booking
+    script = [
+        [("look_up_availability", {"date": "Monday"})],
+        [("look_up_availability", {"date": "Tuesday"}), ("look_up_availability", {"date": "Wednesday"})],
+        [("look_up_availability", {"date": "Tuesday"})],
+        [("confirm_appointment", {"date": "Tuesday", "time": "2pm"})],
+    ]
+    print(
+        f"tools {tool_ms:.0f}ms, answer LLM {llm_ms:.0f}ms to first token, TTS {tts_ms:.0f}ms,"
+        f" pre-rendered filler {filler_ttfb_ms:.0f}ms"
+    )
+    print("path     turn                                       first audio  silence  memo")
+    for label, actions_cls in zip(("plain", "runner"), _bench_actions(tool_ms)):
+        agent = _BenchAgent(filler_ttfb_ms, speech_ms=1500)
+        actions = actions_cls()
+        actions.tools.attach(agent)
+        for turn in script:
+            calls = [
+                FunctionCallInfo(
+                    tool_call_id=f"call_{i}",
+                    function_info=actions.ai_functions[name],
+                    raw_arguments=json.dumps(arguments),
+                    arguments=arguments,
+                )
+                for i, (name, arguments) in enumerate(turn)
+            ]
+            # what VoicePipelineAgent does with the model's tool calls
+            agent.emit("function_calls_collected", calls)
+            called = []
+            for call in calls:
+                called_fnc = call.execute()
+                called.append(called_fnc)
+                await called_fnc.task
+            agent.emit("function_calls_finished", called)
+            await asyncio.sleep(llm_ms / 1000)
+            await agent.play(tts_ms)
+        for turn in actions.tools.turns:
+            names = " + ".join(f"{name}" for name in turn["tools"])
+            print(f"{label:8s} {names:42s} {turn['first_audio_ms']:11.0f} {turn['silence_ms']:8.0f} {turn['memo_hits']:5d}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Silence during tool turns: recent calls, or an offline benchmark")
+    parser.add_argument("--worker", default="dev")
+    parser.add_argument("-n", type=int, default=100, help="number of recent calls")
+    parser.add_argument("--bench", action="store_true")
+    parser.add_argument("--tool-ms", type=float, default=800)
+    parser.add_argument("--llm-ms", type=float, default=450, help="answer LLM call, to first token")
+    parser.add_argument("--tts-ms", type=float, default=300, help="TTS time to first audio for the answer")
+    parser.add_argument("--filler-ms", type=float, default=30, help="time to first audio of a pre-rendered filler")
+    args = parser.parse_args()
+
+    if args.bench:
+        asyncio.run(_bench(args.tool_ms, args.llm_ms, args.tts_ms, args.filler_ms))
+        raise SystemExit
+    summary = summarize(REPORTS.read(args.worker, args.n))
+    if not summary["turns"]:
+        print("no reports")
+        raise SystemExit
+    print(
+        f"{summary['turns']} tool turns over {summary['calls']} calls, {summary['with_filler']} with a filler,"
+        f" {summary['memo_hits']} memoized results reused"
+    )
+    print(
+        f"silence p50 {summary['silence_p50_ms']:.0f}ms p95 {summary['silence_p95_ms']:.0f}ms,"
+        f" first audio p50 {summary['first_audio_p50_ms']:.0f}ms"
+    )
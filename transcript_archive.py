@@ -0,0 +1,314 @@
+from __future__ import annotations
+
+import argparse
+import gzip
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+
+logger = logging.getLogger("transcript-archive")
+
+ARCHIVE_DIR = os.getenv("TRANSCRIPTS_DIR", "transcriptions")
+MANIFEST_NAME = "manifest.db"
+# partitions older than this are gzip-compressed by compaction
+COMPACT_AFTER_DAYS = int(os.getenv("TRANSCRIPTS_COMPACT_AFTER_DAYS", "7"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS calls (
+    path TEXT PRIMARY KEY,
+    phone TEXT NOT NULL,
+    day TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    duration REAL,
+    room TEXT NOT NULL DEFAULT '',
+    agent TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS calls_phone ON calls (phone, started_at);
+CREATE INDEX IF NOT EXISTS calls_day ON calls (day, started_at);
+"""
+
+
+def _parse_filename(name: str) -> Optional[tuple[str, datetime]]:
+    """Phone and start time from transcriptions_<phone>_<YYYY-mm-dd_HH-MM-SS>.log[.gz]"""
+    stem = name.removesuffix(".gz").removesuffix(".log")
+    parts = stem.split("_")
+    if len(parts) < 2 or parts[0] != "transcriptions":
+        return None
+    started_at = None
+    if len(parts) >= 4:
+        try:
+            started_at = datetime.strptime(f"{parts[2]}_{parts[3]}", "%Y-%m-%d_%H-%M-%S")
+        except ValueError:
+            pass
+    return parts[1], started_at
+
+
+def parse_log_content(content):
+    """Parse log content into calls"""
+    calls = []
+    current_call = []
+    current_timestamp = None
+    
+    for line in content.split('\n'):
+        if line.startswith('['):
+            # Extract timestamp
+            timestamp_match = re.match(r'\[(.*?)\]', line)
+            if timestamp_match:
+                timestamp_str = timestamp_match.group(1)
+                try:
+                    timestamp = datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S.%f')
+                except ValueError:
+                    try:
+                        timestamp = datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
+                    except:
+                        timestamp = None
+                
+                if current_timestamp is None:
+                    current_timestamp = timestamp
+                elif timestamp and (timestamp - current_timestamp).total_seconds() > 600:
+                    # If more than 10 minutes passed, consider it a new call
+                    if current_call:
+                        calls.append(current_call)
+                        current_call = []
+                    current_timestamp = timestamp
+            
+            # Extract speaker and text
+            if "USER:" in line:
+                speaker = "User"
+                text = line.split("USER:")[1].strip()
+                current_call.append({"timestamp": timestamp_str if timestamp_match else "", 
+                                    "speaker": speaker, 
+                                    "text": text})
+            elif "AGENT:" in line:
+                speaker = "Agent"
+                text = line.split("AGENT:")[1].strip()
+                current_call.append({"timestamp": timestamp_str if timestamp_match else "", 
+                                    "speaker": speaker, 
+                                    "text": text})
+        elif current_call and line.strip():
+            # agent2.py writes "[ts] USER:" on its own line, followed by the text
+            last = current_call[-1]
+            last["text"] = f"{last['text']}\n{line}" if last["text"] else line
+    
+    # Add the last call if it exists
+    if current_call:
+        calls.append(current_call)
+    
+    return calls
+
+
+class TranscriptArchive:
+    """
+    Transcripts partitioned by day (<root>/YYYY/MM/DD/) with a sqlite manifest
+    holding phone, start time, duration and location for every call. Listing
+    and filtering only query the manifest, never the filesystem.
+    """
+
+    def __init__(self, root: str = ARCHIVE_DIR):
+        self.root = root
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(self.root, exist_ok=True)
+            self._conn = sqlite3.connect(
+                os.path.join(self.root, MANIFEST_NAME), timeout=10, check_same_thread=False
+            )
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    def partition(self, day: date) -> str:
+        return os.path.join(self.root, f"{day.year:04d}", f"{day.month:02d}", f"{day.day:02d}")
+
+    def new_path(self, phone: str, started_at: datetime) -> str:
+        """Location for a new call transcript, creating its partition"""
+        partition = self.partition(started_at.date())
+        os.makedirs(partition, exist_ok=True)
+        return os.path.join(partition, f"transcriptions_{phone}_{started_at.strftime('%Y-%m-%d_%H-%M-%S')}.log")
+
+    def record(
+        self,
+        path: str,
+        *,
+        phone: str,
+        started_at: datetime,
+        duration: Optional[float] = None,
+        room: str = "",
+        agent: str = "",
+    ):
+        """Add or update the manifest entry for a call"""
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO calls (path, phone, day, started_at, duration, room, agent) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    os.path.relpath(path, self.root),
+                    phone,
+                    started_at.strftime("%Y-%m-%d"),
+                    started_at.timestamp(),
+                    duration,
+                    room,
+                    agent,
+                ),
+            )
+
+    def list_calls(
+        self,
+        *,
+        phone: Optional[str] = None,
+        day: Optional[date] = None,
+        since: Optional[date] = None,
+        until: Optional[date] = None,
+    ) -> list[dict]:
+        """Manifest entries, newest first, optionally filtered by phone, day or an inclusive day range"""
+        query = "SELECT path, phone, day, started_at, duration, room, agent FROM calls"
+        clauses, params = [], []
+        if phone:
+            clauses.append("phone = ?")
+            params.append(phone)
+        if day:
+            clauses.append("day = ?")
+            params.append(day.strftime("%Y-%m-%d"))
+        if since:
+            clauses.append("day >= ?")
+            params.append(since.strftime("%Y-%m-%d"))
+        if until:
+            clauses.append("day <= ?")
+            params.append(until.strftime("%Y-%m-%d"))
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY started_at DESC"
+        return [
+            {
+                "file": os.path.join(self.root, path),
+                "phone": phone,
+                "day": day,
+                "started_at": datetime.fromtimestamp(started_at),
+                "duration": duration,
+                "room": room,
+                "agent": agent,
+            }
+            for path, phone, day, started_at, duration, room, agent in self.conn.execute(query, params)
+        ]
+
+    def phones(self) -> list[str]:
+        return [phone for (phone,) in self.conn.execute("SELECT DISTINCT phone FROM calls ORDER BY phone")]
+
+    def read_text(self, path: str) -> str:
+        """Transcript contents, transparently handling compacted (.gz) files"""
+        if path.endswith(".gz"):
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                return f.read()
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+
+    def import_legacy(self) -> int:
+        """Move flat transcriptions_<phone>_<ts>.log files into their day partition"""
+        moved = 0
+        for name in os.listdir(self.root):
+            src = os.path.join(self.root, name)
+            parsed = _parse_filename(name)
+            if parsed is None or not os.path.isfile(src):
+                continue
+            phone, started_at = parsed
+            if started_at is None:
+                started_at = datetime.fromtimestamp(os.path.getmtime(src))
+            dst = os.path.join(self.partition(started_at.date()), name)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            shutil.move(src, dst)
+            self.record(dst, phone=phone, started_at=started_at)
+            moved += 1
+        return moved
+
+    def rebuild(self) -> int:
+        """Re-index partition files missing from the manifest (e.g. after a crash)"""
+        known = {path for (path,) in self.conn.execute("SELECT path FROM calls")}
+        added = 0
+        for dirpath, _, filenames in os.walk(self.root):
+            if dirpath == self.root:
+                continue
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                parsed = _parse_filename(name)
+                if parsed is None or os.path.relpath(path, self.root) in known:
+                    continue
+                phone, started_at = parsed
+                self.record(path, phone=phone, started_at=started_at or datetime.fromtimestamp(os.path.getmtime(path)))
+                added += 1
+        return added
+
+    def compact(self, older_than_days: int = COMPACT_AFTER_DAYS) -> int:
+        """Gzip transcripts in partitions older than the cutoff and repoint the manifest"""
+        cutoff = (datetime.now() - timedelta(days=older_than_days)).strftime("%Y-%m-%d")
+        rows = self.conn.execute(
+            "SELECT path FROM calls WHERE day < ? AND path NOT LIKE '%.gz'", (cutoff,)
+        ).fetchall()
+        compacted = 0
+        for (rel_path,) in rows:
+            src = os.path.join(self.root, rel_path)
+            if not os.path.exists(src):
+                continue
+            with open(src, "rb") as f_in, gzip.open(src + ".gz", "wb") as f_out:
+                shutil.copyfileobj(f_in, f_out)
+            with self._lock, self.conn:
+                self.conn.execute("UPDATE calls SET path = ? WHERE path = ?", (rel_path + ".gz", rel_path))
+            os.remove(src)
+            compacted += 1
+        if compacted:
+            with self._lock:
+                self.conn.execute("VACUUM")
+        return compacted
+
+    def maintain(self):
+        """One background maintenance pass: migrate, re-index and compact"""
+        moved = self.import_legacy()
+        added = self.rebuild()
+        compacted = self.compact()
+        if moved or added or compacted:
+            logger.info(f"transcript archive: {moved} migrated, {added} re-indexed, {compacted} compacted")
+
+
+def start_background_compaction(interval: float = 3600.0, root: str = ARCHIVE_DIR) -> threading.Thread:
+    """Run TranscriptArchive.maintain every `interval` seconds on a daemon thread"""
+
+    def _run():
+        archive = TranscriptArchive(root)
+        while True:
+            try:
+                archive.maintain()
+            except Exception as e:
+                logger.warning(f"transcript archive maintenance failed: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=_run, name="transcript-compaction", daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Maintain the partitioned transcript archive")
+    parser.add_argument("command", choices=["migrate", "rebuild", "compact", "list"])
+    parser.add_argument("--root", default=ARCHIVE_DIR)
+    parser.add_argument("--older-than-days", type=int, default=COMPACT_AFTER_DAYS)
+    args = parser.parse_args()
+
+    archive = TranscriptArchive(args.root)
+    if args.command == "migrate":
+        print(f"migrated {archive.import_legacy()} transcripts")
+    elif args.command == "rebuild":
+        print(f"re-indexed {archive.rebuild()} transcripts")
+    elif args.command == "compact":
+        print(f"compacted {archive.compact(args.older_than_days)} transcripts")
+    else:
+        for call in archive.list_calls():
+            print(f"{call['started_at']}  {call['phone']}  {call['duration'] or 0:.0f}s  {call['file']}")
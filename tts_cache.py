@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import uuid
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from livekit import rtc
+from livekit.agents import APIConnectOptions, tts
+
+from clause_tts import segmenter
+
+
+logger = logging.getLogger("tts-cache")
+
+CACHE_DIR = os.getenv("TTS_CACHE_DIR", os.path.join("data", "tts_cache"))
+# replayed audio is pushed in frames of this length
+FRAME_MS = 100
+
+
+def _key(text: str) -> str:
+    return hashlib.sha1(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+
+def split_sentences(text: str) -> list[str]:
+    """Split the way the pipeline's StreamAdapter will, so cache keys line up"""
+    return segmenter().tokenize(text)
+
+
+class AudioLRU:
+    """Rendered audio by key, dropping the least recently used once over `max_bytes`"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._audio: OrderedDict[str, bytes] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._audio)
+
+    def get(self, key: str) -> Optional[bytes]:
+        pcm = self._audio.get(key)
+        if pcm is None:
+            self.misses += 1
+            return None
+        self._audio.move_to_end(key)
+        self.hits += 1
+        return pcm
+
+    def put(self, key: str, pcm: bytes):
+        if len(pcm) > self.max_bytes:
+            return
+        old = self._audio.pop(key, None)
+        if old is not None:
+            self.bytes -= len(old)
+        self._audio[key] = pcm
+        self.bytes += len(pcm)
+        while self.bytes > self.max_bytes:
+            _, dropped = self._audio.popitem(last=False)
+            self.bytes -= len(dropped)
+
+
+class _CachedChunkedStream(tts.ChunkedStream):
+    def __init__(self, *, tts: "CachedTTS", input_text: str, pcm: bytes, conn_options: Optional[APIConnectOptions]):
+        super().__init__(tts=tts, input_text=input_text, conn_options=conn_options)
+        self._pcm = pcm
+
+    async def _run(self) -> None:
+        request_id = uuid.uuid4().hex
+        sample_rate, num_channels = self._tts.sample_rate, self._tts.num_channels
+        frame_bytes = sample_rate * num_channels * 2 * FRAME_MS // 1000
+        for start in range(0, len(self._pcm), frame_bytes):
+            chunk = self._pcm[start:start + frame_bytes]
+            self._event_ch.send_nowait(
+                tts.SynthesizedAudio(
+                    request_id=request_id,
+                    frame=rtc.AudioFrame(
+                        data=chunk,
+                        sample_rate=sample_rate,
+                        num_channels=num_channels,
+                        samples_per_channel=len(chunk) // (2 * num_channels),
+                    ),
+                )
+            )
+
+
+class CachedTTS(tts.TTS):
+    """
+    Wraps a TTS and serves pinned phrases from pre-rendered audio on disk.
+    `prerender()` synthesizes missing phrases once through the wrapped TTS;
+    every later request for the same text is answered without a network call.
+    """
+
+    def __init__(self, inner: tts.TTS, *, namespace: str, phrases: Iterable[str] = (), cache_dir: str = CACHE_DIR):
+        super().__init__(
+            capabilities=tts.TTSCapabilities(streaming=False),
+            sample_rate=inner.sample_rate,
+            num_channels=inner.num_channels,
+        )
+        self._inner = inner
+        self._dir = os.path.join(cache_dir, namespace)
+        self._pinned: dict[str, str] = {}
+        self._audio: dict[str, bytes] = {}
+        self.hits = 0
+        self.misses = 0
+        for phrase in phrases:
+            self.pin(phrase)
+
+    def pin(self, text: str):
+        """Keep audio for every sentence of `text` once it has been rendered"""
+        for sentence in split_sentences(text):
+            self._pinned[_key(sentence)] = sentence
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._dir, f"{key}.pcm")
+
+    def _load(self, key: str) -> Optional[bytes]:
+        pcm = self._audio.get(key)
+        if pcm is None and key in self._pinned:
+            try:
+                with open(self._path(key), "rb") as f:
+                    pcm = f.read()
+            except FileNotFoundError:
+                return None
+            self._audio[key] = pcm
+        return pcm
+
+    def synthesize(self, text: str, *, conn_options: Optional[APIConnectOptions] = None) -> tts.ChunkedStream:
+        pcm = self._load(_key(text))
+        if pcm is not None:
+            self.hits += 1
+            return _CachedChunkedStream(tts=self, input_text=text, pcm=pcm, conn_options=conn_options)
+        self.misses += 1
+        return self._inner.synthesize(text, conn_options=conn_options)
+
+    async def _render(self, key: str, text: str):
+        chunks = []
+        async for audio in self._inner.synthesize(text):
+            frame = audio.frame
+            if frame.sample_rate != self.sample_rate or frame.num_channels != self.num_channels:
+                raise ValueError("wrapped TTS changed its output format")
+            chunks.append(bytes(frame.data))
+        pcm = b"".join(chunks)
+        os.makedirs(self._dir, exist_ok=True)
+        tmp = self._path(key) + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(pcm)
+        os.replace(tmp, self._path(key))
+        self._audio[key] = pcm
+
+    async def prerender(self):
+        """Render every pinned phrase that has no audio on disk yet"""
+        missing = [(key, text) for key, text in self._pinned.items() if self._load(key) is None]
+        for key, text in missing:
+            try:
+                await self._render(key, text)
+            except Exception as e:
+                logger.warning(f"failed to pre-render {text!r}: {e}")
+        if missing:
+            logger.info(f"pre-rendered {len(missing)} phrases")
+
+    async def aclose(self):
+        await self._inner.aclose()
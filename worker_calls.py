@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import time
+from typing import Optional
+
+from runtime_reports import RUNTIME_DIR
+
+
+logger = logging.getLogger("agent-supervisor")
+
+# one marker file per active call, per worker; written by job processes, read by the supervisor
+CALLS_DIR = os.path.join(RUNTIME_DIR, "calls")
+DEFAULT_BASE_PORT = 8081
+
+
+def _worker_calls_dir() -> Optional[str]:
+    worker_id = os.getenv("AGENT_WORKER_ID")
+    if worker_id is None:
+        # not started by the supervisor (e.g. `python agent2.py dev`)
+        return None
+    return os.path.join(CALLS_DIR, worker_id)
+
+
+def mark_call_started(room_name: str, phone_number: str = "") -> None:
+    """Record an active call for the worker this job belongs to"""
+    calls_dir = _worker_calls_dir()
+    if calls_dir is None:
+        return
+    try:
+        os.makedirs(calls_dir, exist_ok=True)
+        with open(os.path.join(calls_dir, f"{room_name}.json"), "w", encoding="utf-8") as f:
+            json.dump({"room": room_name, "phone": phone_number, "started_at": time.time(), "pid": os.getpid()}, f)
+    except OSError as e:
+        logger.warning(f"could not record active call {room_name}: {e}")
+
+
+def mark_call_finished(room_name: str) -> None:
+    """Remove the active call marker written by mark_call_started"""
+    calls_dir = _worker_calls_dir()
+    if calls_dir is None:
+        return
+    try:
+        os.remove(os.path.join(calls_dir, f"{room_name}.json"))
+    except FileNotFoundError:
+        pass
+
+
+def worker_http_port(default: int = DEFAULT_BASE_PORT) -> int:
+    """HTTP (health check) port assigned to this worker by the supervisor"""
+    return int(os.getenv("AGENT_HTTP_PORT", default))